@@ -1,115 +1,52 @@
-from flask import Flask, request, jsonify
-import re
-import joblib
+from flask import Flask, Blueprint, request, jsonify
 from typing import Dict, Any
-from transformers import pipeline
+from werkzeug.exceptions import HTTPException
+import data_store
+import duplicate_index
+from data_store import get_classifier, get_qa_pipeline
+from invoice_ingest import normalise_invoice
+from ocr_stream import InvoiceExtractor, OcrStream, correct_ocr_numbers, word_ngram_features
+import admission
+import instrumentation
+import profiling
+from instrumentation import stage
 
 app = Flask(__name__)
+bp = Blueprint('query_1', __name__)
 
 # Global variable to store the most recent summary
 current_summary = ""
 
-# Load the pre-trained model and vectorizer
-model = joblib.load('model/model.pkl')
-vectorizer = joblib.load('model/vectorizer.pkl')
-
-# Load the question-answering pipeline
-qa_pipeline = pipeline("question-answering")
-
-def preprocess_ocr_numbers(json_data):
-    # Function to correct common OCR errors in numbers
-    for block in json_data['textBlocks']:
-        text = block['blockText']
-        numbers_with_o = re.findall(r'\d+O\d*|\d*O\d+', text)
-        for num in numbers_with_o:
-            corrected_num = num.replace('O', '0')
-            text = text.replace(num, corrected_num)
-        block['blockText'] = text
-        
-        for line in block['lines']:
-            text = line['lineText']
-            numbers_with_o = re.findall(r'\d+O\d*|\d*O\d+', text)
-            for num in numbers_with_o:
-                corrected_num = num.replace('O', '0')
-                text = text.replace(num, corrected_num)
-            line['lineText'] = text
-    
-    return json_data
-
-def extract_invoice_details(json_data):
-    json_data = preprocess_ocr_numbers(json_data)
-    extracted_text = "\n".join([block['blockText'] for block in json_data['textBlocks']])
-
-    # Extract various fields using patterns
-    name_pattern = r'Issued to:\s*(.*)'
-    name_match = re.search(name_pattern, extracted_text)
-    name = name_match.group(1).strip() if name_match else 'Not Found'
-
-    vendor_pattern = r'vendor\s*:\s*(.*)'
-    vendor_match = re.search(vendor_pattern, extracted_text)
-    vendor = vendor_match.group(1).strip() if vendor_match else 'Not Found'
-
-    emp_id_pattern = r'Employee ld:\s*(\d+)'
-    employee_id_match = re.search(emp_id_pattern, extracted_text)
-    employee_id = employee_id_match.group(1) if employee_id_match else 'Not Found'
-
-    date_pattern = r'Date Issued:\s*(\d{1,2}-\d{1,2}-\d{4})'
-    date_match = re.search(date_pattern, extracted_text)
-    date = date_match.group(1) if date_match else 'Not Found'
-
-    # Total Amount Extraction
-    total_amount = 'Not Found'
-    grand_total_index = -1
-    
-    for i, block in enumerate(json_data['textBlocks']):
-        if 'GRAND TOTAL' in block['blockText']:
-            grand_total_index = i
-            break
-    
-    if grand_total_index != -1:
-        potential_totals = []
-        for i in range(grand_total_index + 1, len(json_data['textBlocks'])):
-            block_text = json_data['textBlocks'][i]['blockText']
-            cleaned_number = re.sub(r'[^\d]', '', block_text)
-            if cleaned_number.isdigit():
-                potential_totals.append(int(cleaned_number))
-        
-        if potential_totals:
-            total_amount = str(max(potential_totals))
-
-    invoice_id_pattern = r'(\d{6})'
-    invoice_id_match = re.search(invoice_id_pattern, extracted_text)
-    invoice_id = invoice_id_match.group(1) if invoice_id_match else 'Not Found'
-
-    location_pattern = r'Address:\s*(.*)'
-    location_match = re.search(location_pattern, extracted_text)
-    location = location_match.group(1).strip() if location_match else 'Not Found'
-
-    # Category mapping
-    category_mapping = {
-        'Food': ['chole', 'bhature', 'pizza', 'coffee', 'restaurant', 'meal', 'food'],
-        'Transport': ['taxi', 'flight', 'transportation', 'bus', 'train', 'travel'],
-        'Medicine': ['medical', 'hospital', 'clinic', 'medicine', 'doctor'],
-        'Electronics': ['phone', 'laptop', 'electronics', 'device', 'gadget', 'Macbook Air'],
-        'Miscellaneous': ['service', 'miscellaneous', 'other', 'misc']
-    }
-
-    expense_category = 'Miscellaneous'
-    for block in json_data['textBlocks']:
-        for category, keywords in category_mapping.items():
-            if any(keyword.lower() in block['blockText'].lower() for keyword in keywords):
-                expense_category = category
-                break
+# Category mapping
+CATEGORY_MAPPING = {
+    'Food': ['chole', 'bhature', 'pizza', 'coffee', 'restaurant', 'meal', 'food'],
+    'Transport': ['taxi', 'flight', 'transportation', 'bus', 'train', 'travel'],
+    'Medicine': ['medical', 'hospital', 'clinic', 'medicine', 'doctor'],
+    'Electronics': ['phone', 'laptop', 'electronics', 'device', 'gadget', 'Macbook Air'],
+    'Miscellaneous': ['service', 'miscellaneous', 'other', 'misc']
+}
+
+@stage('field_extraction')
+def extract_invoice_details(text_blocks, fingerprint=None):
+    # Blocks are corrected for OCR errors in numbers and matched one at a time
+    extractor = InvoiceExtractor(CATEGORY_MAPPING)
+    for block in text_blocks:
+        text = correct_ocr_numbers(block)['blockText']
+        extractor.feed(text)
+        if fingerprint is not None:
+            fingerprint.feed(text)
+    fields = extractor.fields()
+    total_amount = fields['total_amount']
 
     return {
-        'Vendor': vendor,
-        'Client Name': name,
-        'Employee Id': employee_id,
-        'Date Issued': date,
-        'Invoice ID': invoice_id,
+        'Vendor': fields['vendor'],
+        'Client Name': fields['name'],
+        'Employee Id': fields['employee_id'],
+        'Date Issued': fields['date'],
+        'Invoice ID': fields['invoice_id'],
         'Total Amount': '₹' + total_amount if total_amount != 'Not Found' else 'Not Found',
-        'Location': location,
-        'Expense Category': expense_category
+        'Location': fields['location'],
+        'Expense Category': fields['expense_category']
     
     }
 
@@ -126,55 +63,113 @@ def generate_summary(invoice_details: Dict[str, Any]) -> str:
     current_summary = summary.strip()
     return current_summary
 
+def find_duplicate(invoice_details, fingerprint):
+    """The stored invoice these details duplicate, or None; unlike /extract_invoice nothing is recorded"""
+    if not duplicate_index.enabled:
+        return None
+    try:
+        row = normalise_invoice(invoice_details)
+    except ValueError:
+        # Incomplete invoices are never stored
+        return None
+    vendor, _ = data_store.get_name_index('vendor').match(row['vendor'])
+    row['vendor'] = vendor or row['vendor']
+    with stage('duplicate_check'):
+        return data_store.get_duplicate_index().check(row, fingerprint, record=False)
+
 def classify_text(text_blocks):
     """Classify the text as either an Invoice or Contract"""
-    full_text = " ".join([block['blockText'] for block in text_blocks])
-    transformed_text = vectorizer.transform([full_text])
-    prediction = model.predict(transformed_text)
+    model, vectorizer = get_classifier()
+    # Vectorized block by block, with the same features as the blocks' joined text
+    with stage('vectorize'):
+        transformed_text = word_ngram_features(vectorizer, (block['blockText'] for block in text_blocks))
+    with stage('classify'):
+        prediction = model.predict(transformed_text)
     return prediction[0]
 
 def ask_general_question(text, question):
     # Function to answer questions using the transformers pipeline
-    result = qa_pipeline(question=question, context=text)
+    qa_pipeline = get_qa_pipeline()
+    with stage('qa_pipeline'):
+        result = qa_pipeline(question=question, context=text)
     return result['answer']
 
 # API Endpoints
-@app.route('/entity_recognition', methods=['POST'])
+@bp.route('/entity_recognition', methods=['POST'])
 def entity_recognition():
     try:
-        json_data = request.get_json()
-        extracted_data = extract_invoice_details(json_data)
+        ocr = OcrStream.from_request(request)
+        fingerprint = duplicate_index.TextFingerprint()
+        extracted_data = extract_invoice_details(ocr.blocks(), fingerprint)
+        if not ocr.has_blocks:
+            return jsonify({'error': 'Invalid input, expected "textBlocks" field in JSON.'}), 400
+        extracted_data['Duplicate'] = find_duplicate(extracted_data, fingerprint.value())
         return jsonify(extracted_data)
+    except HTTPException as e:
+        # Malformed or unsupported request bodies are the client's error
+        return jsonify({'error': e.description}), e.code
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/summarize', methods=['POST'])
+@bp.route('/summarize', methods=['POST'])
 def summarize():
     try:
         global current_summary
-        json_data = request.get_json()
-        extracted_data = extract_invoice_details(json_data)
+        ocr = OcrStream.from_request(request)
+        extracted_data = extract_invoice_details(ocr.blocks())
+        if not ocr.has_blocks:
+            return jsonify({'error': 'Invalid input, expected "textBlocks" field in JSON.'}), 400
         summary = generate_summary(extracted_data)
         return jsonify({'summary': summary})
+    except HTTPException as e:
+        # Malformed or unsupported request bodies are the client's error
+        return jsonify({'error': e.description}), e.code
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/classify', methods=['POST'])
+@bp.route('/classify', methods=['POST'])
 def classify():
     """API endpoint for document classification"""
     try:
-        data = request.get_json()
-        if 'textBlocks' not in data:
+        ocr = OcrStream.from_request(request)
+        classification = classify_text(ocr.blocks())
+        if not ocr.has_blocks:
             return jsonify({'error': 'Invalid input, expected "textBlocks" field in JSON.'}), 400
         
-        classification = classify_text(data['textBlocks'])
         return jsonify({
             'classification': classification
         })
+    except HTTPException as e:
+        # Malformed or unsupported request bodies are the client's error
+        return jsonify({'error': e.description}), e.code
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/query', methods=['POST'])
+@bp.route('/classify/train', methods=['POST'])
+def classify_train():
+    """API endpoint for adding labelled documents to the online classifier"""
+    if data_store.classifier_mode != 'online':
+        return jsonify({'error': 'Online training needs CLASSIFIER_MODE=online.'}), 400
+
+    data = request.get_json()
+    # Either one document as {"textBlocks": [...], "label": ...} or {"documents": [{"text": ..., "label": ...}]}
+    if 'documents' in data:
+        documents = data['documents']
+    elif 'textBlocks' in data and 'label' in data:
+        documents = [{'text': " ".join(block['blockText'] for block in data['textBlocks']), 'label': data['label']}]
+    else:
+        return jsonify({'error': 'Expected "documents", or "textBlocks" and "label".'}), 400
+
+    classifier, _ = get_classifier()
+    try:
+        with stage('partial_fit'):
+            fitted = classifier.learn([doc['text'] for doc in documents], [doc['label'] for doc in documents])
+    except (KeyError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+
+    return jsonify({'added': len(documents), 'fitted': fitted})
+
+@bp.route('/query', methods=['POST'])
 def query():
     """API endpoint for question answering"""
     try:
@@ -193,8 +188,16 @@ def query():
             'question': question,
             'answer': answer
         })
+    except HTTPException as e:
+        # Malformed or unsupported request bodies are the client's error
+        return jsonify({'error': e.description}), e.code
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+app.register_blueprint(bp)
+instrumentation.init_app(app)
+profiling.init_app(app)
+admission.init_app(app)
+
 if __name__ == '__main__':
     app.run(debug=True, port=5001, host='0.0.0.0')
@@ -1,17 +1,43 @@
-from flask import Flask, request, jsonify
-import pandas as pd
-import matplotlib
-matplotlib.use('Agg')  # Use a non-interactive backend for generating charts
-import matplotlib.pyplot as plt
-import io
-import base64
+from flask import Flask, Blueprint, request, jsonify
 
-app = Flask(__name__)
-
-# Load employee data
-df = pd.read_excel('Employee.xlsx')
+import charts
+from data_store import get_payroll
+import admission
+import instrumentation
+import profiling
+from result_cache import cached
+from single_flight import coalesce
 
-@app.route('/net_worth', methods=['POST'])
+app = Flask(__name__)
+bp = Blueprint('query_3', __name__)
+
+# Function to pick an employee's assets, liabilities and net worth from their payroll record
+def net_worth_summary(employee_id, pay):
+    return {
+        "employee_id": employee_id,
+        "total_assets": pay['total_assets'],
+        "total_liabilities": pay['total_liabilities'],
+        "net_worth": pay['net_worth']
+    }
+
+
+# Function to pick an employee's CTC, allowances and remaining balance from their payroll record
+def employee_summary(employee_id, pay):
+    return {
+        "employee_id": employee_id,
+        "total_ctc": pay['ctc'],
+        "base_salary": pay['base_package'],
+        "food_allowance": pay['food_allowance'],
+        "transport_allowance": pay['transport_allowance'],
+        "medical_allowance": pay['medical_allowance'],
+        "electronics_allowance": pay['electronics_allowance'],
+        "miscellaneous_allowance": pay['misc_allowance'],
+        "monthly_emi": pay['monthly_emi'],
+        "remaining_balance": pay['remaining_balance']
+    }
+
+
+@bp.route('/net_worth', methods=['POST'])
 def get_net_worth():
     try:
         # Get JSON data from request
@@ -22,41 +48,14 @@ def get_net_worth():
         if not employee_id:
             return jsonify({"error": "Employee ID not provided"}), 400
 
-        # Filter for employee with the provided emp_id
-        employee_data = df[df['emp_id'] == employee_id]
+        # Look up the employee's precomputed payroll record
+        pay = get_payroll().record(employee_id)
 
         # Check if employee data exists
-        if employee_data.empty:
+        if pay is None:
             return jsonify({"error": "Employee not found"}), 404
         
-        employee_data = employee_data.iloc[0]  # Get the first (and should be only) row
-        
-        # Extract relevant data
-        base_salary = int(employee_data['base_package'])
-        food_allowance = int(employee_data['food_allowance'])
-        transport_allowance = int(employee_data['transport_allowance'])
-        medical_allowance = int(employee_data['medical_allowance'])
-        electronics_allowance = int(employee_data['electronics_allowance'])
-        misc_allowance = int(employee_data['misc_allowance'])
-        monthly_emi = int(employee_data['monthly_emi'])
-        debt_budget = int(employee_data['debt_budget'])
-
-        # Calculate total assets and liabilities
-        total_assets = base_salary + food_allowance + transport_allowance + \
-                       medical_allowance + electronics_allowance + \
-                       misc_allowance
-        total_liabilities = monthly_emi + debt_budget
-
-        # Calculate net worth
-        net_worth = total_assets - total_liabilities
-
-        # Prepare response data
-        response_data = {
-            "employee_id": employee_id,
-            "total_assets": total_assets,
-            "total_liabilities": total_liabilities,
-            "net_worth": net_worth
-        }
+        response_data = net_worth_summary(employee_id, pay)
 
         return jsonify(response_data), 200
 
@@ -64,7 +63,7 @@ def get_net_worth():
         return jsonify({"error": str(e)}), 400
 
 
-@app.route('/employee', methods=['POST'])
+@bp.route('/employee', methods=['POST'])
 def get_employee_details():
     try:
         # Get JSON data from request
@@ -75,43 +74,14 @@ def get_employee_details():
         if not employee_id:
             return jsonify({"error": "Employee ID not provided"}), 400
 
-        # Filter for employee with the provided emp_id
-        employee_data = df[df['emp_id'] == employee_id]
+        # Look up the employee's precomputed payroll record
+        pay = get_payroll().record(employee_id)
 
         # Check if employee data exists
-        if employee_data.empty:
+        if pay is None:
             return jsonify({"error": "Employee not found"}), 404
         
-        employee_data = employee_data.iloc[0]  # Get the first (and should be only) row
-        
-        # Extract relevant data and convert to standard Python types
-        ctc = int(employee_data['ctc'])
-        base_salary = int(employee_data['base_package'])
-        food_allowance = int(employee_data['food_allowance'])
-        transport_allowance = int(employee_data['transport_allowance'])
-        medical_allowance = int(employee_data['medical_allowance'])
-        electronics_allowance = int(employee_data['electronics_allowance'])
-        misc_allowance = int(employee_data['misc_allowance'])
-        monthly_emi = int(employee_data['monthly_emi'])
-
-        # Calculate total allowances
-        total_allowances = (food_allowance + transport_allowance + 
-                            medical_allowance + electronics_allowance + 
-                            misc_allowance)
-
-        # Prepare response data
-        response_data = {
-            "employee_id": employee_id,
-            "total_ctc": ctc,
-            "base_salary": base_salary,
-            "food_allowance": food_allowance,
-            "transport_allowance": transport_allowance,
-            "medical_allowance": medical_allowance,
-            "electronics_allowance": electronics_allowance,
-            "miscellaneous_allowance": misc_allowance,
-            "monthly_emi": monthly_emi,
-            "remaining_balance": base_salary - (total_allowances + monthly_emi)
-        }
+        response_data = employee_summary(employee_id, pay)
 
         return jsonify(response_data), 200
 
@@ -119,7 +89,49 @@ def get_employee_details():
         return jsonify({"error": str(e)}), 400
 
 
-@app.route('/ctc_chart', methods=['POST'])
+@bp.route('/payroll', methods=['POST'])
+def get_payroll_bulk():
+    try:
+        # Get JSON data from request
+        data = request.get_json()
+        employee_ids = data.get('employee_ids')
+        department = data.get('department')
+
+        if employee_ids is not None and not isinstance(employee_ids, list):
+            return jsonify({"error": "employee_ids must be a list"}), 400
+
+        # Read the requested rows of the precomputed payroll table in one go
+        employees, missing = get_payroll().records(employee_ids, department)
+
+        return jsonify({"employees": employees, "missing": missing}), 200
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+
+# Function to render the CTC breakdown pie chart of an employee as base64 PNG, or None if not found
+@cached
+@coalesce
+def create_ctc_chart(employee_id):
+    # Look up the employee's precomputed payroll record
+    pay = get_payroll().record(employee_id)
+    if pay is None:
+        return None
+    return render_ctc_chart(pay)
+
+
+# Function to render the CTC breakdown pie chart of a payroll record as base64 PNG
+def render_ctc_chart(pay):
+    # Amounts for the pie chart of CTC breakdown, in the order of charts.CTC_LABELS
+    values = [pay[column] for column in ['base_package', 'food_allowance', 'transport_allowance',
+                                         'medical_allowance', 'electronics_allowance',
+                                         'misc_allowance', 'monthly_emi']]
+
+    # Draw it on a template figure that already has the legend and layout
+    return charts.render(charts.CtcChart, values)
+
+
+@bp.route('/ctc_chart', methods=['POST'])
 def get_ctc_chart():
     try:
         # Get JSON data from request
@@ -130,56 +142,12 @@ def get_ctc_chart():
         if not employee_id:
             return jsonify({"error": "Employee ID not provided"}), 400
 
-        # Filter for employee with the provided emp_id
-        employee_data = df[df['emp_id'] == employee_id]
+        # Render the chart; identical concurrent requests share one rendering
+        image_base64 = create_ctc_chart(employee_id)
 
         # Check if employee data exists
-        if employee_data.empty:
+        if image_base64 is None:
             return jsonify({"error": "Employee not found"}), 404
-        
-        employee_data = employee_data.iloc[0]  # Get the first (and should be only) row
-
-        # Extract relevant data for employee and convert to standard Python types
-        ctc = int(employee_data['ctc'])
-        base_salary = int(employee_data['base_package'])
-        food_allowance = int(employee_data['food_allowance'])
-        transport_allowance = int(employee_data['transport_allowance'])
-        medical_allowance = int(employee_data['medical_allowance'])
-        electronics_allowance = int(employee_data['electronics_allowance'])
-        misc_allowance = int(employee_data['misc_allowance'])
-        monthly_emi = int(employee_data['monthly_emi'])
-
-        # Data for the pie chart of CTC breakdown
-        labels = ['Base Salary', 'Food Allowance', 'Transport Allowance', 
-                  'Medical Allowance', 'Electronics Allowance', 
-                  'Miscellaneous Allowance', 'Monthly EMI']
-        values = [base_salary, food_allowance, transport_allowance, 
-                  medical_allowance, electronics_allowance, 
-                  misc_allowance, monthly_emi]
-
-        # Create pie chart in memory
-        plt.figure(figsize=(10, 8))
-        plt.pie(values, startangle=90, 
-                colors=['#66b3ff', '#ff9999', '#99ff99', 
-                        '#ffcc99', '#c2c2f0', '#ffb3e6', 
-                        '#ff6666'],
-                explode=[0.1] * len(labels)
-                )  # Adding labels directly to the pie chart
-
-        # Add legend outside the chart
-        plt.legend(labels, loc='upper left', bbox_to_anchor=(1, 1), fontsize='large')
-
-        plt.axis('equal')  # Equal aspect ratio ensures the pie is drawn as a circle.
-
-        # Save the pie chart to a BytesIO object
-        buf = io.BytesIO()
-        plt.tight_layout()  # Adjust layout
-        plt.savefig(buf, format='png')
-        plt.close()  # Close the plot to free memory
-        buf.seek(0)
-
-        # Encode the image to base64
-        image_base64 = base64.b64encode(buf.read()).decode('utf-8')
 
         # Return the Base64 image in JSON format
         return jsonify({"employee_id": employee_id, "ctc_chart": image_base64}), 200
@@ -187,5 +155,10 @@ def get_ctc_chart():
     except Exception as e:
         return jsonify({"error": str(e)}), 400
 
+app.register_blueprint(bp)
+instrumentation.init_app(app)
+profiling.init_app(app)
+admission.init_app(app)
+
 if __name__ == '__main__':
     app.run(debug=True,host='0.0.0.0',port=8000)
\ No newline at end of file
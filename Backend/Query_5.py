@@ -1,33 +1,38 @@
-import pandas as pd
 from datetime import datetime, timedelta
-from flask import Flask, request, jsonify
-import matplotlib.pyplot as plt
-import matplotlib.table as tbl
-import io
-import base64
-import re
+from flask import Flask, Blueprint, Response, current_app, request, jsonify, stream_with_context
+import charts
+import data_store
+import duplicate_index
+import expense_anomaly
+from data_store import find_employee, get_time_index, take_invoices, update_employee
+from invoice_ingest import normalise_invoice
+from ocr_stream import InvoiceExtractor, OcrStream, correct_ocr_numbers
+import invoice_export
+import out_of_core
+import pandas as pd
+import admission
+import instrumentation
+import profiling
+from instrumentation import registry, stage
 
 app = Flask(__name__)
+bp = Blueprint('query_5', __name__)
 
-# Function to get invoices for the last month
-def get_invoices_for_last_month(employee_id):
-    # Load the invoice data
-    df = pd.read_csv('invoice_database.csv')
-
-    # Convert the 'date' column to datetime format
-    df['date'] = pd.to_datetime(df['date'], format='%d-%m-%Y')
-
+# Function to get the first and last day of last month
+def last_month_range():
     # Get the current date and calculate the first and last day of last month
     today = datetime.now()
     first_day_last_month = (today.replace(day=1) - timedelta(days=1)).replace(day=1)
     last_day_last_month = today.replace(day=1) - timedelta(days=1)
+    return first_day_last_month, last_day_last_month
+
+# Function to get invoices for the last month
+def get_invoices_for_last_month(employee_id):
+    first_day_last_month, last_day_last_month = last_month_range()
 
-    # Filter the DataFrame for the specified employee_id and date range
-    filtered_invoices = df[
-        (df['employee_id'] == employee_id) &
-        (df['date'] >= first_day_last_month) &
-        (df['date'] <= last_day_last_month)
-    ]
+    # Look up the employee's invoices in that date range in their time index
+    rows = get_time_index(employee_id).window_rows(first_day_last_month, last_day_last_month)
+    filtered_invoices = take_invoices(rows)
 
     # Format the 'date' column to remove time
     if not filtered_invoices.empty:
@@ -36,7 +41,7 @@ def get_invoices_for_last_month(employee_id):
     return filtered_invoices
 
 # API to plot invoices table
-@app.route('/invoices', methods=['POST'])
+@bp.route('/invoices', methods=['POST'])
 def plot_invoices_table():
     # Get JSON data from request
     data = request.get_json()
@@ -49,51 +54,26 @@ def plot_invoices_table():
     if invoices.empty:
         return jsonify({"error": f"No invoices found for employee ID {employee_id} in the last month."}), 404
 
-    # Create a figure and a set of subplots
-    fig, ax = plt.subplots(figsize=(10, 5))  # Adjust the size as needed
-    ax.axis('tight')
-    ax.axis('off')
-
-    # Add title and employee ID
-    title = f'Transaction List for Employee ID: {employee_id}'
-    plt.title(title, fontsize=16, fontweight='bold')
-
-    # Create the table
-    table_data = invoices[['invoice_id', 'amount', 'date', 'location', 'type', 'vendor']].values
-    columns = ['Invoice ID', 'Amount', 'Date', 'Location', 'Type', 'Vendor']
-    
-    table = tbl.table(ax, cellText=table_data, colLabels=columns, cellLoc='center', loc='center')
-
-    # Adjust the layout
-    table.auto_set_font_size(False)
-    table.set_fontsize(12)
-    table.scale(1.2, 1.2)  # Scale the table for better visibility
-
-    # Save the plot to a BytesIO object
-    img = io.BytesIO()
-    plt.savefig(img, format='png', bbox_inches='tight', dpi=300)
-    plt.close()
-    img.seek(0)
+    # Return the image in base64 format
+    return jsonify({"image": render_invoices_table(employee_id, invoices)}), 200
 
-    # Encode the image to base64
-    img_base64 = base64.b64encode(img.getvalue()).decode('utf-8')
+# Function to render an employee's invoices as a table image (a base64 PNG data URL)
+def render_invoices_table(employee_id, invoices):
+    # Draw the table on a template figure and encode it as base64
+    img_base64 = charts.render(charts.InvoiceTable, employee_id, invoices)
 
-    # Return the image in base64 format
-    return jsonify({"image": f"data:image/png;base64,{img_base64}"}), 200
+    return f"data:image/png;base64,{img_base64}"
 
 # Function to manage debt for an employee
 def manage_debt(emp_id, debt_amount):
-    # Load employee data
-    df = pd.read_excel('Employee.xlsx')
-
     # Check if employee exists
-    employee = df[df['emp_id'] == emp_id]
-    if employee.empty:
+    employee = find_employee(emp_id)
+    if employee is None:
         return {"error": "Employee ID not found."}
 
     # Get current values and convert to native Python types
-    current_debt_budget = int(employee['debt_budget'].values[0])
-    current_monthly_emi = float(employee['monthly_emi'].values[0])
+    current_debt_budget = int(employee['debt_budget'])
+    current_monthly_emi = float(employee['monthly_emi'])
 
     # Check if debt can be taken
     if debt_amount > current_debt_budget:
@@ -109,12 +89,8 @@ def manage_debt(emp_id, debt_amount):
     # Calculate new EMI
     new_monthly_emi = (current_monthly_emi * 12 + debt_amount) / 12
 
-    # Update DataFrame
-    df.loc[df['emp_id'] == emp_id, 'debt_budget'] = new_debt_budget
-    df.loc[df['emp_id'] == emp_id, 'monthly_emi'] = new_monthly_emi
-
-    # Save the updated data back to Excel
-    df.to_excel('Employee.xlsx', index=False)
+    # Update the shared employee data and save it back to Excel
+    update_employee(emp_id, debt_budget=new_debt_budget, monthly_emi=new_monthly_emi)
 
     # Prepare final changes string
     changes = {
@@ -128,7 +104,7 @@ def manage_debt(emp_id, debt_amount):
     return changes
 
 # API to manage debt
-@app.route('/manage_debt', methods=['POST'])
+@bp.route('/manage_debt', methods=['POST'])
 def debt_management():
     data = request.json
     emp_id = data.get('emp_id')
@@ -144,127 +120,172 @@ def debt_management():
 
     return jsonify(result), 200
 
-# Function to preprocess OCR text blocks
-def preprocess_ocr_numbers(json_data):
-    """Preprocess all text blocks to correct common OCR errors in numbers"""
-    for block in json_data['textBlocks']:
-        # Replace 'O' with '0' when it appears to be part of a number
-        text = block['blockText']
-        # Find all numbers that contain 'O'
-        numbers_with_o = re.findall(r'\d+O\d*|\d*O\d+', text)
-        for num in numbers_with_o:
-            corrected_num = num.replace('O', '0')
-            text = text.replace(num, corrected_num)
-        block['blockText'] = text
-        
-        # Do the same for each line
-        for line in block['lines']:
-            text = line['lineText']
-            numbers_with_o = re.findall(r'\d+O\d*|\d*O\d+', text)
-            for num in numbers_with_o:
-                corrected_num = num.replace('O', '0')
-                text = text.replace(num, corrected_num)
-            line['lineText'] = text
-    
-    return json_data
-
-# Function to extract invoice details from OCR text
-def extract_invoice_details(json_data):
-    # Preprocess the JSON data to correct OCR errors in numbers
-    json_data = preprocess_ocr_numbers(json_data)
-    
-    extracted_text = "\n".join([block['blockText'] for block in json_data['textBlocks']])
-
-    # Extract the "Issued to" or relevant name
-    name_pattern = r'Issued to:\s*(.*)'
-    name_match = re.search(name_pattern, extracted_text)
-    name = name_match.group(1).strip() if name_match else 'Not Found'
-
-    # Extract the "vendor"
-    vendor_pattern = r'vendor\s*:\s*(.*)'
-    vendor_match = re.search(vendor_pattern, extracted_text)
-    vendor = vendor_match.group(1).strip() if vendor_match else 'Not Found'
-
-    # Extract Employee Id
-    emp_id_pattern = r'Employee ld:\s*(\d+)'
-    employee_id_match = re.search(emp_id_pattern, extracted_text)
-    employee_id = employee_id_match.group(1) if employee_id_match else 'Not Found'
-
-    # Extract Date Issued
-    date_pattern = r'Date Issued:\s*(\d{1,2}-\d{1,2}-\d{4})'
-    date_match = re.search(date_pattern, extracted_text)
-    date = date_match.group(1) if date_match else 'Not Found'
-
-    # Total Amount Extraction
-    total_amount = 'Not Found'
-    grand_total_index = -1
-    
-    # First, find the index of the GRAND TOTAL text
-    for i, block in enumerate(json_data['textBlocks']):
-        if 'GRAND TOTAL' in block['blockText']:
-            grand_total_index = i
-            break
-    
-    if grand_total_index != -1:
-        # Look at blocks after GRAND TOTAL
-        potential_totals = []
-        for i in range(grand_total_index + 1, len(json_data['textBlocks'])):
-            block_text = json_data['textBlocks'][i]['blockText']
-            # Clean up the text and check if it's a number
-            cleaned_number = re.sub(r'[^\d]', '', block_text)
-            if cleaned_number.isdigit():
-                potential_totals.append(int(cleaned_number))
-        
-        # If we found any numbers after GRAND TOTAL, use the largest one
-        if potential_totals:
-            total_amount = str(max(potential_totals))
-
-    # Extract Invoice ID (6-digit pattern)
-    invoice_id_pattern = r'(\d{6})'
-    invoice_id_match = re.search(invoice_id_pattern, extracted_text)
-    invoice_id = invoice_id_match.group(1) if invoice_id_match else 'Not Found'
-
-    # Extract location (Address)
-    location_pattern = r'Address:\s*(.*)'
-    location_match = re.search(location_pattern, extracted_text)
-    location = location_match.group(1).strip() if location_match else 'Not Found'
-
-    # Category mapping
-    category_mapping = {
-        'Food': ['chole', 'bhature', 'pizza', 'coffee', 'restaurant', 'meal', 'food', 'Panner Pizza', 'Choco Lava'],
-        'Transport': ['taxi', 'flight', 'transportation', 'bus', 'train', 'travel'],
-        'Medicine': ['medical', 'hospital', 'clinic', 'medicine', 'doctor', 'Betnovate-N', 'Avomine'],
-        'Electronics': ['phone', 'laptop', 'electronics', 'device', 'gadget', 'Macbook Air M3', 'Iphone 16'],
-        'Miscellaneous': ['service', 'miscellaneous', 'other', 'misc']
-    }
-
-    # Categorize the overall expense
-    expense_category = 'Miscellaneous'
-    for block in json_data['textBlocks']:
-        for category, keywords in category_mapping.items():
-            if any(keyword.lower() in block['blockText'].lower() for keyword in keywords):
-                expense_category = category
-                break
+# Category mapping
+CATEGORY_MAPPING = {
+    'Food': ['chole', 'bhature', 'pizza', 'coffee', 'restaurant', 'meal', 'food', 'Panner Pizza', 'Choco Lava'],
+    'Transport': ['taxi', 'flight', 'transportation', 'bus', 'train', 'travel'],
+    'Medicine': ['medical', 'hospital', 'clinic', 'medicine', 'doctor', 'Betnovate-N', 'Avomine'],
+    'Electronics': ['phone', 'laptop', 'electronics', 'device', 'gadget', 'Macbook Air M3', 'Iphone 16'],
+    'Miscellaneous': ['service', 'miscellaneous', 'other', 'misc']
+}
+
+# Function to extract invoice details from OCR text blocks, read one block at a time
+def extract_invoice_details(text_blocks, fingerprint=None):
+    extractor = InvoiceExtractor(CATEGORY_MAPPING)
+    for block in text_blocks:
+        # Correct OCR errors in numbers before matching
+        text = correct_ocr_numbers(block)['blockText']
+        extractor.feed(text)
+        if fingerprint is not None:
+            fingerprint.feed(text)
+    fields = extractor.fields()
+    total_amount = fields['total_amount']
 
     # Summarize the extracted information
     summary = {
-        'employee_id': employee_id,
+        'employee_id': fields['employee_id'],
         'amount': '₹' + total_amount if total_amount != 'Not Found' else 'Not Found',
-        'date': date,
-        'location': location,
-        'invoice_id': invoice_id,
-        'Vendor': vendor,
-        'type': expense_category
+        'date': fields['date'],
+        'location': fields['location'],
+        'invoice_id': fields['invoice_id'],
+        'Vendor': fields['vendor'],
+        'type': fields['expense_category']
     }
 
     return summary
 
+registry.describe('mintbolt_name_match_total', 'counter',
+                  'Vendor and location names of extracted invoices by column and outcome (exact, matched, new).')
+
+# Function to replace OCR-read vendor and location names with the canonical names already in the invoice database
+def canonicalise_names(row):
+    for column in ('vendor', 'location'):
+        name, score, outcome = data_store.get_name_index(column).canonical(row[column])
+        if outcome == 'matched':
+            current_app.logger.info(f"{column} {row[column]!r} read as {name!r} (score {score})")
+        if instrumentation.enabled:
+            registry.inc('mintbolt_name_match_total', (('column', column), ('outcome', outcome)))
+        row[column] = name
+    return row
+
+# Function to store a new invoice, or return which stored invoice it duplicates
+def store_invoice(row, fingerprint):
+    index = data_store.get_duplicate_index() if duplicate_index.enabled else None
+    if index is not None:
+        with stage('duplicate_check'):
+            duplicate = index.check(row, fingerprint)
+        if duplicate is not None:
+            return duplicate
+    try:
+        with stage('wal_append'):
+            data_store.append_invoice(row)
+    except Exception:
+        # Not stored after all, so a retry must not be taken for a duplicate
+        if index is not None:
+            index.forget(row, fingerprint)
+        raise
+    return None
+
+registry.describe('mintbolt_expense_anomaly_total', 'counter',
+                  'Stored invoices flagged as unusually large, by the grouping that flagged them (type, vendor).')
+
+# Function to score a new invoice against the employee's usual spend for its type and vendor
+def score_anomaly(row):
+    if not expense_anomaly.enabled:
+        return None
+    with stage('anomaly_score'):
+        return data_store.get_anomaly_scorer().score(row)
+
 # API to extract invoice details from OCR
-@app.route('/extract_invoice', methods=['POST'])
+@bp.route('/extract_invoice', methods=['POST'])
 def extract_invoice():
-    json_data = request.get_json()
-    extracted_data = extract_invoice_details(json_data)
+    # Read the OCR document one text block at a time instead of parsing it whole
+    ocr = OcrStream.from_request(request)
+    fingerprint = duplicate_index.TextFingerprint()
+    with stage('field_extraction'):
+        extracted_data = extract_invoice_details(ocr.blocks(), fingerprint)
+    if not ocr.has_blocks:
+        return jsonify({'error': 'Invalid input, expected "textBlocks" field in JSON.'}), 400
+    duplicate = None
+    anomaly = None
+
+    # Persist the invoice so the analytics services pick it up, unless it is already stored
+    try:
+        row = normalise_invoice(extracted_data)
+        with stage('name_match'):
+            canonicalise_names(row)
+        # Scored before it is stored, so it is compared with the invoices before it only
+        anomaly = score_anomaly(row)
+        duplicate = store_invoice(row, fingerprint.value())
+        if duplicate is not None:
+            current_app.logger.info(f"Invoice not persisted: {duplicate['match']} duplicate of invoice {duplicate['invoice_id']}")
+            anomaly = None
+        elif anomaly is not None and instrumentation.enabled:
+            registry.inc('mintbolt_expense_anomaly_total', (('by', anomaly['by']),))
+    except ValueError as e:
+        current_app.logger.warning(f"Invoice not persisted: {e}")
+    except OSError as e:
+        # The extraction itself succeeded; only writing the WAL failed (disk full, lock error, ...)
+        current_app.logger.error(f"Invoice not persisted: could not write the invoice log: {e}")
+
+    extracted_data['duplicate'] = duplicate
+    extracted_data['anomaly'] = anomaly
     return jsonify(extracted_data)
 
+# API to report ingest throughput and WAL state, and how quickly new invoices reach this process's invoice table
+@bp.route('/ingest_stats', methods=['GET'])
+def ingest_stats():
+    stats = data_store.get_invoice_log().stats.snapshot()
+    # Out of core there is no in-memory table following the WAL
+    if not out_of_core.enabled:
+        applied = data_store.ingest_status()
+        stats['applied'] = applied['applied']
+        stats['visibility_lag_ms'] = applied['visibility_lag_ms']
+        stats['invoice_table'] = data_store.invoice_memory()
+    return jsonify(stats), 200
+
+# API to list recently stored invoices that are unusually large for the employee
+@bp.route('/anomalies', methods=['GET'])
+def anomalies():
+    if not expense_anomaly.enabled:
+        return jsonify({"error": "Anomaly scoring is turned off."}), 404
+    employee_id = request.args.get('employee_id', type=int)
+    limit = request.args.get('limit', 100, type=int)
+    return jsonify({
+        "threshold": expense_anomaly.z_threshold,
+        "anomalies": data_store.get_anomaly_scorer().recent(employee_id, limit)
+    }), 200
+
+# API to export invoices as CSV, streamed and optionally gzipped
+@bp.route('/export_invoices', methods=['GET'])
+def export_invoices():
+    args = request.args
+    try:
+        filters = invoice_export.ExportFilters(
+            employee_id=args.get('employee_id', type=int),
+            department=args.get('department'),
+            start_date=pd.to_datetime(args['start_date']) if 'start_date' in args else None,
+            end_date=pd.to_datetime(args['end_date']) if 'end_date' in args else None,
+            expense_type=args.get('type'),
+            vendor=args.get('vendor'),
+        )
+    except ValueError as e:
+        return jsonify({"error": f"Invalid date: {str(e)}"}), 400
+
+    body = invoice_export.iter_csv(filters)
+    headers = {'Content-Disposition': 'attachment; filename=invoices.csv', 'Vary': 'Accept-Encoding'}
+
+    # Compress when the client accepts gzip, unless it asked for gzip=0
+    if args.get('gzip', '1') != '0' and 'gzip' in request.accept_encodings:
+        body = invoice_export.gzip_stream(body)
+        headers['Content-Encoding'] = 'gzip'
+
+    return Response(stream_with_context(body), mimetype='text/csv', headers=headers)
+
+app.register_blueprint(bp)
+instrumentation.init_app(app)
+profiling.init_app(app)
+admission.init_app(app)
+
 if __name__ == '__main__':
     app.run(debug=True, port=5000, host='0.0.0.0')
\ No newline at end of file
@@ -0,0 +1,176 @@
+import math
+import os
+import threading
+import time
+
+from flask import g, jsonify, request
+
+import instrumentation
+from instrumentation import registry, stage
+
+# Admission control for the slow endpoints.
+#
+# Each heavy route belongs to a class (forecasts, the QA model, Gemini,
+# chart rendering) that runs at most `concurrency` requests at a time and
+# queues at most `queue` more for up to `timeout` seconds. A request that
+# finds the queue full, or is still queued at the timeout, is answered at
+# once with 503 and a Retry-After estimated from how fast the class is
+# draining. Heavy requests also share ADMISSION_HEAVY_SLOTS slots (running
+# or queued) per process; keep it below the server's threads per worker so
+# cheap routes such as /employee always find a free thread. Routes without a
+# class are never limited.
+#
+# A class is configured with ADMISSION_<CLASS>=concurrency:queue:timeout,
+# e.g. ADMISSION_LLM=4:4:10. Set ADMISSION_ENABLED=0 to turn it all off.
+
+enabled = os.environ.get('ADMISSION_ENABLED', '1') != '0'
+heavy_slots = int(os.environ.get('ADMISSION_HEAVY_SLOTS', '3'))
+
+ROUTE_CLASSES = {
+    '/api/ARIMA': 'forecast',
+    '/api/Monthly_Spending': 'forecast',
+    '/api/Yearly_Spending': 'forecast',
+    '/api/Category_Spending': 'forecast',
+    '/api/forecast': 'forecast',
+    '/query': 'qa',
+    '/chat': 'llm',
+    '/get_expenses_summary': 'llm',
+    '/invoices': 'render',
+    '/api/barplot': 'render',
+    '/api/piechart': 'render',
+    '/api/heatmap': 'render',
+    '/ctc_chart': 'render',
+    '/dashboard': 'render',
+}
+
+# concurrency, queue, timeout in seconds. CPU-bound classes run one request
+# at a time per process (they hold the GIL); Gemini calls mostly wait on I/O.
+DEFAULT_LIMITS = {
+    'forecast': '1:2:2',
+    'qa': '1:1:2',
+    'llm': '2:2:5',
+    'render': '1:2:2',
+}
+
+registry.describe('mintbolt_admission_total', 'counter',
+                  'Requests to limited routes by class and outcome (admitted, queued, rejected_full, rejected_timeout).')
+
+
+class EndpointClass:
+    """Concurrency limit with a bounded, timed wait queue"""
+
+    def __init__(self, name, concurrency, queue, timeout):
+        self.name = name
+        self.concurrency = concurrency
+        self.queue = queue
+        self.timeout = timeout
+        self.running = 0
+        self.waiting = 0
+        # Moving average of how long an admitted request runs
+        self.service_time = 1.0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        """'admitted', 'queued' (admitted after waiting), 'rejected_full' or 'rejected_timeout'"""
+        with self._cond:
+            if self.running < self.concurrency and not self.waiting:
+                self.running += 1
+                return 'admitted'
+            if self.waiting >= self.queue:
+                return 'rejected_full'
+            self.waiting += 1
+            deadline = time.monotonic() + self.timeout
+            try:
+                while self.running >= self.concurrency:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return 'rejected_timeout'
+                    self._cond.wait(remaining)
+                self.running += 1
+                return 'queued'
+            finally:
+                self.waiting -= 1
+
+    def release(self, seconds):
+        with self._cond:
+            self.running -= 1
+            self.service_time += 0.2 * (seconds - self.service_time)
+            self._cond.notify()
+
+    def retry_after(self):
+        """Seconds until the requests ahead of a new one should have drained"""
+        with self._cond:
+            backlog = self.running + self.waiting
+        return max(1, math.ceil(self.service_time * backlog / self.concurrency))
+
+
+def _parse_limits(name):
+    concurrency, queue, timeout = os.environ.get(f'ADMISSION_{name.upper()}', DEFAULT_LIMITS[name]).split(':')
+    return EndpointClass(name, int(concurrency), int(queue), float(timeout))
+
+
+classes = {name: _parse_limits(name) for name in DEFAULT_LIMITS}
+
+_heavy_lock = threading.Lock()
+_heavy_in_use = 0
+
+
+def _take_heavy_slot():
+    global _heavy_in_use
+    with _heavy_lock:
+        if _heavy_in_use >= heavy_slots:
+            return False
+        _heavy_in_use += 1
+        return True
+
+
+def _return_heavy_slot():
+    global _heavy_in_use
+    with _heavy_lock:
+        _heavy_in_use -= 1
+
+
+def _reject(endpoint_class, outcome):
+    _count(endpoint_class, outcome)
+    response = jsonify({"error": f"Too many {endpoint_class.name} requests in progress, try again shortly."})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(endpoint_class.retry_after())
+    return response
+
+
+def _count(endpoint_class, outcome):
+    if instrumentation.enabled:
+        registry.inc('mintbolt_admission_total', (('class', endpoint_class.name), ('outcome', outcome)))
+
+
+def _before_request():
+    name = ROUTE_CLASSES.get(request.url_rule.rule if request.url_rule else None)
+    if name is None:
+        return None
+    endpoint_class = classes[name]
+    if not _take_heavy_slot():
+        return _reject(endpoint_class, 'rejected_full')
+
+    with stage('admission_wait'):
+        outcome = endpoint_class.acquire()
+    if outcome.startswith('rejected'):
+        _return_heavy_slot()
+        return _reject(endpoint_class, outcome)
+    _count(endpoint_class, outcome)
+    g.admission = (endpoint_class, time.perf_counter())
+    return None
+
+
+def _teardown_request(exc):
+    admitted = g.pop('admission', None)
+    if admitted is not None:
+        endpoint_class, start = admitted
+        endpoint_class.release(time.perf_counter() - start)
+        _return_heavy_slot()
+
+
+def init_app(app):
+    """Limit the heavy routes of a Flask app"""
+    if enabled:
+        app.before_request(_before_request)
+        app.teardown_request(_teardown_request)
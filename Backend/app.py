@@ -0,0 +1,37 @@
+import os
+import matplotlib
+matplotlib.use('Agg')  # Charts are rendered off-screen from worker threads
+from flask import Flask
+
+import admission
+import instrumentation
+import precompute
+import profiling
+
+import Query_1
+import Query_2
+import Query_3
+import Query_4
+import Query_5
+import dashboard
+
+# Single entry point: every service's routes mounted on one app that shares
+# the data and models loaded by data_store
+
+
+def create_app():
+    app = Flask(__name__)
+    for service in (Query_1, Query_2, Query_3, Query_4, Query_5, dashboard):
+        app.register_blueprint(service.bp)
+    instrumentation.init_app(app)
+    profiling.init_app(app)
+    precompute.init_app(app)
+    admission.init_app(app)
+    return app
+
+
+app = create_app()
+
+if __name__ == '__main__':
+    # Development server only; production runs under gunicorn (see gunicorn.conf.py)
+    app.run(host='0.0.0.0', port=int(os.environ.get('PORT', 5000)))
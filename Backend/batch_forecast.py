@@ -0,0 +1,90 @@
+import numpy as np
+from scipy.stats import norm
+
+# ARIMA forecasts for many series at once.
+#
+# The forecast routes fit one statsmodels ARIMA(1,1,1) per series, a maximum
+# likelihood search that runs the Kalman filter over the history many times.
+# To forecast every expense type of an employee in one go, BatchArima takes
+# the series as the rows of one matrix (type x month) and estimates the same
+# model for all rows together. The conditional sum of squares is computed for
+# every row and a grid of (ar, ma) values in one recursion over the periods,
+# then again on a finer grid around each row's best point. Forecasts and their
+# variances follow in closed form from the model's psi weights, including the
+# variance of a total over several periods, whose errors are correlated.
+#
+# Conditional least squares gives estimates close to statsmodels' exact
+# likelihood, but not identical to them.
+
+COARSE_GRID = np.linspace(-0.95, 0.95, 39)
+FINE_STEPS = np.linspace(-0.05, 0.05, 21)
+# Invertible and stationary: the recursions and psi weights stay bounded
+PARAMETER_LIMIT = 0.99
+
+
+def _residuals(diffs, ar, ma):
+    """Sum of squared residuals and the last residual of each ARMA(1,1) fit
+
+    diffs is (series, periods); ar and ma are (series, candidates). The first
+    difference is conditioned on, with a residual of zero before it.
+    """
+    residual = np.zeros(ar.shape)
+    total = np.zeros(ar.shape)
+    for t in range(1, diffs.shape[1]):
+        residual = diffs[:, t, None] - ar * diffs[:, t - 1, None] - ma * residual
+        total += residual * residual
+    return total, residual
+
+
+class BatchArima:
+    """ARIMA(1,1,1) without a constant, fitted to each row of a (series, periods) matrix"""
+
+    def __init__(self, matrix):
+        matrix = np.asarray(matrix, dtype='float64')
+        if matrix.shape[1] < 3:
+            raise ValueError("At least 3 periods are needed to fit ARIMA(1,1,1)")
+        diffs = np.diff(matrix, axis=1)
+        rows = np.arange(len(matrix))
+
+        # Coarse grid shared by all series, then a finer one around each series' best point
+        ar, ma = (np.broadcast_to(values.ravel(), (len(matrix), values.size))
+                  for values in np.meshgrid(COARSE_GRID, COARSE_GRID, indexing='ij'))
+        best = _residuals(diffs, ar, ma)[0].argmin(axis=1)
+        steps_ar, steps_ma = (values.ravel() for values in np.meshgrid(FINE_STEPS, FINE_STEPS, indexing='ij'))
+        ar = np.clip(ar[rows, best, None] + steps_ar, -PARAMETER_LIMIT, PARAMETER_LIMIT)
+        ma = np.clip(ma[rows, best, None] + steps_ma, -PARAMETER_LIMIT, PARAMETER_LIMIT)
+        total, residual = _residuals(diffs, ar, ma)
+        best = total.argmin(axis=1)
+
+        self.ar = ar[rows, best]
+        self.ma = ma[rows, best]
+        self.sigma2 = total[rows, best] / (diffs.shape[1] - 1)
+        self._last_value = matrix[:, -1]
+        self._last_diff = diffs[:, -1]
+        self._last_residual = residual[rows, best]
+
+    def forecast(self, steps):
+        """Point forecasts for the next steps periods, (series, steps)"""
+        diffs = np.empty((len(self.ar), steps))
+        diffs[:, 0] = self.ar * self._last_diff + self.ma * self._last_residual
+        for step in range(1, steps):
+            diffs[:, step] = self.ar * diffs[:, step - 1]
+        return self._last_value[:, None] + np.cumsum(diffs, axis=1)
+
+    def psi_weights(self, steps):
+        """Weights of the shocks in the forecast errors of the integrated series, (series, steps)"""
+        weights = np.empty((len(self.ar), steps))
+        weights[:, 0] = 1.0
+        if steps > 1:
+            weights[:, 1:] = (self.ar + self.ma)[:, None] * self.ar[:, None] ** np.arange(steps - 1)
+        return np.cumsum(weights, axis=1)
+
+    def total(self, first, last, confidence=0.95):
+        """(forecast, lower, upper) of the total over steps first..last (1 is the next period), per series"""
+        forecast = self.forecast(last)[:, first - 1:].sum(axis=1)
+        psi = self.psi_weights(last)
+        # The shock of step k enters the total with the psi weights of the steps from max(k, first) to last
+        lags = np.arange(last)[:, None] - np.arange(last)
+        coefficients = np.where((lags >= 0)[None], psi[:, np.clip(lags, 0, None)], 0.0)[:, first - 1:, :].sum(axis=1)
+        spread = norm.ppf(0.5 + confidence / 2) * np.sqrt(self.sigma2 * (coefficients ** 2).sum(axis=1))
+        return forecast, forecast - spread, forecast + spread
@@ -0,0 +1,277 @@
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+# Times every route of the consolidated app through the Flask test client on
+# a synthetic dataset and compares the result with a saved baseline.
+#
+#   cd Backend
+#   python -m benchmarks.bench_endpoints --scale small --save-baseline
+#   python -m benchmarks.bench_endpoints --scale small --compare
+#
+# Gemini, the QA pipeline and the classifier are replaced by local stubs
+# unless --real-models is given.
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_DIR = os.path.join(BACKEND_DIR, 'benchmarks', 'baselines')
+
+
+def employee_body(key='employee_id'):
+    return lambda ctx: {key: ctx.employee_id()}
+
+
+# Request body for every route, keyed by (method, path)
+ROUTES = {
+    # Query_1
+    ('POST', '/entity_recognition'): lambda ctx: ctx.ocr_payload(),
+    ('POST', '/summarize'): lambda ctx: ctx.ocr_payload(),
+    ('POST', '/classify'): lambda ctx: ctx.ocr_payload(),
+    ('POST', '/classify/train'): lambda ctx: {**ctx.ocr_payload(), 'label': 'Invoice'},
+    ('POST', '/query'): lambda ctx: {'question': 'Who issued this invoice?'},
+    # Query_2
+    ('POST', '/api/expenses_by_type'): employee_body(),
+    ('POST', '/api/expenses_by_vendor'): employee_body(),
+    ('POST', '/api/expenses_by_location'): employee_body(),
+    ('POST', '/get_expenses_summary'): employee_body(),
+    ('POST', '/api/barplot'): employee_body(),
+    ('POST', '/api/piechart'): employee_body(),
+    ('POST', '/api/heatmap'): employee_body(),
+    ('POST', '/api/ARIMA'): employee_body(),
+    ('POST', '/api/Monthly_Spending'): lambda ctx: {'employee_id': ctx.employee_id(), 'month_str': 'March',
+                                                    'year_str': str(ctx.year)},
+    ('POST', '/api/Yearly_Spending'): lambda ctx: {'employee_id': ctx.employee_id(), 'year_str': str(ctx.year)},
+    ('POST', '/api/Category_Spending'): lambda ctx: {'employee_id': ctx.employee_id(), 'category': 'Food',
+                                                     'month_str': '03', 'year_str': str(ctx.year)},
+    ('POST', '/api/forecast'): employee_body(),
+    ('POST', '/api/department_spend'): lambda ctx: {'group_by': ['department', 'type', 'month'],
+                                                    'start_month': f'{ctx.year}-01'},
+    ('POST', '/api/spend_range'): lambda ctx: {'employee_id': ctx.employee_id(), 'quarter': 'Q2',
+                                               'year_str': str(ctx.year)},
+    # Query_3
+    ('POST', '/net_worth'): employee_body('emp_id'),
+    ('POST', '/employee'): employee_body('emp_id'),
+    ('POST', '/ctc_chart'): employee_body('emp_id'),
+    ('POST', '/payroll'): lambda ctx: {'department': 'HR'},
+    # Query_4
+    ('POST', '/chat'): lambda ctx: {'employee_id': ctx.employee_id(), 'user_input': 'Summarise my expenses'},
+    # Query_5
+    ('POST', '/invoices'): employee_body('emp_id'),
+    ('POST', '/manage_debt'): lambda ctx: {'emp_id': ctx.employee_id(), 'debt_amount': 1},
+    ('POST', '/extract_invoice'): lambda ctx: ctx.ocr_payload(),
+    ('GET', '/ingest_stats'): None,
+    ('GET', '/anomalies'): None,
+    ('GET', '/export_invoices'): None,
+    # dashboard
+    ('POST', '/dashboard'): employee_body(),
+    # precompute
+    ('GET', '/api/precompute_status'): None,
+    # instrumentation
+    ('GET', '/metrics'): None,
+}
+
+
+class Context:
+    """Random but reproducible request parameters drawn from the dataset"""
+
+    def __init__(self, employee_ids, ocr_payloads, year, seed=0):
+        self.rng = np.random.default_rng(seed)
+        self.employee_ids = employee_ids
+        self.ocr_payloads = ocr_payloads
+        self.year = year
+
+    def employee_id(self):
+        return int(self.rng.choice(self.employee_ids))
+
+    def ocr_payload(self):
+        return self.ocr_payloads[int(self.rng.integers(len(self.ocr_payloads)))]
+
+
+def rss_mib():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except FileNotFoundError:
+        import resource
+        return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def prepare_data(data_dir, scale):
+    from benchmarks.synthetic_data import SCALES, write_dataset
+
+    if not os.path.exists(os.path.join(data_dir, 'invoice_database.csv')):
+        n_invoices, n_employees = SCALES[scale]
+        print(f"Generating {scale} dataset in {data_dir} ...")
+        write_dataset(data_dir, n_invoices, n_employees)
+
+    # The services load model/*.pkl relative to the working directory
+    model_dir = os.path.join(data_dir, 'model')
+    if not os.path.exists(model_dir):
+        try:
+            os.symlink(os.path.join(BACKEND_DIR, 'model'), model_dir)
+        except OSError:
+            shutil.copytree(os.path.join(BACKEND_DIR, 'model'), model_dir)
+
+
+def request(client, method, path, body):
+    response = client.get(path) if method == 'GET' else client.post(path, json=body)
+    # Read streamed bodies to the end, so they are timed in full and closed
+    response.get_data()
+    response.close()
+    return response
+
+
+def time_route(client, ctx, method, path, make_body, iterations, warmup, max_seconds):
+    for _ in range(warmup):
+        request(client, method, path, make_body(ctx) if make_body else None)
+
+    timings, errors = [], 0
+    deadline = time.perf_counter() + max_seconds
+    for i in range(iterations):
+        body = make_body(ctx) if make_body else None
+        start = time.perf_counter()
+        response = request(client, method, path, body)
+        timings.append(time.perf_counter() - start)
+        if response.status_code >= 500:
+            errors += 1
+        if i >= 4 and time.perf_counter() > deadline:
+            break
+
+    # One extra call under tracemalloc for the route's peak Python/numpy allocation
+    tracemalloc.start()
+    request(client, method, path, make_body(ctx) if make_body else None)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    ms = np.array(timings) * 1000
+    return {
+        'n': len(timings),
+        'errors': errors,
+        'p50_ms': round(float(np.percentile(ms, 50)), 3),
+        'p95_ms': round(float(np.percentile(ms, 95)), 3),
+        'p99_ms': round(float(np.percentile(ms, 99)), 3),
+        'peak_alloc_kib': round(peak / 1024, 1),
+    }
+
+
+def run(args):
+    data_dir = os.path.abspath(args.data or os.path.join(BACKEND_DIR, 'benchmarks', 'data', args.scale))
+    prepare_data(data_dir, args.scale)
+
+    sys.path.insert(0, BACKEND_DIR)
+    os.chdir(data_dir)
+
+    import data_store
+    from invoice_ingest import from_day_numbers
+    if not args.real_models:
+        from benchmarks import stubs
+        stubs.install()
+
+    rss_before = rss_mib()
+    start = time.perf_counter()
+    data_store.preload(classifier=args.real_models, qa=args.real_models)
+    load_seconds = time.perf_counter() - start
+
+    import app
+    if not args.verbose:
+        # Failing routes are counted in the report; skip the tracebacks
+        app.app.logger.setLevel(logging.CRITICAL)
+    client = app.app.test_client()
+
+    invoices = data_store.get_invoices()
+    with open('ocr_payloads.jsonl') as f:
+        ocr_payloads = [json.loads(line) for line in f]
+    year = int(from_day_numbers([invoices['date'].max()]).year[0])
+    ctx = Context(invoices['employee_id'].unique(), ocr_payloads, year)
+
+    # /query answers questions about the most recent summary
+    client.post('/summarize', json=ctx.ocr_payload())
+
+    results = {}
+    for rule in app.app.url_map.iter_rules():
+        if rule.endpoint == 'static':
+            continue
+        for method in sorted(rule.methods - {'HEAD', 'OPTIONS'}):
+            key = (method, rule.rule)
+            if key not in ROUTES:
+                print(f"No request body defined for {method} {rule.rule}; skipped")
+                continue
+            if args.routes and not any(pattern in rule.rule for pattern in args.routes):
+                continue
+            results[f'{method} {rule.rule}'] = time_route(client, ctx, method, rule.rule, ROUTES[key],
+                                                          args.iterations, args.warmup, args.max_seconds)
+
+    return {
+        'scale': args.scale,
+        'invoices': len(invoices),
+        'employees': len(data_store.get_employees()),
+        'load_seconds': round(load_seconds, 3),
+        'rss_before_load_mib': rss_before,
+        'rss_after_load_mib': rss_mib(),
+        'routes': results,
+    }
+
+
+def print_report(report, baseline=None, tolerance=0.25):
+    print(f"{report['invoices']} invoices, {report['employees']} employees; "
+          f"load {report['load_seconds']}s, RSS {report['rss_before_load_mib']} -> {report['rss_after_load_mib']} MiB")
+    print(f"{'route':<34} {'n':>5} {'err':>4} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'peak KiB':>10}  vs baseline")
+
+    regressions = []
+    for route, r in sorted(report['routes'].items()):
+        note = ''
+        if baseline and route in baseline['routes']:
+            ratio = r['p95_ms'] / max(baseline['routes'][route]['p95_ms'], 1e-6)
+            note = f'{ratio:.2f}x'
+            if ratio > 1 + tolerance:
+                note += ' REGRESSION'
+                regressions.append(route)
+        print(f"{route:<34} {r['n']:>5} {r['errors']:>4} {r['p50_ms']:>9} {r['p95_ms']:>9} "
+              f"{r['p99_ms']:>9} {r['peak_alloc_kib']:>10}  {note}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark every backend route on synthetic data')
+    parser.add_argument('--scale', default='small', help='small, medium, large or xlarge')
+    parser.add_argument('--data', help='dataset directory (default benchmarks/data/<scale>)')
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('--max-seconds', type=float, default=20.0, help='time budget per route')
+    parser.add_argument('--routes', nargs='*', help='only routes containing one of these strings')
+    parser.add_argument('--real-models', action='store_true', help='use Gemini and the real models')
+    parser.add_argument('--verbose', action='store_true', help='log tracebacks of failing routes')
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--compare', action='store_true', help='compare p95 with the saved baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed p95 slowdown for --compare')
+    args = parser.parse_args()
+
+    baseline_path = os.path.join(BASELINE_DIR, f'{args.scale}.json')
+    report = run(args)
+
+    baseline = None
+    if args.compare:
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+    regressions = print_report(report, baseline, args.tolerance)
+
+    if args.save_baseline:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        with open(baseline_path, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved baseline to {baseline_path}")
+
+    if regressions:
+        sys.exit(f"{len(regressions)} route(s) slower than baseline: {', '.join(regressions)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+import warnings
+
+from benchmarks.bench_endpoints import BACKEND_DIR, BASELINE_DIR, prepare_data
+
+# Charts drawn per second per CPU core, for every chart the backend renders,
+# on a synthetic dataset. Each chart is drawn from data looked up beforehand,
+# the way the routes call the drawing functions (the ARIMA chart includes the
+# forecast from the already fitted model), with the result cache off so every
+# call draws.
+#
+#   cd Backend
+#   python -m benchmarks.chart_bench --scale small --save-baseline    # on the tree before a change
+#   python -m benchmarks.chart_bench --scale small --compare
+#
+# With --processes N, N processes draw at the same time and charts per second
+# per core is their total divided by N.
+
+CHARTS = ['barplot', 'piechart', 'heatmap', 'arima', 'ctc_chart', 'invoices_table']
+
+
+def chart_calls(employee_ids):
+    """{chart: [call drawing it for one employee, ...]}"""
+    import data_store
+    import Query_2
+    import Query_3
+    import Query_5
+
+    frames = [data_store.get_employee_invoices(employee_id) for employee_id in employee_ids]
+    pays = [data_store.get_payroll().record(employee_id) for employee_id in employee_ids]
+    tables = [(employee_id, invoices) for employee_id, invoices in
+              ((employee_id, Query_5.get_invoices_for_last_month(employee_id)) for employee_id in employee_ids)
+              if not invoices.empty]
+    # Fit each employee's model once; the benchmark measures drawing, not fitting
+    for employee_id in employee_ids:
+        Query_2.fit_arima_for_employee_monthly(employee_id)
+
+    return {
+        'barplot': [lambda frame=frame: Query_2.create_barplot(frame) for frame in frames],
+        'piechart': [lambda frame=frame: Query_2.create_piechart(frame) for frame in frames],
+        'heatmap': [lambda frame=frame: Query_2.create_heatmap(frame) for frame in frames],
+        'arima': [lambda employee_id=employee_id: Query_2.fit_arima_for_employee_monthly(employee_id)
+                  for employee_id in employee_ids],
+        'ctc_chart': [lambda pay=pay: Query_3.render_ctc_chart(pay) for pay in pays],
+        'invoices_table': [lambda employee_id=employee_id, invoices=invoices:
+                           Query_5.render_invoices_table(employee_id, invoices) for employee_id, invoices in tables],
+    }
+
+
+_calls = None
+
+
+def draw_for(args):
+    """Draw one chart for the employees in turn for a number of seconds; (charts drawn, seconds)"""
+    chart, seconds = args
+    calls = _calls[chart]
+    # The first draw also builds whatever the drawing code keeps between calls
+    calls[0]()
+    count, start = 0, time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        calls[count % len(calls)]()
+        count += 1
+    return count, time.perf_counter() - start
+
+
+def run(args):
+    global _calls
+    data_dir = os.path.abspath(args.data or os.path.join(BACKEND_DIR, 'benchmarks', 'data', args.scale))
+    prepare_data(data_dir, args.scale)
+
+    sys.path.insert(0, BACKEND_DIR)
+    os.chdir(data_dir)
+    warnings.simplefilter('ignore')
+
+    import data_store
+    import result_cache
+    result_cache.enabled = False
+
+    employee_ids = sorted(data_store.get_invoices()['employee_id'].unique())[:args.employees]
+    _calls = chart_calls(employee_ids)
+
+    results = {}
+    # Forked workers share the data looked up above
+    with multiprocessing.get_context('fork').Pool(args.processes) as pool:
+        for chart in args.charts:
+            runs = pool.map(draw_for, [(chart, args.seconds)] * args.processes)
+            total = sum(count / seconds for count, seconds in runs)
+            results[chart] = {'charts_per_s': round(total, 2), 'per_core': round(total / args.processes, 2),
+                              'ms_per_chart': round(1000 * args.processes / total, 1)}
+    return {'scale': args.scale, 'processes': args.processes, 'charts': results}
+
+
+def print_report(report, baseline=None):
+    print(f"{report['processes']} process(es), scale {report['scale']}")
+    print(f"{'chart':<16} {'charts/s':>9} {'per core':>9} {'ms/chart':>9}  {'before':>9}  speedup")
+    for chart, r in report['charts'].items():
+        before, speedup = '', ''
+        if baseline and chart in baseline['charts']:
+            before = baseline['charts'][chart]['per_core']
+            speedup = f"{r['per_core'] / before:.2f}x"
+        print(f"{chart:<16} {r['charts_per_s']:>9} {r['per_core']:>9} {r['ms_per_chart']:>9}  {before:>9}  {speedup}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure chart rendering throughput')
+    parser.add_argument('--scale', default='small', help='small, medium, large or xlarge')
+    parser.add_argument('--data', help='dataset directory (default benchmarks/data/<scale>)')
+    parser.add_argument('--employees', type=int, default=20, help='employees whose charts are drawn in turn')
+    parser.add_argument('--seconds', type=float, default=5.0, help='drawing time per chart')
+    parser.add_argument('--processes', type=int, default=1, help='processes drawing at the same time')
+    parser.add_argument('--charts', nargs='*', default=CHARTS, choices=CHARTS)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--compare', action='store_true', help='compare with the saved baseline')
+    args = parser.parse_args()
+
+    baseline_path = os.path.join(BASELINE_DIR, f'charts_{args.scale}_{args.processes}.json')
+    report = run(args)
+
+    baseline = None
+    if args.compare:
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+
+    if args.save_baseline:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        with open(baseline_path, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved baseline to {baseline_path}")
+
+
+if __name__ == '__main__':
+    main()
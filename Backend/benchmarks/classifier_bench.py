@@ -0,0 +1,114 @@
+import argparse
+import os
+import pickle
+import tempfile
+import time
+import warnings
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.linear_model import SGDClassifier
+from sklearn.model_selection import StratifiedKFold
+
+from benchmarks.bench_endpoints import BACKEND_DIR
+
+# Compares the pickled classifier (model.pkl + vectorizer.pkl) with the online
+# hashing classifier: artifact size, load time, single-document and batch
+# throughput, and accuracy on documents.csv.
+#
+#   cd Backend
+#   python -m benchmarks.classifier_bench
+#
+# model.pkl was trained on documents.csv, so its accuracy there is in-sample;
+# the online classifier is also scored with stratified k-fold cross-validation.
+
+
+def time_per_call(fn, seconds):
+    calls, start = 0, time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        fn()
+        calls += 1
+    return (time.perf_counter() - start) / calls
+
+
+def measure(name, load, texts, labels, seconds):
+    start = time.perf_counter()
+    model, vectorizer = load()
+    load_ms = (time.perf_counter() - start) * 1000
+
+    single = time_per_call(lambda: model.predict(vectorizer.transform([texts[0]])), seconds)
+    batch = time_per_call(lambda: model.predict(vectorizer.transform(texts)), seconds)
+    accuracy = float(np.mean(model.predict(vectorizer.transform(texts)) == np.asarray(labels)))
+    return {
+        'classifier': name,
+        'load_ms': round(load_ms, 2),
+        'single_docs_per_s': round(1 / single),
+        'batch_docs_per_s': round(len(texts) / batch),
+        'accuracy': round(accuracy, 3),
+    }
+
+
+def cross_validate_online(documents, folds):
+    import online_classifier
+
+    scores = []
+    for train, test in StratifiedKFold(folds, shuffle=True, random_state=0).split(documents, documents['label']):
+        classifier = online_classifier.OnlineClassifier(SGDClassifier(loss='log_loss', alpha=1e-4, random_state=0))
+        features = classifier.vectorizer.transform(documents['text'].iloc[train])
+        for _ in range(online_classifier.bootstrap_epochs):
+            classifier.model.partial_fit(features, documents['label'].iloc[train], classes=online_classifier.CLASSES)
+        predicted = classifier.model.predict(classifier.vectorizer.transform(documents['text'].iloc[test]))
+        scores.append(np.mean(predicted == documents['label'].iloc[test].to_numpy()))
+    return float(np.mean(scores))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the pickled and the online document classifier')
+    parser.add_argument('--seconds', type=float, default=2.0, help='time budget per throughput measurement')
+    parser.add_argument('--folds', type=int, default=5)
+    args = parser.parse_args()
+
+    os.chdir(BACKEND_DIR)
+    import online_classifier
+
+    documents = pd.read_csv(online_classifier.documents_file)
+    texts, labels = documents['text'].tolist(), documents['label'].tolist()
+    rows = []
+
+    pickle_files = ['model/model.pkl', 'model/vectorizer.pkl']
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            row = measure('pickle', lambda: tuple(joblib.load(path) for path in pickle_files), texts, labels,
+                          args.seconds)
+        row['artifact_kib'] = round(sum(os.path.getsize(path) for path in pickle_files) / 1024, 1)
+        rows.append(row)
+    except (ValueError, pickle.UnpicklingError, AttributeError) as e:
+        print(f"model.pkl could not be loaded with this scikit-learn version: {e}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        online_classifier.model_file = os.path.join(tmp, 'online_classifier.joblib')
+        online_classifier.training_log = os.path.join(tmp, 'online_training.jsonl')
+        start = time.perf_counter()
+        online_classifier.OnlineClassifier.load()
+        bootstrap_ms = (time.perf_counter() - start) * 1000
+
+        def load():
+            classifier = online_classifier.OnlineClassifier.load()
+            return classifier, classifier.vectorizer
+
+        row = measure('online', load, texts, labels, args.seconds)
+        row['artifact_kib'] = round(os.path.getsize(online_classifier.model_file) / 1024, 1)
+        row['cv_accuracy'] = round(cross_validate_online(documents, args.folds), 3)
+        classifier = online_classifier.OnlineClassifier.load()
+        learn = time_per_call(lambda: classifier.learn(texts[:10], labels[:10]), args.seconds)
+        row['learn_docs_per_s'] = round(10 / learn)
+        rows.append(row)
+
+    print(pd.DataFrame(rows).set_index('classifier').T.to_string())
+    print(f"\nOnline classifier bootstrap from {len(documents)} documents: {bootstrap_ms:.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
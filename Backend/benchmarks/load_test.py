@@ -0,0 +1,315 @@
+import argparse
+import csv
+import http.client
+import json
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+import pandas as pd
+
+from benchmarks.bench_endpoints import BACKEND_DIR, ROUTES, Context, prepare_data
+
+# Closed-loop load test: N simulated chatbot users each send a request drawn
+# from a weighted mix, wait for the answer, and send the next one. The number
+# of users is ramped through --concurrency; every stage reports per-endpoint
+# latency histograms, error rate and throughput.
+#
+#   cd Backend
+#   python -m benchmarks.load_test --scale small --concurrency 50 100 200 500
+#
+# Without --url a stub server (benchmarks/stub_server.py) is started on the
+# same synthetic dataset, with Gemini and the transformers model stubbed.
+
+# Default request mix, as relative weights
+DEFAULT_MIX = {
+    'POST /chat': 30,
+    'POST /invoices': 12,
+    'POST /api/expenses_by_type': 10,
+    'POST /api/expenses_by_vendor': 10,
+    'POST /api/expenses_by_location': 10,
+    'POST /api/barplot': 6,
+    'POST /api/piechart': 6,
+    'POST /api/heatmap': 6,
+    'POST /ctc_chart': 6,
+    'POST /net_worth': 2,
+    'POST /api/ARIMA': 2,
+}
+
+
+class LatencyHistogram:
+    """Log-linear latency histogram in microseconds, in the spirit of HdrHistogram
+
+    Each power of two is split into SUB_BUCKETS linear buckets, so any
+    recorded value is reproduced within 1/SUB_BUCKETS (about 1.6%).
+    """
+
+    SUB_BUCKETS = 64
+
+    def __init__(self):
+        self.counts = {}
+        self.total = 0
+        self.max = 0
+
+    def record(self, micros):
+        micros = max(1, int(micros))
+        exponent = micros.bit_length() - 1
+        sub = ((micros - (1 << exponent)) * self.SUB_BUCKETS) >> exponent
+        index = exponent * self.SUB_BUCKETS + sub
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.total += 1
+        self.max = max(self.max, micros)
+
+    def merge(self, other):
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def _upper_value(self, index):
+        exponent, sub = divmod(index, self.SUB_BUCKETS)
+        return ((1 << exponent) * (self.SUB_BUCKETS + sub + 1)) // self.SUB_BUCKETS
+
+    def percentile(self, q):
+        if not self.total:
+            return None
+        target = max(1, math.ceil(q / 100 * self.total))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= target:
+                return min(self._upper_value(index), self.max)
+        return self.max
+
+    def write_hgrm(self, path):
+        """Write the percentile distribution in HdrHistogram's .hgrm text format (values in ms)"""
+        with open(path, 'w') as f:
+            f.write(f"{'Value':>12} {'Percentile':>14} {'TotalCount':>10} {'1/(1-Percentile)':>14}\n\n")
+            seen = 0
+            for index in sorted(self.counts):
+                seen += self.counts[index]
+                fraction = seen / self.total
+                inverse = f'{1 / (1 - fraction):14.2f}' if fraction < 1 else f"{'inf':>14}"
+                value = min(self._upper_value(index), self.max) / 1000
+                f.write(f'{value:12.3f} {fraction:14.12f} {seen:10d} {inverse}\n')
+            f.write(f'#[Max = {self.max / 1000:.3f}, Total count = {self.total}]\n')
+
+
+class EndpointStats:
+    def __init__(self):
+        self.histogram = LatencyHistogram()
+        self.errors = 0
+
+    def merge(self, other):
+        self.histogram.merge(other.histogram)
+        self.errors += other.errors
+
+
+def user_loop(url, mix, ctx, stats, measure_from, stop, think_time):
+    """One simulated user: request, wait for the response, repeat"""
+    parts = urlsplit(url)
+    conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=120)
+    names, weights = list(mix), list(mix.values())
+    rng = random.Random(id(stats))
+
+    while not stop.is_set():
+        name = rng.choices(names, weights)[0]
+        method, path = name.split(' ', 1)
+        make_body = ROUTES.get((method, path))
+        body = json.dumps(make_body(ctx)) if make_body else None
+
+        start = time.perf_counter()
+        try:
+            conn.request(method, path, body, {'Content-Type': 'application/json'})
+            response = conn.getresponse()
+            response.read()
+            failed = response.status >= 500
+        except (OSError, http.client.HTTPException):
+            failed = True
+            conn.close()
+        elapsed = time.perf_counter() - start
+
+        if start >= measure_from:
+            endpoint = stats.setdefault(name, EndpointStats())
+            endpoint.histogram.record(elapsed * 1e6)
+            endpoint.errors += failed
+        if think_time:
+            time.sleep(rng.expovariate(1 / think_time))
+    conn.close()
+
+
+def run_stage(url, mix, concurrency, seconds, warmup, think_time, employee_ids, ocr_payloads, year):
+    stop = threading.Event()
+    measure_from = time.perf_counter() + warmup
+    per_user = [{} for _ in range(concurrency)]
+    threads = [
+        threading.Thread(target=user_loop, daemon=True,
+                         args=(url, mix, Context(employee_ids, ocr_payloads, year, seed=i),
+                               per_user[i], measure_from, stop, think_time))
+        for i in range(concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    time.sleep(warmup + seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    merged = {}
+    for stats in per_user:
+        for name, endpoint in stats.items():
+            merged.setdefault(name, EndpointStats()).merge(endpoint)
+    return merged
+
+
+def summarise(stage_results, seconds):
+    rows = []
+    for concurrency, results in stage_results:
+        total = EndpointStats()
+        for name, endpoint in sorted(results.items()):
+            total.merge(endpoint)
+            rows.append(stage_row(concurrency, name, endpoint, seconds))
+        rows.append(stage_row(concurrency, 'ALL', total, seconds))
+    return rows
+
+
+def stage_row(concurrency, name, endpoint, seconds):
+    h = endpoint.histogram
+    return {
+        'concurrency': concurrency,
+        'endpoint': name,
+        'requests': h.total,
+        'throughput_rps': round(h.total / seconds, 2),
+        'error_rate': round(endpoint.errors / h.total, 4) if h.total else 0.0,
+        'p50_ms': (h.percentile(50) or 0) / 1000,
+        'p90_ms': (h.percentile(90) or 0) / 1000,
+        'p99_ms': (h.percentile(99) or 0) / 1000,
+        'p999_ms': (h.percentile(99.9) or 0) / 1000,
+        'max_ms': h.max / 1000,
+    }
+
+
+def saturation_points(rows, min_gain=0.1, max_error_rate=0.01):
+    """First concurrency per endpoint where more users stop buying throughput"""
+    points = {}
+    by_endpoint = {}
+    for row in rows:
+        by_endpoint.setdefault(row['endpoint'], []).append(row)
+    for endpoint, series in by_endpoint.items():
+        series.sort(key=lambda r: r['concurrency'])
+        peak = max(series, key=lambda r: r['throughput_rps'])
+        points[endpoint] = {'concurrency': None, 'peak_rps': peak['throughput_rps']}
+        for previous, current in zip(series, series[1:]):
+            gain = current['throughput_rps'] / max(previous['throughput_rps'], 1e-9) - 1
+            if gain < min_gain or current['error_rate'] > max_error_rate:
+                points[endpoint]['concurrency'] = previous['concurrency']
+                break
+    return points
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_stub_server(args, data_dir):
+    port = free_port()
+    command = [sys.executable, '-m', 'benchmarks.stub_server', '--data', data_dir, '--port', str(port),
+               '--workers', str(args.server_workers), '--gemini-latency', str(args.gemini_latency),
+               '--qa-latency', str(args.qa_latency)]
+    server = subprocess.Popen(command, cwd=BACKEND_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    url = f'http://127.0.0.1:{port}'
+    deadline = time.time() + 120
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            conn.request('GET', '/ingest_stats')
+            conn.getresponse().read()
+            return server, url
+        except OSError:
+            if server.poll() is not None:
+                break
+            time.sleep(0.5)
+    server.kill()
+    sys.exit('Stub server did not start')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Closed-loop load test of the backend')
+    parser.add_argument('--url', help='server to test (default: start a stub server)')
+    parser.add_argument('--scale', default='small')
+    parser.add_argument('--data', help='dataset directory the server uses (default benchmarks/data/<scale>)')
+    parser.add_argument('--mix', help='JSON file mapping "METHOD /path" to a weight')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[50, 100, 200, 300, 500])
+    parser.add_argument('--stage-seconds', type=float, default=30)
+    parser.add_argument('--warmup-seconds', type=float, default=5)
+    parser.add_argument('--think-time', type=float, default=0.0, help='mean pause between requests (s)')
+    parser.add_argument('--server-workers', type=int, default=1)
+    parser.add_argument('--gemini-latency', type=float, default=0.8)
+    parser.add_argument('--qa-latency', type=float, default=0.15)
+    parser.add_argument('--output', default=os.path.join('benchmarks', 'results', 'load_test'))
+    args = parser.parse_args()
+
+    mix = DEFAULT_MIX
+    if args.mix:
+        with open(args.mix) as f:
+            mix = json.load(f)
+    unknown = [name for name in mix if tuple(name.split(' ', 1)) not in ROUTES]
+    if unknown:
+        sys.exit(f"No request body defined for: {', '.join(unknown)}")
+
+    data_dir = os.path.abspath(args.data or os.path.join(BACKEND_DIR, 'benchmarks', 'data', args.scale))
+    prepare_data(data_dir, args.scale)
+    invoices = pd.read_csv(os.path.join(data_dir, 'invoice_database.csv'), usecols=['employee_id', 'date'])
+    employee_ids = invoices['employee_id'].unique()
+    year = int(invoices['date'].str[-4:].astype(int).max())
+    with open(os.path.join(data_dir, 'ocr_payloads.jsonl')) as f:
+        ocr_payloads = [json.loads(line) for line in f]
+
+    server, url = (None, args.url) if args.url else start_stub_server(args, data_dir)
+    try:
+        stage_results = []
+        for concurrency in args.concurrency:
+            print(f"Running {concurrency} users for {args.stage_seconds}s ...")
+            results = run_stage(url, mix, concurrency, args.stage_seconds, args.warmup_seconds,
+                                args.think_time, employee_ids, ocr_payloads, year)
+            stage_results.append((concurrency, results))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    os.makedirs(args.output, exist_ok=True)
+    rows = summarise(stage_results, args.stage_seconds)
+    with open(os.path.join(args.output, 'throughput_curve.csv'), 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+    for concurrency, results in stage_results:
+        for name, endpoint in results.items():
+            slug = name.replace(' /', '_').replace('/', '_').lower()
+            endpoint.histogram.write_hgrm(os.path.join(args.output, f'c{concurrency}_{slug}.hgrm'))
+
+    print(f"{'users':>6} {'endpoint':<32} {'req':>7} {'rps':>9} {'err %':>6} "
+          f"{'p50 ms':>9} {'p99 ms':>9} {'p99.9 ms':>9}")
+    for row in rows:
+        print(f"{row['concurrency']:>6} {row['endpoint']:<32} {row['requests']:>7} {row['throughput_rps']:>9} "
+              f"{row['error_rate'] * 100:>6.2f} {row['p50_ms']:>9.1f} {row['p99_ms']:>9.1f} {row['p999_ms']:>9.1f}")
+
+    print('\nSaturation (last concurrency level that still added >10% throughput):')
+    for endpoint, point in sorted(saturation_points(rows).items()):
+        level = point['concurrency'] or f">={args.concurrency[-1]} (not reached)"
+        print(f"  {endpoint:<32} {level} users, peak {point['peak_rps']} rps")
+    print(f"\nHistograms and throughput_curve.csv written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
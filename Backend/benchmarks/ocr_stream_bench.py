@@ -0,0 +1,101 @@
+import argparse
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.bench_endpoints import BACKEND_DIR
+from benchmarks.synthetic_data import make_ocr_payload
+
+# Peak memory and latency of reading OCR documents whole (OCR_STREAMING=0:
+# request.get_json() builds the full tree first) against streaming their
+# textBlocks, for field extraction (/extract_invoice) and classification
+# (/classify) of documents with a growing number of blocks.
+#
+#   cd Backend
+#   python -m benchmarks.ocr_stream_bench --blocks 1000 10000 50000
+#
+# Peak memory is what tracemalloc sees allocated while the body is read and
+# processed; the request body itself is allocated before and not counted.
+# The classifier is the online hashing classifier, bootstrapped into a
+# temporary directory.
+
+
+def run(app, body, task):
+    from flask import request
+    import ocr_stream
+
+    with app.test_request_context(method='POST', data=body, content_type='application/json'):
+        return task(ocr_stream.OcrStream.from_request(request))
+
+
+def measure(app, body, task, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = run(app, body, task)
+        times.append(time.perf_counter() - start)
+
+    from flask import request
+    import ocr_stream
+
+    with app.test_request_context(method='POST', data=body, content_type='application/json'):
+        tracemalloc.start()
+        task(ocr_stream.OcrStream.from_request(request))
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return result, float(np.median(times)), peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare whole-document and streamed OCR ingestion')
+    parser.add_argument('--blocks', type=int, nargs='+', default=[1000, 10000, 50000],
+                        help='text blocks per document')
+    parser.add_argument('--repeat', type=int, default=5, help='timed runs per measurement (median is reported)')
+    args = parser.parse_args()
+
+    os.chdir(BACKEND_DIR)
+    import data_store
+    import duplicate_index
+    import ocr_stream
+    import online_classifier
+    import Query_1
+    import Query_5
+
+    def extract(ocr):
+        fingerprint = duplicate_index.TextFingerprint()
+        return Query_5.extract_invoice_details(ocr.blocks(), fingerprint), fingerprint.value()
+
+    def classify(ocr):
+        return Query_1.classify_text(ocr.blocks())
+
+    rng = np.random.default_rng(0)
+    invoice = {'vendor': 'Dominos', 'employee_id': 1001, 'date': '05-06-2024', 'invoice_id': 987654,
+               'location': 'Sec 5', 'amount': 1234, 'type': 'Food'}
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        online_classifier.model_file = os.path.join(tmp, 'online_classifier.joblib')
+        online_classifier.training_log = os.path.join(tmp, 'online_training.jsonl')
+        classifier = online_classifier.OnlineClassifier.load()
+        data_store.override_model('classifier', (classifier, classifier.vectorizer))
+
+        for blocks in args.blocks:
+            body = json.dumps(make_ocr_payload(invoice, 'Ravi', rng, extra_blocks=blocks)).encode('utf-8')
+            for name, task in (('extract', extract), ('classify', classify)):
+                results = {}
+                for mode, streaming in (('whole', False), ('streamed', True)):
+                    ocr_stream.enabled = streaming
+                    results[mode], seconds, peak = measure(Query_5.app, body, task, args.repeat)
+                    rows.append({'task': name, 'blocks': blocks, 'body_mib': round(len(body) / 2 ** 20, 2),
+                                 'mode': mode, 'ms': round(seconds * 1000, 1), 'peak_mib': round(peak / 2 ** 20, 2)})
+                assert results['whole'] == results['streamed'], f"{name}: streamed result differs"
+
+    print(pd.DataFrame(rows).set_index(['task', 'blocks', 'mode']).to_string())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+# Per-worker memory with and without pre-fork preloading (Linux only).
+#
+#   cd Backend
+#   python -m benchmarks.prefork_rss --workers 4
+#
+# Each worker serves a few warm-up requests, then all workers are measured
+# together so that PSS splits the shared pages fairly between them.
+
+WARMUP_REQUESTS = [
+    ('/api/expenses_by_type', {'employee_id': 1000}),
+    ('/api/expenses_by_vendor', {'employee_id': 1010}),
+    ('/api/heatmap', {'employee_id': 1020}),
+    ('/net_worth', {'emp_id': 1000}),
+    ('/employee', {'emp_id': 1010}),
+]
+
+
+def read_memory(pid):
+    """Rss, Pss and private (unshared) memory of a process in MiB"""
+    values = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                values[parts[0].rstrip(':')] = int(parts[1]) / 1024
+    return {
+        'rss': round(values['Rss'], 1),
+        'pss': round(values['Pss'], 1),
+        'private': round(values['Private_Clean'] + values['Private_Dirty'], 1),
+    }
+
+
+def run_worker(ready_w, go_r, preloaded, models):
+    try:
+        import data_store
+        if preloaded:
+            import prefork
+            prefork.init_worker()
+        else:
+            data_store.preload(**models)
+
+        import app
+        client = app.app.test_client()
+        for path, body in WARMUP_REQUESTS:
+            client.post(path, json=body)
+    finally:
+        os.write(ready_w, b'.')
+    os.read(go_r, 1)
+    os._exit(0)
+
+
+def measure(workers, preloaded, models):
+    if preloaded:
+        # Like gunicorn's preload_app: import the app in the master as well
+        import app  # noqa: F401
+        import prefork
+        prefork.prepare_master(**models)
+
+    ready_r, ready_w = os.pipe()
+    go_r, go_w = os.pipe()
+    pids = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            run_worker(ready_w, go_r, preloaded, models)
+        pids.append(pid)
+
+    for _ in range(workers):
+        os.read(ready_r, 1)
+    time.sleep(0.2)
+    results = [read_memory(pid) for pid in pids]
+
+    os.write(go_w, b'.' * workers)
+    for pid in pids:
+        os.waitpid(pid, 0)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--mode', choices=['both', 'reload', 'prefork'], default='both')
+    parser.add_argument('--no-classifier', action='store_true', help='skip model.pkl/vectorizer.pkl')
+    parser.add_argument('--no-qa', action='store_true', help='skip the transformers QA model')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    args = parser.parse_args()
+
+    models = {'classifier': not args.no_classifier, 'qa': not args.no_qa}
+    modes = ['reload', 'prefork'] if args.mode == 'both' else [args.mode]
+    report = {}
+    for mode in modes:
+        # Run each mode from a fresh interpreter so the first cannot warm the second
+        pid = os.fork()
+        if pid == 0:
+            result = measure(args.workers, mode == 'prefork', models)
+            with open(f'.prefork_rss_{mode}.json', 'w') as f:
+                json.dump(result, f)
+            os._exit(0)
+        os.waitpid(pid, 0)
+        with open(f'.prefork_rss_{mode}.json') as f:
+            report[mode] = json.load(f)
+        os.remove(f'.prefork_rss_{mode}.json')
+
+    print(f"{'mode':<8} {'worker':>6} {'rss MiB':>9} {'pss MiB':>9} {'private MiB':>12}")
+    for mode, results in report.items():
+        for i, r in enumerate(results):
+            print(f"{mode:<8} {i:>6} {r['rss']:>9} {r['pss']:>9} {r['private']:>12}")
+        total_pss = sum(r['pss'] for r in results)
+        print(f"{mode:<8} {'total':>6} {'':>9} {round(total_pss, 1):>9}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    if not sys.platform.startswith('linux'):
+        sys.exit('prefork_rss needs fork() and /proc (Linux)')
+    main()
@@ -0,0 +1,65 @@
+import argparse
+import os
+import sys
+
+from benchmarks.bench_endpoints import BACKEND_DIR, prepare_data
+
+# Serves app.py on a synthetic dataset with Gemini, the QA pipeline and the
+# classifier replaced by local stubs with configurable latency.
+#
+#   cd Backend
+#   python -m benchmarks.stub_server --scale small --port 5050 --workers 4
+#
+# With --workers > 1 the app runs under gunicorn in pre-fork mode, otherwise
+# under the threaded Werkzeug server.
+
+
+def serve_gunicorn(application, port, workers, threads):
+    from gunicorn.app.base import BaseApplication
+    import prefork
+
+    class StubApplication(BaseApplication):
+        def load_config(self):
+            self.cfg.set('bind', f'127.0.0.1:{port}')
+            self.cfg.set('workers', workers)
+            self.cfg.set('worker_class', 'gthread')
+            self.cfg.set('threads', threads)
+            self.cfg.set('timeout', 120)
+            self.cfg.set('post_fork', lambda server, worker: prefork.init_worker())
+
+        def load(self):
+            return application
+
+    prefork.prepare_master(classifier=False, qa=False)
+    StubApplication().run()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve the backend with stubbed models')
+    parser.add_argument('--scale', default='small')
+    parser.add_argument('--data', help='dataset directory (default benchmarks/data/<scale>)')
+    parser.add_argument('--port', type=int, default=5050)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--gemini-latency', type=float, default=0.8, help='seconds per stub Gemini call')
+    parser.add_argument('--qa-latency', type=float, default=0.15, help='seconds per stub QA call')
+    args = parser.parse_args()
+
+    data_dir = os.path.abspath(args.data or os.path.join(BACKEND_DIR, 'benchmarks', 'data', args.scale))
+    prepare_data(data_dir, args.scale)
+    sys.path.insert(0, BACKEND_DIR)
+    os.chdir(data_dir)
+
+    from benchmarks import stubs
+    stubs.install(gemini_latency=args.gemini_latency, qa_latency=args.qa_latency)
+    import app
+
+    if args.workers > 1:
+        serve_gunicorn(app.app, args.port, args.workers, args.threads)
+    else:
+        from werkzeug.serving import run_simple
+        run_simple('127.0.0.1', args.port, app.app, threaded=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+import time
+
+# Deterministic local stand-ins for the remote Gemini API and the heavy
+# transformers / scikit-learn models, so benchmarks measure this code rather
+# than the network or model inference.
+
+
+class StubGeminiResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class StubGemini:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+
+    def generate_content(self, prompt):
+        if self.latency:
+            time.sleep(self.latency)
+        return StubGeminiResponse(f"Stub answer for a {len(prompt)} character prompt.")
+
+
+class StubQAPipeline:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+
+    def __call__(self, question, context):
+        if self.latency:
+            time.sleep(self.latency)
+        words = context.split()
+        return {'answer': ' '.join(words[:5]), 'score': 1.0}
+
+
+class StubVectorizer:
+    def transform(self, texts):
+        return texts
+
+
+class StubClassifier:
+    def predict(self, texts):
+        return ['Invoice' if 'invoice' in text.lower() else 'Contract' for text in texts]
+
+
+def install(gemini_latency=0.0, qa_latency=0.0, classifier=True):
+    """Register the stubs with data_store in place of the real models"""
+    import data_store
+    data_store.override_model('gemini', StubGemini(gemini_latency))
+    data_store.override_model('qa_pipeline', StubQAPipeline(qa_latency))
+    if classifier:
+        data_store.override_model('classifier', (StubClassifier(), StubVectorizer()))
@@ -0,0 +1,184 @@
+import argparse
+import json
+import os
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+# Synthetic invoice, employee and OCR data with the same schemas as
+# invoice_database.csv, Employee.xlsx, department.csv and the textBlocks
+# payloads sent by the app.
+#
+#   cd Backend
+#   python -m benchmarks.synthetic_data --scale medium --output benchmarks/data/medium
+
+# Preset sizes: (invoices, employees)
+SCALES = {
+    'small': (10_000, 100),
+    'medium': (100_000, 1_000),
+    'large': (1_000_000, 10_000),
+    'xlarge': (10_000_000, 100_000),
+}
+
+VENDORS = {
+    'Electronics': ['Vijay Sales', 'Mi Store', 'Croma', 'Reliance Digital', 'Samsung Store'],
+    'Food': ['Dominos', 'Pizza Hut', "McDonald's", 'Subway', 'KFC'],
+    'Medicine': ['Tata 1mg', '1mg Pharmacy', 'Netmeds', 'MedPlus', 'Apollo Pharmacy'],
+    'Miscellaneous': ['Amazon', 'Flipkart', 'Myntra', 'Jabong', 'Snapdeal'],
+    'Transport': ['Ola', 'BlaBlaCar', 'Lyft', 'Uber', 'Zoomcar'],
+}
+TYPES = list(VENDORS)
+LOCATIONS = [f'Sec {i}' for i in range(1, 21)]
+DEPARTMENTS = ['HR', 'Analytics', 'Finance', 'Engineering', 'Marketing']
+ROLES = ['Manager', 'Analyst', 'Executive', 'Consultant']
+FIRST_NAMES = ['Alice', 'John', 'Sarah', 'Michael', 'Emily', 'David', 'Emma', 'James', 'Olivia',
+               'William', 'Sophia', 'Daniel', 'Isabella', 'Matthew', 'Priya', 'Rahul', 'Ananya', 'Arjun']
+LAST_NAMES = ['Smith', 'Doe', 'Johnson', 'Brown', 'Davis', 'Wilson', 'Taylor', 'Anderson', 'Thomas',
+              'Jackson', 'White', 'Harris', 'Clark', 'Lewis', 'Sharma', 'Patel', 'Iyer', 'Gupta']
+
+# Item names per category that extract_invoice_details' keyword matching recognises
+ITEMS = {
+    'Food': ['Panner Pizza', 'Choco Lava', 'coffee', 'meal'],
+    'Transport': ['taxi', 'train ticket', 'bus pass', 'flight'],
+    'Medicine': ['Betnovate-N', 'Avomine', 'clinic visit', 'medicine'],
+    'Electronics': ['Macbook Air M3', 'Iphone 16', 'laptop', 'phone'],
+    'Miscellaneous': ['service charge', 'misc'],
+}
+
+FIRST_EMPLOYEE_ID = 1000
+
+
+def make_employees(n, rng):
+    """Employee table with the columns of Employee.xlsx"""
+    ids = np.arange(FIRST_EMPLOYEE_ID, FIRST_EMPLOYEE_ID + n)
+    department_id = rng.integers(1, len(DEPARTMENTS) + 1, n)
+    first = rng.choice(FIRST_NAMES, n)
+    last = rng.choice(LAST_NAMES, n)
+    base_package = rng.integers(40, 51, n) * 1000
+    scale = base_package / 40000
+
+    employees = pd.DataFrame({
+        'employee_id': ids,
+        'name': np.char.add(np.char.add(first, ' '), last),
+        'phone_no': 9876500000 + ids,
+        'dob': pd.to_datetime('1980-01-01') + pd.to_timedelta(rng.integers(0, 20 * 365, n), unit='D'),
+        'sex': rng.choice(['Male', 'Female'], n),
+        'department_id': department_id,
+        'department': np.array(DEPARTMENTS)[department_id - 1],
+        'role': rng.choice(ROLES, n),
+        'email': [f'{f.lower()}.{l[0].lower()}{i}@company.com' for f, l, i in zip(first, last, ids)],
+        'balance_money': rng.integers(37, 47, n) * 100,
+        'ctc': base_package + rng.integers(15, 25, n) * 1000,
+        'base_package': base_package,
+        'food_allowance': (2000 * scale).astype(int),
+        'transport_allowance': (4000 * scale).astype(int),
+        'medical_allowance': (4000 * scale).astype(int),
+        'electronics_allowance': (2000 * scale).astype(int),
+        'misc_allowance': (800 * scale).astype(int),
+        'debt_budget': rng.integers(23, 61, n) * 500,
+        'monthly_emi': rng.integers(500, 991, n),
+    })
+    return employees
+
+
+def make_departments(employees):
+    return employees[['employee_id', 'department_id', 'department']]
+
+
+def make_invoices(n, employee_ids, rng, start=None, end=None, first_invoice_id=100000):
+    """Invoice rows with the columns of invoice_database.csv
+
+    Dates run up to today so that "last month" queries find data.
+    """
+    end = end or date.today()
+    start = start or end - timedelta(days=3 * 365)
+    days = (end - start).days
+
+    type_codes = rng.integers(0, len(TYPES), n)
+    vendor_codes = rng.integers(0, 5, n)
+    vendors = np.array([VENDORS[t] for t in TYPES])[type_codes, vendor_codes]
+    dates = pd.Timestamp(start) + pd.to_timedelta(rng.integers(0, days + 1, n), unit='D')
+
+    return pd.DataFrame({
+        'employee_id': rng.choice(employee_ids, n),
+        'amount': rng.integers(100, 5000, n),
+        'date': dates.strftime('%d-%m-%Y'),
+        'location': np.array(LOCATIONS)[rng.integers(0, len(LOCATIONS), n)],
+        'invoice_id': first_invoice_id + rng.permutation(n),
+        'type': np.array(TYPES)[type_codes],
+        'vendor': vendors,
+    })
+
+
+def make_ocr_payload(invoice, name, rng, extra_blocks=0):
+    """A textBlocks document, as sent by the app's OCR, for one invoice row"""
+    day, month, year = (int(part) for part in invoice['date'].split('-'))
+    item = rng.choice(ITEMS[invoice['type']])
+    texts = [
+        f"vendor : {invoice['vendor']}",
+        f"Issued to: {name}",
+        f"Employee ld: {invoice['employee_id']}",
+        f"Date Issued: {day}-{month}-{year}",
+        f"Invoice No. {invoice['invoice_id']}",
+        f"Address: {invoice['location']}",
+        f"1 x {item}",
+    ]
+    texts += [f"Note line {i}: thank you for shopping with us" for i in range(extra_blocks)]
+    texts += ['GRAND TOTAL', f"Rs {invoice['amount']}"]
+
+    return {
+        'textBlocks': [
+            {'blockText': text, 'lines': [{'lineText': line} for line in text.split('\n')]}
+            for text in texts
+        ]
+    }
+
+
+def write_dataset(output, n_invoices, n_employees, seed=0, n_ocr=200, chunk_size=1_000_000):
+    """Write the invoice CSV, employee workbook, departments and OCR samples to output"""
+    rng = np.random.default_rng(seed)
+    os.makedirs(output, exist_ok=True)
+
+    employees = make_employees(n_employees, rng)
+    employees.to_excel(os.path.join(output, 'Employee.xlsx'), index=False)
+    make_departments(employees).to_csv(os.path.join(output, 'department.csv'), index=False)
+
+    # Invoices are generated and written in chunks to keep memory flat at 10M rows
+    invoice_path = os.path.join(output, 'invoice_database.csv')
+    ids = employees['employee_id'].to_numpy()
+    id_order = rng.permutation(n_invoices)
+    for start in range(0, n_invoices, chunk_size):
+        size = min(chunk_size, n_invoices - start)
+        chunk = make_invoices(size, ids, rng)
+        chunk['invoice_id'] = 100000 + id_order[start:start + size]
+        chunk.to_csv(invoice_path, mode='w' if start == 0 else 'a', header=start == 0, index=False)
+
+    names = dict(zip(employees['employee_id'], employees['name']))
+    sample = make_invoices(n_ocr, ids, rng, first_invoice_id=100000 + n_invoices)
+    with open(os.path.join(output, 'ocr_payloads.jsonl'), 'w') as f:
+        for invoice in sample.to_dict(orient='records'):
+            payload = make_ocr_payload(invoice, names[invoice['employee_id']], rng)
+            f.write(json.dumps(payload) + '\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic MintBolt dataset')
+    parser.add_argument('--scale', choices=SCALES, default='small')
+    parser.add_argument('--invoices', type=int, help='override the number of invoices')
+    parser.add_argument('--employees', type=int, help='override the number of employees')
+    parser.add_argument('--output', help='directory to write to (default benchmarks/data/<scale>)')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    n_invoices, n_employees = SCALES[args.scale]
+    n_invoices = args.invoices or n_invoices
+    n_employees = args.employees or n_employees
+    output = args.output or os.path.join('benchmarks', 'data', args.scale)
+
+    write_dataset(output, n_invoices, n_employees, seed=args.seed)
+    print(f"Wrote {n_invoices} invoices and {n_employees} employees to {output}")
+
+
+if __name__ == '__main__':
+    main()
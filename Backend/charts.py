@@ -0,0 +1,297 @@
+import base64
+import colorsys
+import io
+import math
+import os
+import threading
+
+import numpy as np
+from matplotlib import colormaps, rcParams
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.cm import ScalarMappable
+from matplotlib.colors import Normalize
+from matplotlib.figure import Figure
+from matplotlib.font_manager import FontProperties
+
+from instrumentation import stage
+
+# Chart rendering on reusable template figures.
+#
+# The charts used to be drawn through pyplot and seaborn: a new figure per
+# request, styled, laid out, saved and closed again. For charts this small,
+# building the figure and laying it out took as long as drawing it, and
+# pyplot.savefig() drew every figure twice (seaborn's heatmap a third time to
+# check its tick labels). Each chart type here is a class that builds its
+# figure once with the object-oriented API on an Agg canvas, with the title,
+# axis labels, legend, colorbar and layout that never change. render() only
+# replaces the data artists (bars, wedges, mesh and annotations, lines, table)
+# and the texts naming the employee, then draws the figure once into a PNG.
+# The charts look as they did with seaborn: its palettes, bar saturation,
+# heatmap ticks and annotation colours are reproduced here.
+#
+# A template is used by one render at a time. render() takes an idle template
+# of the chart type from a pool, or builds a new one, and puts it back when
+# done, so concurrent requests draw in parallel on separate figures. An idle
+# template holds the image buffer it last drew into, 3-4 MB, so at most
+# CHART_TEMPLATES idle templates are kept per chart type, and one of the
+# invoice table (15 MB at 300 dpi).
+
+templates_per_type = int(os.environ.get('CHART_TEMPLATES', '2'))
+
+_lock = threading.Lock()
+_idle = {}
+
+
+def render(chart_type, *args):
+    """Draw a chart on an idle template of its type and return the PNG as base64"""
+    with _lock:
+        idle = _idle.setdefault(chart_type, [])
+        chart = idle.pop() if idle else None
+    if chart is None:
+        chart = chart_type()
+    png = chart.render(*args)
+    # A render that raised may have left its figure half updated, so only finished ones go back
+    with _lock:
+        if len(idle) < min(templates_per_type, getattr(chart_type, 'max_idle', templates_per_type)):
+            idle.append(chart)
+    with stage('base64'):
+        return base64.b64encode(png).decode()
+
+
+def _figure(figsize, dpi=None):
+    figure = Figure(figsize=figsize, dpi=dpi)
+    FigureCanvasAgg(figure)
+    return figure, figure.add_subplot()
+
+
+def _png(figure, **kwargs):
+    buffer = io.BytesIO()
+    with stage('savefig'):
+        figure.savefig(buffer, format='png', **kwargs)
+    return buffer.getvalue()
+
+
+def palette(name, n):
+    """n colours spread over a colormap, as seaborn.color_palette(name, n) picks them"""
+    return colormaps[name](np.linspace(0, 1, n + 2)[1:-1])[:, :3]
+
+
+def desaturate(colors, proportion):
+    """Colours with their HLS saturation scaled by proportion, as seaborn's barplot draws them"""
+    result = []
+    for color in colors:
+        hue, lightness, saturation = colorsys.rgb_to_hls(*color)
+        result.append(colorsys.hls_to_rgb(hue, lightness, saturation * proportion))
+    return result
+
+
+def relative_luminance(colors):
+    """Relative luminance of RGBA colours, which decides seaborn's annotation colour"""
+    rgb = np.asarray(colors)[:, :3]
+    rgb = np.where(rgb <= .03928, rgb / 12.92, ((rgb + .055) / 1.055) ** 2.4)
+    return rgb.dot([.2126, .7152, .0722])
+
+
+class BarChart:
+    """Total expenses by category"""
+
+    def __init__(self):
+        self.figure, self.ax = _figure((12, 6))
+        self.ax.set_title('Total Expenses by Category')
+        self.ax.set_xlabel('type')
+        self.ax.set_ylabel('Total Amount')
+        self.ax.tick_params(axis='x', labelrotation=45)
+        self._bars = None
+
+    def render(self, totals):
+        """totals: amount per category in axis order, NaN for a category without invoices"""
+        if self._bars is not None:
+            self._bars.remove()
+        values = totals.to_numpy(dtype=float)
+        positions = np.arange(len(values))
+        drawn = ~np.isnan(values)
+        colors = np.array(desaturate(palette('viridis', len(values)), .75)).reshape(-1, 3)
+        self._bars = self.ax.bar(positions[drawn], values[drawn], width=0.8, color=colors[drawn])
+        self.ax.set_xticks(positions, [str(label) for label in totals.index])
+        self.ax.set_xlim(-.5, len(values) - .5)
+        self.ax.relim()
+        self.ax.autoscale_view(scalex=False)
+        return _png(self.figure)
+
+
+class VendorPieChart:
+    """Share of the top vendors in an employee's expenses"""
+
+    def __init__(self):
+        self.figure, self.ax = _figure((8, 8))
+        self.ax.set_title('Top 10 Vendor Expense Distribution')
+        self._artists = []
+
+    def render(self, totals):
+        """totals: amount per vendor, largest first"""
+        for artist in self._artists:
+            artist.remove()
+        wedges, texts, autotexts = self.ax.pie(totals, labels=totals.index, autopct='%1.1f%%', startangle=140,
+                                               colors=palette('viridis', len(totals)))
+        self._artists = [*wedges, *texts, *autotexts]
+        # Without the removed wedges in the data limits
+        self.ax.relim()
+        self.ax.axis('equal')
+        return _png(self.figure)
+
+
+class HeatmapChart:
+    """Expenses by category and location, annotated with the amounts"""
+
+    def __init__(self):
+        self.figure, self.ax = _figure((12, 8))
+        self._colors = ScalarMappable(Normalize(0, 1), colormaps['YlGnBu'])
+        colorbar = self.figure.colorbar(self._colors, ax=self.ax, label='Amount Spent')
+        colorbar.outline.set_linewidth(0)
+        for spine in self.ax.spines.values():
+            spine.set_visible(False)
+        self.ax.set_title('Expenses by Category and Location')
+        self.ax.set_xlabel('Location')
+        self.ax.set_ylabel('Category')
+        self._font = FontProperties(size=rcParams['xtick.labelsize'])
+        self._artists = []
+
+    def _ticks(self, labels, size):
+        """Tick positions and labels, thinned out as seaborn does when they would not fit"""
+        max_ticks = int(size / self.figure.dpi // (self._font.get_size_in_points() / 72))
+        if max_ticks < 1:
+            return [], []
+        every = len(labels) // max_ticks + 1
+        return np.arange(0, len(labels), every) + .5, [str(label) for label in labels[::every]]
+
+    def _overlap(self, labels, spacing):
+        """Whether labels centred spacing pixels apart would overlap"""
+        renderer = self.figure.canvas.get_renderer()
+        widths = [renderer.get_text_width_height_descent(label, self._font, ismath=False)[0] for label in labels]
+        return any((left + right) / 2 > spacing for left, right in zip(widths, widths[1:]))
+
+    def render(self, table):
+        """table: amounts with categories as rows and locations as columns"""
+        for artist in self._artists:
+            artist.remove()
+        values = table.to_numpy(dtype=float)
+        rows, columns = values.shape
+        self._colors.set_clim(np.nanmin(values), np.nanmax(values))
+        mesh = self.ax.pcolormesh(values, cmap=self._colors.cmap, norm=self._colors.norm, linewidths=0,
+                                  edgecolor='white')
+        self.ax.set_xlim(0, columns)
+        self.ax.set_ylim(rows, 0)
+
+        box = self.ax.get_position().transformed(self.figure.transFigure)
+        xticks, xlabels = self._ticks(table.columns, box.width)
+        yticks, ylabels = self._ticks(table.index, box.height)
+        rotate_x = self._overlap(xlabels, box.width / columns * (xticks[1] - xticks[0] if len(xticks) > 1 else 1))
+        rotate_y = self._overlap(ylabels, box.height / rows * (yticks[1] - yticks[0] if len(yticks) > 1 else 1))
+        self.ax.set_xticks(xticks, xlabels, rotation='vertical' if rotate_x else 'horizontal')
+        self.ax.set_yticks(yticks, ylabels, rotation='horizontal' if rotate_y else 'vertical', va='center')
+
+        colors = self._colors.to_rgba(values.ravel())
+        text_colors = np.where(relative_luminance(colors) > .408, '.15', 'w')
+        self._artists = [mesh]
+        for (row, column), value, color in zip(np.ndindex(rows, columns), values.flat, text_colors):
+            if not math.isnan(value):
+                self._artists.append(self.ax.text(column + .5, row + .5, f"{value:.1f}", color=color,
+                                                  ha='center', va='center'))
+        return _png(self.figure)
+
+
+class ForecastChart:
+    """An employee's monthly expenses with the ARIMA forecast after them"""
+
+    def __init__(self):
+        self.figure, self.ax = _figure((14, 8))
+        self.ax.xaxis_date()
+        self._history, = self.ax.plot([], [], color='blue', label='Historical Monthly Expenses')
+        self._forecast, = self.ax.plot([], [], color='orange', linestyle='--', label='Future Monthly Predictions')
+        self.ax.set_xlabel('Date')
+        self.ax.set_ylabel('Amount')
+        self._legend = self.ax.legend()
+
+    def render(self, employee_id, history, forecast):
+        """history and forecast: amounts indexed by month"""
+        self._history.set_data(history.index.to_numpy(), history.to_numpy())
+        self._forecast.set_data(forecast.index.to_numpy(), forecast.to_numpy())
+        history_label, forecast_label = self._legend.get_texts()
+        history_label.set_text(f'Historical Monthly Expenses (Employee {employee_id})')
+        forecast_label.set_text(f'Future Monthly Predictions (Employee {employee_id})')
+        self.ax.set_title(f'Historical and Future Monthly Expenses for Employee {employee_id}')
+        self.ax.relim()
+        self.ax.autoscale_view()
+        return _png(self.figure)
+
+
+CTC_LABELS = ['Base Salary', 'Food Allowance', 'Transport Allowance', 'Medical Allowance', 'Electronics Allowance',
+              'Miscellaneous Allowance', 'Monthly EMI']
+CTC_COLORS = ['#66b3ff', '#ff9999', '#99ff99', '#ffcc99', '#c2c2f0', '#ffb3e6', '#ff6666']
+
+
+class CtcChart:
+    """An employee's CTC breakdown as an exploded pie with a legend"""
+
+    explode = 0.1
+    start_angle = 90
+
+    def __init__(self):
+        self.figure, self.ax = _figure((10, 8))
+        self._wedges, _ = self.ax.pie(np.ones(len(CTC_LABELS)), startangle=self.start_angle, colors=CTC_COLORS,
+                                      explode=[self.explode] * len(CTC_LABELS))
+        self.ax.legend(CTC_LABELS, loc='upper left', bbox_to_anchor=(1, 1), fontsize='large')
+        self.ax.axis('equal')
+        # Lay the figure out once around the legend; tight_layout() would otherwise redo it on every save
+        self.figure.tight_layout()
+        self.figure.set_layout_engine('none')
+
+    def render(self, values):
+        """values: the amounts in CTC_LABELS order"""
+        values = np.asarray(values, dtype=float)
+        if (values < 0).any():
+            raise ValueError("Wedge sizes 'x' must be non negative values")
+        # The wedges are moved the way Axes.pie() places them
+        theta1 = self.start_angle / 360
+        for wedge, fraction in zip(self._wedges, values / values.sum()):
+            theta2 = theta1 + fraction
+            middle = math.pi * (theta1 + theta2)
+            wedge.set_center((self.explode * math.cos(middle), self.explode * math.sin(middle)))
+            wedge.set_theta1(360 * theta1)
+            wedge.set_theta2(360 * theta2)
+            theta1 = theta2
+        self.ax.relim()
+        self.ax.autoscale_view()
+        return _png(self.figure)
+
+
+INVOICE_TABLE_COLUMNS = {'invoice_id': 'Invoice ID', 'amount': 'Amount', 'date': 'Date', 'location': 'Location',
+                         'type': 'Type', 'vendor': 'Vendor'}
+
+
+class InvoiceTable:
+    """An employee's invoices as a table image"""
+
+    # Its 300 dpi image buffer is large
+    max_idle = 1
+
+    def __init__(self):
+        # Drawn at the resolution it is saved at, so its extent can be measured without drawing it first
+        self.figure, self.ax = _figure((10, 5), dpi=300)
+        self.ax.axis('tight')
+        self.ax.axis('off')
+        self._table = None
+
+    def render(self, employee_id, invoices):
+        """invoices: a frame with the INVOICE_TABLE_COLUMNS"""
+        if self._table is not None:
+            self._table.remove()
+        self.ax.set_title(f'Transaction List for Employee ID: {employee_id}', fontsize=16, fontweight='bold')
+        self._table = self.ax.table(cellText=invoices[list(INVOICE_TABLE_COLUMNS)].values,
+                                    colLabels=list(INVOICE_TABLE_COLUMNS.values()), cellLoc='center', loc='center')
+        self._table.auto_set_font_size(False)
+        self._table.set_fontsize(12)
+        self._table.scale(1.2, 1.2)
+        # The area bbox_inches='tight' would crop to; savefig() would draw the whole figure once to find it
+        bbox = self.figure.get_tightbbox(self.figure.canvas.get_renderer())
+        return _png(self.figure, bbox_inches=bbox.padded(rcParams['savefig.pad_inches']))
@@ -0,0 +1,133 @@
+import contextvars
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+from flask import Blueprint, request, jsonify
+
+import Query_2
+import Query_3
+import Query_5
+import out_of_core
+from data_store import get_employee_invoices, get_payroll
+from instrumentation import stage
+
+# Employee dashboard in one call.
+#
+# The app's home screen used to make a round trip per panel (/employee,
+# /net_worth, /ctc_chart, the three /api/expenses_by_* routes and /invoices),
+# each looking the employee up again. /dashboard looks up the employee's
+# payroll record and invoices once and builds every requested section from them.
+# With INVOICE_OUT_OF_CORE=1 the invoices are only loaded for the invoices
+# section; otherwise the expense totals are streamed from disk.
+# The expense breakdowns and each of the charts run concurrently on a small
+# thread pool; every chart is drawn on its own template figure (charts.py).
+# Each section has the same JSON as the route it replaces, or {"error": ...}.
+
+SECTIONS = ['employee', 'net_worth', 'ctc_chart', 'expenses_by_type', 'expenses_by_vendor',
+            'expenses_by_location', 'invoices']
+
+EXPENSE_SECTIONS = {
+    'expenses_by_type': ('type', 'Expense Type'),
+    'expenses_by_vendor': ('vendor', 'Vendor'),
+    'expenses_by_location': ('location', 'Location'),
+}
+
+workers = int(os.environ.get('DASHBOARD_WORKERS', '4'))
+
+bp = Blueprint('dashboard', __name__)
+
+_executor = None
+_executor_pid = None
+
+
+def _get_executor():
+    global _executor, _executor_pid
+    # Threads do not survive fork(), so every worker process gets its own pool
+    if _executor_pid != os.getpid():
+        _executor = ThreadPoolExecutor(workers, thread_name_prefix='dashboard')
+        _executor_pid = os.getpid()
+    return _executor
+
+
+def _submit(fn, *args):
+    # Run in a copy of the request's context so stages are attributed to /dashboard
+    return _get_executor().submit(contextvars.copy_context().run, fn, *args)
+
+
+# Function to build the expense breakdown sections from one set of totals
+def expense_sections(employee_id, invoices, names):
+    if invoices is None:
+        totals = Query_2.employee_totals(employee_id)
+    else:
+        with stage('aggregate'):
+            totals = Query_2.frame_totals(invoices)
+    if totals is None:
+        return {name: {"error": f"No data found for employee {employee_id}"} for name in names}
+    return {name: Query_2.totals_to_records(totals[column], label)
+            for name, (column, label) in zip(names, (EXPENSE_SECTIONS[name] for name in names))}
+
+
+# Function to keep the invoices dated last month, in date order as /invoices lists them
+def last_month_invoices(invoices):
+    first_day, last_day = (pd.Timestamp(day).normalize() for day in Query_5.last_month_range())
+    dates = invoices['date']
+    invoices = invoices[(dates >= first_day) & (dates <= last_day)].sort_values('date', kind='stable')
+    return invoices.assign(date=invoices['date'].dt.date)
+
+
+# Function to draw the chart sections
+def chart_sections(employee_id, pay, invoices, names):
+    sections = {}
+    for name in names:
+        try:
+            if name == 'ctc_chart':
+                sections[name] = {"employee_id": employee_id, "ctc_chart": Query_3.render_ctc_chart(pay)}
+                continue
+            recent = last_month_invoices(invoices)
+            if recent.empty:
+                sections[name] = {"error": f"No invoices found for employee ID {employee_id} in the last month."}
+            else:
+                sections[name] = {"image": Query_5.render_invoices_table(employee_id, recent)}
+        except Exception as e:
+            sections[name] = {"error": str(e)}
+    return sections
+
+
+@bp.route('/dashboard', methods=['POST'])
+def dashboard():
+    data = request.get_json()
+    employee_id = data.get('employee_id', data.get('emp_id'))
+    sections = data.get('sections', SECTIONS)
+
+    if not employee_id:
+        return jsonify({"error": "Employee ID not provided"}), 400
+    if not isinstance(sections, list) or any(name not in SECTIONS for name in sections):
+        return jsonify({"error": f"sections must be a list of: {', '.join(SECTIONS)}"}), 400
+
+    # Look up the employee and their invoices once for every section
+    pay = get_payroll().record(employee_id)
+    if pay is None:
+        return jsonify({"error": "Employee not found"}), 404
+    expenses = [name for name in SECTIONS if name in sections and name in EXPENSE_SECTIONS]
+    if 'invoices' in sections or (expenses and not out_of_core.enabled):
+        invoices = get_employee_invoices(employee_id)
+    else:
+        invoices = None
+
+    futures = []
+    if expenses:
+        futures.append(_submit(expense_sections, employee_id, invoices, expenses))
+    for name in SECTIONS:
+        if name in sections and name in ('ctc_chart', 'invoices'):
+            futures.append(_submit(chart_sections, employee_id, pay, invoices, [name]))
+
+    response = {"employee_id": employee_id}
+    if 'employee' in sections:
+        response['employee'] = Query_3.employee_summary(employee_id, pay)
+    if 'net_worth' in sections:
+        response['net_worth'] = Query_3.net_worth_summary(employee_id, pay)
+    for future in futures:
+        response.update(future.result())
+
+    return jsonify(response), 200
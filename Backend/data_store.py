@@ -0,0 +1,404 @@
+import os
+import threading
+
+import joblib
+import numpy as np
+import pandas as pd
+
+import out_of_core
+from duplicate_index import DuplicateIndex
+from expense_anomaly import AnomalyScorer
+from invoice_ingest import (InvoiceLog, compact_frame, concat_frames, from_day_numbers, load_invoices,
+                            memory_footprint, read_checkpoint, rows_to_frame, WalTailer)
+from name_index import TrigramIndex
+from online_classifier import OnlineClassifier
+from payroll import Payroll, employee_key
+from spend_cube import SpendCube
+from time_index import EmployeeTimeIndex
+
+# Shared data and model layer: every service reads the invoice and employee
+# tables and the models from here, so a process holds exactly one copy.
+# Everything is loaded lazily on first use, or up front by preload() in a
+# pre-fork master. Background threads are per process and only ever start
+# in the process that serves requests.
+
+employee_file = 'Employee.xlsx'
+department_file = 'department.csv'
+model_file = 'model/model.pkl'
+vectorizer_file = 'model/vectorizer.pkl'
+# 'pickle' for model.pkl + vectorizer.pkl, 'online' for the trainable hashing classifier
+classifier_mode = os.environ.get('CLASSIFIER_MODE', 'pickle')
+
+_lock = threading.RLock()
+_invoices = None
+_wal_position = None
+_invoice_tailer = None
+_tailer_pid = None
+_invoice_log = None
+_invoice_log_pid = None
+_employee_rows = None
+_time_indexes = {}
+_invoice_listeners = []
+_employee_versions = {}
+_data_version = 0
+_spend_cube = None
+_name_indexes = {}
+_duplicate_index = None
+_duplicate_wal_position = None
+_duplicate_tailer_pid = None
+_anomaly_scorer = None
+_departments = None
+_employees = None
+_payroll = None
+_models = {}
+
+
+def _load_once(name, loader):
+    if name not in _models:
+        with _lock:
+            if name not in _models:
+                _models[name] = loader()
+    return _models[name]
+
+
+# Invoice data
+def _load_invoice_frame():
+    global _invoices, _wal_position
+    if _invoices is None:
+        with _lock:
+            if _invoices is None:
+                _invoices, _wal_position = load_invoices()
+
+
+def get_invoices():
+    """The full invoice frame in the compact schema, kept up to date from the WAL
+
+    Dates are int32 day numbers here; take_invoices() and
+    get_employee_invoices() return rows with regular datetime dates.
+    """
+    global _invoice_tailer, _tailer_pid
+    _load_invoice_frame()
+    # Threads do not survive fork(), so each worker starts its own tailer
+    if _tailer_pid != os.getpid():
+        with _lock:
+            if _tailer_pid != os.getpid():
+                _invoice_tailer = WalTailer(_apply_new_invoices, _wal_position).start()
+                _tailer_pid = os.getpid()
+    return _invoices
+
+
+def _get_employee_rows():
+    """Positions of each employee's rows in the invoice frame, built in one pass"""
+    global _employee_rows
+    if _employee_rows is None:
+        _load_invoice_frame()
+        with _lock:
+            if _employee_rows is None:
+                _employee_rows = dict(_invoices.groupby('employee_id').indices)
+    return _employee_rows
+
+
+def take_invoices(rows):
+    """Invoice rows at the given positions, with dates decoded to datetime64"""
+    df = get_invoices().take(rows)
+    df['date'] = from_day_numbers(df['date']).values
+    return df
+
+
+def get_employee_rows(employee_ids):
+    """Positions of the given employees' invoices in the invoice frame, in file order"""
+    employee_rows = _get_employee_rows()
+    rows = [employee_rows[e] for e in employee_ids if e in employee_rows]
+    return np.sort(np.concatenate(rows)) if rows else np.array([], dtype='int64')
+
+
+def get_employee_invoices(employee_id):
+    """The employee's invoices in file order"""
+    rows = _get_employee_rows().get(employee_key(employee_id))
+    return take_invoices(np.array([], dtype='int64') if rows is None else rows)
+
+
+def get_time_index(employee_id):
+    """The employee's EmployeeTimeIndex, built on first use and dropped when they get new invoices"""
+    employee_id = employee_key(employee_id)
+    index = _time_indexes.get(employee_id)
+    if index is not None:
+        return index
+    get_invoices()
+    employee_rows = _get_employee_rows()
+    with _lock:
+        df = _invoices
+        rows = employee_rows.get(employee_id)
+    if rows is None:
+        return EmployeeTimeIndex(df, np.array([], dtype='int64'))
+    index = EmployeeTimeIndex(df, rows)
+    with _lock:
+        # Only cache it if no rows for this employee arrived while building
+        if employee_rows.get(employee_id) is rows:
+            _time_indexes[employee_id] = index
+    return index
+
+
+def _apply_new_invoices(rows):
+    global _invoices
+    new_invoices = rows_to_frame(rows)
+    with _lock:
+        offset = len(_invoices)
+        _invoices = concat_frames([_invoices, new_invoices])
+        new_rows_by_employee = new_invoices.groupby('employee_id').indices
+        if _employee_rows is not None:
+            for employee_id, new_rows in new_rows_by_employee.items():
+                existing = _employee_rows.get(employee_id, np.array([], dtype='int64'))
+                _employee_rows[employee_id] = np.concatenate((existing, new_rows + offset))
+                _time_indexes.pop(employee_id, None)
+        _bump_versions(new_rows_by_employee)
+        appended = _invoices.iloc[offset:]
+        listeners = list(_invoice_listeners)
+    for listener in listeners:
+        listener(appended)
+
+
+def subscribe_invoices(listener, seen_rows):
+    """Call listener with every slice of rows appended to the invoice frame after the first seen_rows"""
+    with _lock:
+        if len(_invoices) > seen_rows:
+            listener(_invoices.iloc[seen_rows:])
+        _invoice_listeners.append(listener)
+
+
+def get_spend_cube():
+    """The department spend cube, built on first use and kept current as invoices arrive"""
+    global _spend_cube
+    if _spend_cube is None:
+        _load_invoice_frame()
+        df = _invoices
+        cube = SpendCube(df, get_departments())
+        with _lock:
+            if _spend_cube is None:
+                subscribe_invoices(cube.add_invoices, len(df))
+                _spend_cube = cube
+    return _spend_cube
+
+
+def get_name_index(column):
+    """Trigram index over the distinct values of an invoice column, kept current as invoices arrive"""
+    index = _name_indexes.get(column)
+    if index is None and out_of_core.enabled:
+        # The table is only streamed from disk; names this process adds are kept by the index itself
+        totals, _ = out_of_core.aggregate([column])
+        with _lock:
+            index = _name_indexes.setdefault(column, TrigramIndex(totals[column].index))
+    elif index is None:
+        # get_invoices() starts the WAL tailer, so names added by other workers arrive too
+        df = get_invoices()
+        index = TrigramIndex(df[column].unique())
+        with _lock:
+            if column not in _name_indexes:
+                subscribe_invoices(lambda appended: index.add(appended[column].unique()), len(df))
+                _name_indexes[column] = index
+            index = _name_indexes[column]
+    return index
+
+
+def get_duplicate_index():
+    """Keys of every stored invoice for duplicate checks, kept current as invoices arrive"""
+    global _duplicate_index, _duplicate_wal_position, _duplicate_tailer_pid
+    if _duplicate_index is None:
+        index = DuplicateIndex()
+        if out_of_core.enabled:
+            # Rows the chunks already include are added again by the tailer below, which is harmless
+            position = (read_checkpoint()['generation'], 0, 0)
+            for chunk in out_of_core.iter_invoice_chunks():
+                index.add_frame(compact_frame(chunk))
+            with _lock:
+                if _duplicate_index is None:
+                    _duplicate_index = index
+                    _duplicate_wal_position = position
+        else:
+            df = get_invoices()
+            index.add_frame(df)
+            with _lock:
+                if _duplicate_index is None:
+                    subscribe_invoices(index.add_frame, len(df))
+                    _duplicate_index = index
+    # Out of core nothing else follows the WAL, so the index has its own tailer for other workers' uploads
+    if out_of_core.enabled and _duplicate_tailer_pid != os.getpid():
+        with _lock:
+            if _duplicate_tailer_pid != os.getpid():
+                index = _duplicate_index
+                WalTailer(lambda rows: index.add_frame(rows_to_frame(rows)), _duplicate_wal_position).start()
+                _duplicate_tailer_pid = os.getpid()
+    return _duplicate_index
+
+
+def get_anomaly_scorer():
+    """Per-employee amount statistics for anomaly scoring, bootstrapped from the invoice table and kept current"""
+    global _anomaly_scorer
+    if _anomaly_scorer is None:
+        scorer = AnomalyScorer()
+        if out_of_core.enabled:
+            for chunk in out_of_core.iter_invoice_chunks():
+                scorer.bootstrap(compact_frame(chunk))
+            with _lock:
+                if _anomaly_scorer is None:
+                    _anomaly_scorer = scorer
+        else:
+            df = get_invoices()
+            scorer.bootstrap(df)
+            with _lock:
+                if _anomaly_scorer is None:
+                    subscribe_invoices(scorer.add_invoices, len(df))
+                    _anomaly_scorer = scorer
+    return _anomaly_scorer
+
+
+def get_invoice_log():
+    global _invoice_log, _invoice_log_pid
+    if _invoice_log_pid != os.getpid():
+        with _lock:
+            if _invoice_log_pid != os.getpid():
+                _invoice_log = InvoiceLog()
+                _invoice_log_pid = os.getpid()
+    return _invoice_log
+
+
+def ingest_status():
+    """Visibility lag of WAL rows applied to this process's invoice frame"""
+    get_invoices()
+    return _invoice_tailer.stats.snapshot()
+
+
+def invoice_memory():
+    """Memory held by this process's invoice table, per column"""
+    return memory_footprint(get_invoices())
+
+
+def append_invoice(row):
+    """Durably log a new invoice row and make it visible to this process right away"""
+    record = get_invoice_log().append(row)
+    if _tailer_pid == os.getpid():
+        _invoice_tailer.wake()
+    # Out of core nothing follows the WAL, so the scorer only learns this process's own invoices
+    if out_of_core.enabled and _anomaly_scorer is not None:
+        _anomaly_scorer.add_invoices(rows_to_frame([row]))
+    return record
+
+
+def _bump_versions(employee_ids):
+    global _data_version
+    for employee_id in employee_ids:
+        _employee_versions[employee_id] = _employee_versions.get(employee_id, 0) + 1
+    _data_version += 1
+
+
+def employee_version(employee_id):
+    """Counter that changes whenever the employee's invoices or employee row change in this process"""
+    return _employee_versions.get(employee_id, 0)
+
+
+def data_version():
+    """Counter that changes whenever any invoice or employee data changes in this process"""
+    return _data_version
+
+
+# Employee data
+def get_departments():
+    global _departments
+    if _departments is None:
+        with _lock:
+            if _departments is None:
+                _departments = pd.read_csv(department_file)
+    return _departments
+
+
+def get_employees():
+    global _employees
+    if _employees is None:
+        with _lock:
+            if _employees is None:
+                _employees = pd.read_excel(employee_file)
+    return _employees
+
+
+def get_payroll():
+    """Derived pay figures for the current employee table, with O(1) lookups by employee id"""
+    global _payroll
+    if _payroll is None:
+        employees = get_employees()
+        with _lock:
+            if _payroll is None:
+                _payroll = Payroll(employees)
+    return _payroll
+
+
+def find_employee(employee_id):
+    """Return the employee's row as a Series, or None if the id is unknown"""
+    payroll = get_payroll()
+    position = payroll.position(employee_id)
+    if position is None:
+        return None
+    return payroll.employees.iloc[position]
+
+
+def update_employee(employee_id, **values):
+    """Update one employee in memory and write the table back to Excel"""
+    global _employees, _payroll
+    employee_id = employee_key(employee_id)
+    with _lock:
+        df = get_employees().copy()
+        match = df['employee_id'] == employee_id
+        for column, value in values.items():
+            df[column] = df[column].where(~match, value)
+        df.to_excel(employee_file, index=False)
+        _employees = df
+        _payroll = Payroll(df)
+        _bump_versions([employee_id])
+
+
+# Models
+def override_model(name, model):
+    """Replace a model ('classifier', 'qa_pipeline' or 'gemini'), e.g. with a stub in benchmarks"""
+    with _lock:
+        _models[name] = model
+
+
+def get_classifier():
+    """The document classifier and its vectorizer"""
+    def load():
+        if classifier_mode == 'online':
+            classifier = OnlineClassifier.load()
+            return classifier, classifier.vectorizer
+        return joblib.load(model_file), joblib.load(vectorizer_file)
+    return _load_once('classifier', load)
+
+
+def get_qa_pipeline():
+    def load():
+        from transformers import pipeline
+        return pipeline("question-answering")
+    return _load_once('qa_pipeline', load)
+
+
+def get_gemini_model():
+    def load():
+        import google.generativeai as genai
+        api_key = os.environ.get('GOOGLE_API_KEY')
+        if not api_key:
+            raise RuntimeError("GOOGLE_API_KEY is not set; export the Gemini API key to use /chat and /get_expenses_summary")
+        genai.configure(api_key=api_key)
+        return genai.GenerativeModel('gemini-pro')
+    return _load_once('gemini', load)
+
+
+def preload(classifier=True, qa=True):
+    """Load all read-only state now, without starting any background threads"""
+    # Out of core, the invoice table is only ever streamed from disk
+    if not out_of_core.enabled:
+        _load_invoice_frame()
+        _get_employee_rows()
+        get_spend_cube()
+    get_payroll()
+    if classifier:
+        get_classifier()
+    if qa:
+        get_qa_pipeline()
@@ -0,0 +1,243 @@
+import hashlib
+import math
+import os
+import threading
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import instrumentation
+from instrumentation import registry
+from name_index import words
+
+# Duplicate invoice detection.
+#
+# Every stored invoice has a 64-bit key hashed from (invoice_id, vendor,
+# amount, date), with the vendor compared as name_index.words() sees it. The
+# keys are kept in a sorted uint64 array (8 bytes an invoice) plus a small set
+# of recent keys, fronted by a Bloom filter: most uploads are new, and a new
+# key is rejected by the filter after a few bit probes without touching the
+# exact index. A filter hit is confirmed against the exact index, so false
+# positives never flag an invoice. The filter is rebuilt twice as large when
+# the table outgrows it.
+#
+# A receipt that OCR writes out differently the second time (other case or
+# spacing, a 0 for an o) can extract to different fields. It is caught by a
+# fingerprint of the receipt text: a hash of its words with case, spacing,
+# punctuation and digits misread inside words normalised away
+# (name_index.words()). Similarity hashes such as SimHash cannot tell
+# receipts this short apart: two receipts from one vendor differ in only a
+# few words. Receipt text is not stored in the invoice table, so
+# fingerprints cover the last DUPLICATE_TEXT_MAX uploads this process has
+# seen.
+#
+# A check records the invoice as it looks it up, under one lock, so the same
+# receipt submitted twice in one burst is caught too. If the invoice is then
+# not stored, forget() removes its key from the exact index wherever it is by
+# then. Bits cannot be cleared from a Bloom filter, so forgotten keys are kept
+# as tombstones and the filter is rebuilt from the exact keys once there are
+# tombstone_max of them. Set
+# DUPLICATE_CHECK_ENABLED=0 to turn detection off (load tests replay the same
+# receipts).
+
+enabled = os.environ.get('DUPLICATE_CHECK_ENABLED', '1') != '0'
+text_max = int(os.environ.get('DUPLICATE_TEXT_MAX', '100000'))
+bloom_error_rate = float(os.environ.get('DUPLICATE_BLOOM_ERROR_RATE', '0.001'))
+recent_max = 65536
+tombstone_max = 1024
+
+registry.describe('mintbolt_duplicate_total', 'counter',
+                  'Invoice duplicate checks by result (new, exact, text).')
+
+_MIX = np.uint64(0x9E3779B97F4A7C15)
+_EPOCH = datetime(1970, 1, 1)
+
+
+def _hash(values):
+    return pd.util.hash_array(np.asarray(values))
+
+
+def _hash_string(value):
+    return int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def key_hashes(invoice_ids, vendors, amounts, days):
+    """64-bit keys of invoices given as arrays; vendors are hashed vendor keys"""
+    keys = _hash(np.asarray(invoice_ids, dtype='int64'))
+    for values in (vendors, _hash(np.asarray(amounts, dtype='int64')), _hash(np.asarray(days, dtype='int64'))):
+        keys = (keys * _MIX) ^ values
+    return keys
+
+
+def vendor_hashes(vendors):
+    return np.array([_hash_string(' '.join(words(vendor))) for vendor in vendors], dtype=np.uint64)
+
+
+def frame_keys(df):
+    """Keys of the invoices in a compact frame (see invoice_ingest.compact_frame)"""
+    vendors = df['vendor'].astype('category')
+    # Hash each distinct vendor once
+    per_vendor = vendor_hashes(vendors.cat.categories)
+    return key_hashes(df['invoice_id'].to_numpy(), per_vendor[vendors.cat.codes.to_numpy()],
+                      df['amount'].to_numpy(), df['date'].to_numpy())
+
+
+def row_key(row):
+    """Key of one invoice row as normalise_invoice() returns it"""
+    day = (datetime.strptime(row['date'], '%d-%m-%Y') - _EPOCH).days
+    return int(key_hashes([row['invoice_id']], vendor_hashes([row['vendor']]), [row['amount']], [day])[0])
+
+
+class TextFingerprint:
+    """text_fingerprint() of a receipt fed one block at a time, as if the blocks were joined with newlines"""
+
+    def __init__(self):
+        self._hash = hashlib.blake2b(digest_size=8)
+        self._empty = True
+
+    def feed(self, text):
+        block_words = words(text)
+        if block_words:
+            self._hash.update(((' ' if not self._empty else '') + ' '.join(block_words)).encode('utf-8'))
+            self._empty = False
+
+    def value(self):
+        return None if self._empty else int.from_bytes(self._hash.digest(), 'little')
+
+
+def text_fingerprint(text):
+    """64-bit hash of a receipt's normalised words, or None for a receipt without any"""
+    fingerprint = TextFingerprint()
+    fingerprint.feed(text)
+    return fingerprint.value()
+
+
+class BloomFilter:
+    """Bit array answering 'maybe present' or 'certainly absent' for 64-bit keys"""
+
+    def __init__(self, capacity, error_rate):
+        self.capacity = max(capacity, 1024)
+        self.size = math.ceil(-self.capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.probes = max(round(self.size / self.capacity * math.log(2)), 1)
+        self.bits = np.zeros((self.size + 7) // 8, dtype=np.uint8)
+
+    def _positions(self, keys):
+        # Double hashing: probe i is low + i * high
+        keys = np.asarray(keys, dtype=np.uint64)
+        low, high = keys & np.uint64(0xFFFFFFFF), (keys >> np.uint64(32)) | np.uint64(1)
+        probes = np.arange(self.probes, dtype=np.uint64)
+        return (low[:, None] + probes * high[:, None]) % np.uint64(self.size)
+
+    def add(self, keys):
+        positions = self._positions(keys).ravel()
+        np.bitwise_or.at(self.bits, positions >> np.uint64(3),
+                         np.left_shift(1, positions & np.uint64(7)).astype(np.uint8))
+
+    def contains(self, keys):
+        positions = self._positions(keys)
+        return ((self.bits[positions >> np.uint64(3)] >> (positions & np.uint64(7)).astype(np.uint8)) & 1).all(axis=1)
+
+
+class DuplicateIndex:
+    """Exact keys of every stored invoice and text fingerprints of recent uploads"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sorted = np.empty(0, dtype=np.uint64)
+        self._recent = set()
+        self._bloom = BloomFilter(0, bloom_error_rate)
+        # Forgotten keys whose bits are still set in the Bloom filter
+        self._tombstones = set()
+        self._texts = {}
+
+    def __len__(self):
+        return len(self._sorted) + len(self._recent)
+
+    def add_frame(self, df):
+        """Record the invoices of a compact frame"""
+        keys = frame_keys(df)
+        with self._lock:
+            self._add_keys(keys)
+
+    def _add_keys(self, keys):
+        keys = np.asarray(keys, dtype=np.uint64)
+        if self._tombstones:
+            self._tombstones.difference_update(keys.tolist())
+        if len(self) + len(keys) > self._bloom.capacity:
+            self._merge(keys)
+            self._rebuild_bloom()
+            return
+        self._bloom.add(keys)
+        if len(keys) > 1024:
+            self._merge(keys)
+        else:
+            self._recent.update(keys.tolist())
+            if len(self._recent) > recent_max:
+                self._merge(np.empty(0, dtype=np.uint64))
+
+    def _rebuild_bloom(self):
+        """A new filter over the exact keys only, twice the size of the index"""
+        self._merge(np.empty(0, dtype=np.uint64))
+        self._bloom = BloomFilter(2 * len(self), bloom_error_rate)
+        self._bloom.add(self._sorted)
+        self._tombstones = set()
+
+    def _merge(self, keys):
+        recent = np.fromiter(self._recent, dtype=np.uint64, count=len(self._recent))
+        self._sorted = np.union1d(self._sorted, np.concatenate((recent, keys)))
+        self._recent = set()
+
+    def _has_key(self, key):
+        if not self._bloom.contains([key])[0]:
+            return False
+        if key in self._recent:
+            return True
+        position = np.searchsorted(self._sorted, np.uint64(key))
+        return position < len(self._sorted) and int(self._sorted[position]) == key
+
+    def _add_text(self, fingerprint, invoice_id):
+        self._texts[fingerprint] = invoice_id
+        if len(self._texts) > text_max:
+            # Dicts keep insertion order, so the first fingerprint is the oldest
+            del self._texts[next(iter(self._texts))]
+
+    def check(self, row, fingerprint, record=True):
+        """None if the invoice is new, else {'match': 'exact' or 'text', 'invoice_id': ...}
+
+        fingerprint is the receipt's text_fingerprint(), or None. With
+        record=True a new invoice is recorded in the same step; undo it with
+        forget() if it is not stored after all.
+        """
+        key = row_key(row)
+        with self._lock:
+            if self._has_key(key):
+                result = {'match': 'exact', 'invoice_id': row['invoice_id']}
+            elif fingerprint is not None and fingerprint in self._texts:
+                result = {'match': 'text', 'invoice_id': self._texts[fingerprint]}
+            else:
+                result = None
+            if result is None and record:
+                self._add_keys([key])
+                if fingerprint is not None:
+                    self._add_text(fingerprint, row['invoice_id'])
+        if instrumentation.enabled:
+            registry.inc('mintbolt_duplicate_total', (('result', 'new' if result is None else result['match']),))
+        return result
+
+    def forget(self, row, fingerprint):
+        """Undo a check() that recorded an invoice which was then not stored"""
+        key = row_key(row)
+        with self._lock:
+            if key in self._recent:
+                self._recent.discard(key)
+            else:
+                # Merged into the sorted keys since it was recorded
+                position = np.searchsorted(self._sorted, np.uint64(key))
+                if position < len(self._sorted) and int(self._sorted[position]) == key:
+                    self._sorted = np.delete(self._sorted, position)
+            self._tombstones.add(key)
+            if len(self._tombstones) >= tombstone_max:
+                self._rebuild_bloom()
+            if fingerprint is not None and self._texts.get(fingerprint) == row['invoice_id']:
+                del self._texts[fingerprint]
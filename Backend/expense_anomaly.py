@@ -0,0 +1,213 @@
+import math
+import os
+import threading
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+from invoice_ingest import INVOICE_COLUMNS, from_day_numbers
+
+# Anomaly scoring of expenses as they are ingested.
+#
+# For every employee the scorer keeps running statistics of invoice amounts
+# per expense type and per vendor: the count, the mean and the sum of squared
+# deviations from it (M2). New invoices update them with Welford's method, so
+# scoring and updating are O(1) however long the history is. The bootstrap
+# from the invoice table sums each chunk with a groupby and merges the chunk
+# statistics with Chan et al.'s parallel formula, which gives the same figures
+# as adding the invoices one by one. Statistics are kept in sorted arrays like
+# the keys in duplicate_index.py, 32 bytes per employee and type and per
+# employee and vendor.
+#
+# A new invoice is scored before it is added: the number of standard
+# deviations its amount lies above the employee's mean for its type, or for
+# its vendor, whichever is higher. The spread is at least ANOMALY_MIN_SPREAD
+# times the mean, so an employee who always pays the same amount is not
+# flagged for paying a little more. A group is only scored once it has
+# ANOMALY_MIN_COUNT invoices. Invoices scoring ANOMALY_Z or more are kept in
+# a list of the last ANOMALY_RECENT_MAX anomalies.
+#
+# Set ANOMALY_SCORING_ENABLED=0 to turn scoring off.
+
+enabled = os.environ.get('ANOMALY_SCORING_ENABLED', '1') != '0'
+z_threshold = float(os.environ.get('ANOMALY_Z', '3.0'))
+min_count = int(os.environ.get('ANOMALY_MIN_COUNT', '5'))
+min_spread = float(os.environ.get('ANOMALY_MIN_SPREAD', '0.1'))
+recent_max = int(os.environ.get('ANOMALY_RECENT_MAX', '1000'))
+
+# Columns an employee's invoices are grouped by
+GROUPINGS = ('type', 'vendor')
+# Groups added since the arrays were last rebuilt, per grouping
+new_max = 65536
+
+
+def merge_stats(a, b):
+    """Combine (count, mean, m2) of two disjoint sets of amounts; works on scalars and arrays alike"""
+    count = a[0] + b[0]
+    delta = b[1] - a[1]
+    return count, a[1] + delta * b[0] / count, a[2] + b[2] + delta * delta * a[0] * b[0] / count
+
+
+class GroupStats:
+    """(count, mean, m2) of the amounts of each group of one grouping
+
+    A group is an employee id and a value code packed into one int64 key.
+    Keys are kept in a sorted array with the statistics in parallel arrays,
+    32 bytes a group, plus a dict of groups first seen since the arrays were
+    last rebuilt.
+    """
+
+    def __init__(self):
+        self.codes = {}
+        self._keys = np.empty(0, dtype=np.int64)
+        self._stats = (np.empty(0, dtype=np.int64), np.empty(0), np.empty(0))
+        self._new = {}
+
+    def __len__(self):
+        return len(self._keys) + len(self._new)
+
+    def code(self, value):
+        """Code of a type or vendor, assigned on first use"""
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.codes)
+        return code
+
+    def key(self, employee_id, value):
+        """Key of a group, or None if the value was never seen"""
+        code = self.codes.get(value)
+        return None if code is None else (employee_id << 24) | code
+
+    def _position(self, key):
+        position = int(self._keys.searchsorted(key))
+        if position < len(self._keys) and self._keys.item(position) == key:
+            return position
+        return None
+
+    def get(self, key):
+        stats = self._new.get(key)
+        if stats is not None:
+            return stats
+        position = self._position(key)
+        if position is None:
+            return None
+        counts, means, m2s = self._stats
+        return counts.item(position), means.item(position), m2s.item(position)
+
+    def add(self, key, amount):
+        """Welford's update of one group with one amount"""
+        position = None if key in self._new else self._position(key)
+        stats = self.get(key) if position is None else tuple(values.item(position) for values in self._stats)
+        count, mean, m2 = stats if stats is not None else (0, 0.0, 0.0)
+        count += 1
+        delta = amount - mean
+        mean += delta / count
+        m2 += delta * (amount - mean)
+        if position is None:
+            self._new[key] = (count, mean, m2)
+            if len(self._new) > new_max:
+                self._rebuild()
+        else:
+            for values, value in zip(self._stats, (count, mean, m2)):
+                values[position] = value
+
+    def _rebuild(self):
+        new, self._new = self._new, {}
+        if new:
+            counts, means, m2s = zip(*new.values())
+            self.merge(np.fromiter(new, dtype=np.int64, count=len(new)), np.array(counts), np.array(means),
+                       np.array(m2s))
+
+    def merge(self, keys, counts, means, m2s):
+        """Add the statistics of distinct groups, merging those already present"""
+        self._rebuild()
+        keys = np.concatenate((self._keys, keys))
+        order = np.argsort(keys, kind='stable')
+        keys = keys[order]
+        stats = [np.concatenate((old, new))[order] for old, new in zip(self._stats, (counts, means, m2s))]
+        # Each key is in the arrays at most twice, the second copy right after the first
+        repeated = np.flatnonzero(keys[1:] == keys[:-1])
+        if len(repeated):
+            merged = merge_stats([values[repeated] for values in stats], [values[repeated + 1] for values in stats])
+            for values, value in zip(stats, merged):
+                values[repeated] = value
+            keep = np.ones(len(keys), dtype=bool)
+            keep[repeated + 1] = False
+            keys = keys[keep]
+            stats = [values[keep] for values in stats]
+        self._keys, self._stats = keys, tuple(stats)
+
+
+class AnomalyScorer:
+    """Per-employee amount statistics by type and vendor, and the recent anomalies found with them"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._groups = {column: GroupStats() for column in GROUPINGS}
+        self._recent = deque(maxlen=recent_max)
+
+    def bootstrap(self, invoices):
+        """Add a compact invoice frame to the statistics without scoring its invoices"""
+        if not len(invoices):
+            return
+        amounts = invoices['amount'].to_numpy('float64')
+        employee_ids = invoices['employee_id'].to_numpy('int64')
+        with self._lock:
+            for column, groups in self._groups.items():
+                values = invoices[column].astype('category')
+                codes = np.array([groups.code(value) for value in values.cat.categories], dtype=np.int64)
+                keys = (employee_ids << 24) | codes[values.cat.codes.to_numpy()]
+                by_key = pd.Series(amounts).groupby(keys)
+                counts = by_key.count()
+                groups.merge(counts.index.to_numpy(), counts.to_numpy(), by_key.mean().to_numpy(),
+                             (by_key.var(ddof=0) * counts).to_numpy())
+
+    def _group_score(self, column, employee_id, value, amount):
+        groups = self._groups[column]
+        key = groups.key(employee_id, value)
+        stats = groups.get(key) if key is not None else None
+        if stats is None or stats[0] < min_count:
+            return None
+        count, mean, m2 = stats
+        std = math.sqrt(m2 / (count - 1))
+        spread = max(std, min_spread * abs(mean), 1.0)
+        return {'score': round((amount - mean) / spread, 2), 'by': column, 'mean': round(mean, 2),
+                'std': round(std, 2), 'invoices': count}
+
+    def score(self, row):
+        """{'score', 'by', 'mean', 'std', 'invoices'} if the invoice row is unusually large, else None"""
+        with self._lock:
+            return self._score(row)
+
+    def _score(self, row):
+        best = None
+        for column in GROUPINGS:
+            result = self._group_score(column, row['employee_id'], row[column], row['amount'])
+            if result is not None and (best is None or result['score'] > best['score']):
+                best = result
+        if best is None or best['score'] < z_threshold:
+            return None
+        return best
+
+    def add_invoices(self, invoices):
+        """Score newly appended invoice rows (a compact frame) in order, then add each to the statistics"""
+        dates = from_day_numbers(invoices['date']).strftime('%d-%m-%Y').tolist()
+        columns = {column: dates if column == 'date' else invoices[column].tolist() for column in INVOICE_COLUMNS}
+        with self._lock:
+            for values in zip(*columns.values()):
+                row = dict(zip(columns, values))
+                result = self._score(row)
+                if result is not None:
+                    self._recent.append({**row, **result})
+                for column, groups in self._groups.items():
+                    groups.add((row['employee_id'] << 24) | groups.code(row[column]), row['amount'])
+
+    def recent(self, employee_id=None, limit=100):
+        """The latest anomalies first, optionally for one employee only"""
+        with self._lock:
+            anomalies = list(self._recent)
+        anomalies.reverse()
+        if employee_id is not None:
+            anomalies = [anomaly for anomaly in anomalies if anomaly['employee_id'] == employee_id]
+        return anomalies[:limit]
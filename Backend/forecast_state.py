@@ -0,0 +1,96 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from statsmodels.tsa.arima.model import ARIMA
+
+from instrumentation import stage
+
+# Fitted ARIMA state per forecast series.
+#
+# Fitting ARIMA means estimating its parameters, which runs the Kalman filter
+# over the whole history many times. Here the parameters are estimated once
+# per series and kept with the filter state at the end of the last complete
+# period. When the series grows, only the new periods are run through the
+# filter (results.extend), so a forecast costs about the same however long the
+# history is. The last period is usually still filling up with invoices, so it
+# is filtered fresh on every call and never becomes part of the kept state.
+#
+# The parameters are re-estimated from the full history after
+# FORECAST_REFIT_PERIODS new periods or FORECAST_REFIT_SECONDS, whichever
+# comes first, and straight away when an earlier period changes (a backdated
+# invoice) so the kept state no longer matches the data.
+
+refit_periods = int(os.environ.get('FORECAST_REFIT_PERIODS', '12'))
+refit_seconds = float(os.environ.get('FORECAST_REFIT_SECONDS', '86400'))
+max_series = int(os.environ.get('FORECAST_MAX_SERIES', '4096'))
+
+_states = OrderedDict()
+_lock = threading.Lock()
+
+
+class _State:
+    """Filter results over the complete periods of a series, with the data they were filtered on"""
+
+    def __init__(self, results, series, fitted_at, extended=0):
+        self.results = results
+        self.index = series.index
+        self.values = series.to_numpy(dtype='float64')
+        self.fitted_at = fitted_at
+        self.extended = extended
+
+    def matches(self, series):
+        """Whether series starts with exactly the periods this state was filtered on"""
+        n = len(self.values)
+        return (len(series) > n and series.index[:n].equals(self.index)
+                and np.array_equal(series.to_numpy(dtype='float64')[:n], self.values))
+
+    def due(self):
+        return self.extended >= refit_periods or time.monotonic() - self.fitted_at >= refit_seconds
+
+
+def _get_state(key):
+    with _lock:
+        state = _states.get(key)
+        if state is not None:
+            _states.move_to_end(key)
+        return state
+
+
+def _set_state(key, state):
+    with _lock:
+        _states[key] = state
+        _states.move_to_end(key)
+        while len(_states) > max_series:
+            _states.popitem(last=False)
+
+
+def fitted_model(key, series, order=(1, 1, 1)):
+    """ARIMA results covering the whole series, refitted only when due
+
+    key names the series (e.g. ('monthly', employee_id)); series must have a
+    DatetimeIndex with a frequency. Raises ValueError when the model cannot
+    be fitted, like ARIMA.fit().
+    """
+    key = (key, order)
+    state = _get_state(key)
+
+    if state is None or state.due() or not state.matches(series):
+        with stage('arima_fit'):
+            results = ARIMA(series, order=order).fit()
+            if len(series) > 2:
+                # Filter state at the end of the last complete period, for later extends
+                complete = series.iloc[:-1]
+                _set_state(key, _State(ARIMA(complete, order=order).filter(results.params), complete,
+                                       time.monotonic()))
+        return results
+
+    with stage('arima_extend'):
+        completed = series.iloc[len(state.values):-1]
+        if len(completed):
+            state = _State(state.results.extend(completed), series.iloc[:-1], state.fitted_at,
+                           state.extended + len(completed))
+            _set_state(key, state)
+        return state.results.extend(series.iloc[-1:])
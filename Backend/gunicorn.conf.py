@@ -0,0 +1,39 @@
+import gc
+import multiprocessing
+import os
+
+# Production server for the consolidated backend:
+#   gunicorn -c gunicorn.conf.py app:app
+
+bind = '0.0.0.0:5000'
+workers = multiprocessing.cpu_count()
+worker_class = 'gthread'
+threads = 4
+timeout = 120  # ARIMA fits and Gemini calls can be slow
+
+# Pre-fork mode (see prefork.py): data and models are loaded once in the
+# master and shared copy-on-write. Set PREFORK=0 to load them per worker.
+preload_app = os.environ.get('PREFORK', '1') != '0'
+if preload_app:
+    gc.disable()
+
+# Workers share their metrics through this directory, so /metrics reports the
+# whole server (see instrumentation.py)
+os.environ.setdefault('METRICS_DIR', 'metrics')
+
+
+def on_starting(server):
+    import instrumentation
+    instrumentation.clear_metrics_dir()
+
+
+def when_ready(server):
+    if preload_app:
+        import prefork
+        prefork.prepare_master(qa=os.environ.get('PRELOAD_QA', '1') != '0')
+
+
+def post_fork(server, worker):
+    if preload_app:
+        import prefork
+        prefork.init_worker()
@@ -0,0 +1,276 @@
+import bisect
+import glob
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from flask import Request, Response, g, request
+
+# Request and stage timing for all services, exported in the Prometheus text
+# format on /metrics.
+#
+# init_app() adds middleware that counts requests and times them per route.
+# stage() times a named hot spot (JSON parsing, OCR correction, ARIMA fit,
+# savefig, ...) and attributes it to the route being served. Stages may nest;
+# a stage's time includes any stage called inside it. The JSON body is parsed
+# lazily, when the view first reads it, and timed as the parse_json stage, so
+# requests rejected before their view runs never parse it. Set
+# METRICS_ENABLED=0 to turn all recording off.
+#
+# Metrics are recorded per process. With METRICS_DIR set (gunicorn.conf.py
+# sets it), every worker also writes its metrics to <pid>.json there every
+# METRICS_FLUSH_SECONDS, and /metrics adds up the files of all workers, so a
+# scrape sees the whole server whichever worker answers it. Files of workers
+# that exited are kept, so counters never go backwards; a worker's last
+# METRICS_FLUSH_SECONDS of metrics are lost if it dies.
+
+enabled = os.environ.get('METRICS_ENABLED', '1') != '0'
+metrics_dir = os.environ.get('METRICS_DIR')
+flush_seconds = float(os.environ.get('METRICS_FLUSH_SECONDS', '1'))
+
+# Prometheus-style latency buckets in seconds
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_current_route = ContextVar('current_route', default='none')
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    """Counters and histograms keyed by metric name and label values"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._help = {}
+
+    def describe(self, name, kind, text):
+        self._help[name] = (kind, text)
+
+    def inc(self, name, labels, amount=1):
+        key = (name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, labels, value):
+        key = (name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def snapshot(self):
+        """({(name, labels): value}, {(name, labels): (counts, sum, count, buckets)}) as of now"""
+        with self._lock:
+            return (dict(self._counters),
+                    {key: (list(h.counts), h.sum, h.count, h.buckets) for key, h in self._histograms.items()})
+
+    def render(self, snapshot=None):
+        """Prometheus text exposition format, of this registry or of a (merged) snapshot"""
+        counters, histograms = snapshot or self.snapshot()
+        counters, histograms = sorted(counters.items()), sorted(histograms.items())
+
+        lines = []
+        described = set()
+
+        def header(name):
+            if name not in described and name in self._help:
+                kind, text = self._help[name]
+                lines.append(f'# HELP {name} {text}')
+                lines.append(f'# TYPE {name} {kind}')
+                described.add(name)
+
+        for (name, labels), value in counters:
+            header(name)
+            lines.append(f'{name}{_labels(labels)} {value}')
+
+        for (name, labels), (counts, total, count, buckets) in histograms:
+            header(name)
+            cumulative = 0
+            for bound, bucket_count in zip(buckets + ('+Inf',), counts):
+                cumulative += bucket_count
+                lines.append(f'{name}_bucket{_labels(labels + (("le", str(bound)),))} {cumulative}')
+            lines.append(f'{name}_sum{_labels(labels)} {total}')
+            lines.append(f'{name}_count{_labels(labels)} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels) + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+registry = Registry()
+registry.describe('mintbolt_requests_total', 'counter', 'Requests served, by route, method and status.')
+registry.describe('mintbolt_request_duration_seconds', 'histogram', 'Request latency by route.')
+registry.describe('mintbolt_stage_duration_seconds', 'histogram', 'Time spent in named stages, by route.')
+registry.describe('mintbolt_stage_errors_total', 'counter', 'Stages that raised, by route.')
+
+
+@contextmanager
+def stage(name):
+    """Time a named stage of the current request; also works as a decorator"""
+    if not enabled:
+        yield
+        return
+    start = time.perf_counter()
+    labels = (('route', _current_route.get()), ('stage', name))
+    try:
+        yield
+    except BaseException:
+        registry.inc('mintbolt_stage_errors_total', labels)
+        raise
+    finally:
+        registry.observe('mintbolt_stage_duration_seconds', labels, time.perf_counter() - start)
+
+
+def _before_request():
+    if metrics_dir and _flusher_pid != os.getpid():
+        _start_flusher()
+    g.metrics_start = time.perf_counter()
+    g.metrics_route = request.url_rule.rule if request.url_rule else 'unmatched'
+    g.metrics_token = _current_route.set(g.metrics_route)
+
+
+class TimedRequest(Request):
+    """Flask request whose JSON body parsing is timed as the parse_json stage"""
+
+    def get_json(self, *args, **kwargs):
+        with stage('parse_json'):
+            return super().get_json(*args, **kwargs)
+
+
+def _after_request(response):
+    g.metrics_status = response.status_code
+    return response
+
+
+def _teardown_request(exc):
+    start = g.pop('metrics_start', None)
+    if start is None:
+        return
+    route = g.pop('metrics_route')
+    elapsed = time.perf_counter() - start
+    status = g.pop('metrics_status', 500)
+    registry.inc('mintbolt_requests_total', (('route', route), ('method', request.method), ('status', str(status))))
+    registry.observe('mintbolt_request_duration_seconds', (('route', route), ('method', request.method)), elapsed)
+    try:
+        _current_route.reset(g.pop('metrics_token'))
+    except ValueError:
+        # Torn down in a different context than the one the request started in
+        _current_route.set('none')
+
+
+def _snapshot_to_json(snapshot):
+    counters, histograms = snapshot
+    return {'counters': [[name, labels, value] for (name, labels), value in counters.items()],
+            'histograms': [[name, labels, counts, total, count, buckets]
+                           for (name, labels), (counts, total, count, buckets) in histograms.items()]}
+
+
+def _labels_key(labels):
+    return tuple(tuple(pair) for pair in labels)
+
+
+def _merge_json(snapshot, data):
+    """Add the metrics of another worker, as written by _flush, to a snapshot"""
+    counters, histograms = snapshot
+    for name, labels, value in data['counters']:
+        key = (name, _labels_key(labels))
+        counters[key] = counters.get(key, 0) + value
+    for name, labels, counts, total, count, buckets in data['histograms']:
+        key = (name, _labels_key(labels))
+        if key in histograms:
+            old_counts, old_total, old_count, buckets = histograms[key]
+            counts = [a + b for a, b in zip(old_counts, counts)]
+            total, count = old_total + total, old_count + count
+        histograms[key] = (counts, total, count, tuple(buckets))
+
+
+def _flush():
+    path = os.path.join(metrics_dir, f'{os.getpid()}.json')
+    with open(path + '.tmp', 'w') as f:
+        json.dump(_snapshot_to_json(registry.snapshot()), f)
+    os.replace(path + '.tmp', path)
+
+
+_flusher_pid = None
+_flusher_lock = threading.Lock()
+
+
+def _start_flusher():
+    """Write this worker's metrics to METRICS_DIR periodically, from a thread started in the worker itself"""
+    global _flusher_pid
+    with _flusher_lock:
+        if _flusher_pid == os.getpid():
+            return
+        _flusher_pid = os.getpid()
+    os.makedirs(metrics_dir, exist_ok=True)
+
+    def run():
+        while True:
+            time.sleep(flush_seconds)
+            try:
+                _flush()
+            except OSError:
+                pass
+
+    threading.Thread(target=run, name='metrics-flush', daemon=True).start()
+
+
+def combined_snapshot():
+    """This process's metrics plus those every other worker last wrote to METRICS_DIR"""
+    snapshot = registry.snapshot()
+    own = os.path.join(metrics_dir, f'{os.getpid()}.json')
+    for path in glob.glob(os.path.join(metrics_dir, '*.json')):
+        if path == own:
+            continue
+        try:
+            with open(path) as f:
+                _merge_json(snapshot, json.load(f))
+        except (OSError, ValueError):
+            # Removed or being replaced meanwhile
+            continue
+    return snapshot
+
+
+def clear_metrics_dir():
+    """Remove the files of an earlier server run, before workers start"""
+    for path in glob.glob(os.path.join(metrics_dir, '*.json')):
+        os.remove(path)
+
+
+def metrics():
+    snapshot = combined_snapshot() if metrics_dir else None
+    return Response(registry.render(snapshot), mimetype='text/plain; version=0.0.4')
+
+
+def init_app(app):
+    """Add request timing middleware and the /metrics endpoint to a Flask app"""
+    if enabled:
+        app.request_class = TimedRequest
+        app.before_request(_before_request)
+        app.after_request(_after_request)
+        app.teardown_request(_teardown_request)
+    app.add_url_rule('/metrics', 'metrics', metrics, methods=['GET'])
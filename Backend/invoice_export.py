@@ -0,0 +1,99 @@
+import zlib
+
+import numpy as np
+import pandas as pd
+
+import data_store
+import out_of_core
+from invoice_ingest import INVOICE_COLUMNS
+
+# Streaming CSV export of the invoice table.
+#
+# Rows are selected, filtered and written a chunk at a time, so an export of
+# any size holds one chunk in memory. The header goes out before any rows are
+# read. With compression the chunks go through one gzip stream that is
+# sync-flushed after every chunk, so the client keeps receiving data as it is
+# produced.
+
+rows_per_chunk = 10_000
+
+
+class ExportFilters:
+    """Invoice filters for an export; None means no filter"""
+
+    def __init__(self, employee_id=None, department=None, start_date=None, end_date=None,
+                 expense_type=None, vendor=None):
+        self.employee_id = employee_id
+        self.department = department
+        self.start_date = start_date
+        self.end_date = end_date
+        self.expense_type = expense_type
+        self.vendor = vendor
+
+    def employee_ids(self):
+        """Employees the export is limited to, or None for everyone"""
+        ids = None
+        if self.department is not None:
+            departments = data_store.get_departments()
+            ids = set(departments.loc[departments['department'] == self.department, 'employee_id'].tolist())
+        if self.employee_id is not None:
+            ids = {self.employee_id} if ids is None else ids & {self.employee_id}
+        return ids
+
+    def apply(self, chunk):
+        """Rows of a chunk (with datetime dates) that pass the filters"""
+        mask = np.ones(len(chunk), dtype=bool)
+        if self.start_date is not None:
+            mask &= (chunk['date'] >= self.start_date).to_numpy()
+        if self.end_date is not None:
+            mask &= (chunk['date'] <= self.end_date).to_numpy()
+        if self.expense_type is not None:
+            mask &= (chunk['type'] == self.expense_type).to_numpy()
+        if self.vendor is not None:
+            mask &= (chunk['vendor'] == self.vendor).to_numpy()
+        return chunk[mask]
+
+
+def _memory_chunks(employee_ids):
+    if employee_ids is None:
+        total = len(data_store.get_invoices())
+        for start in range(0, total, rows_per_chunk):
+            yield data_store.take_invoices(np.arange(start, min(start + rows_per_chunk, total)))
+        return
+
+    employee_rows = data_store.get_employee_rows(sorted(employee_ids))
+    for start in range(0, len(employee_rows), rows_per_chunk):
+        yield data_store.take_invoices(employee_rows[start:start + rows_per_chunk])
+
+
+def _disk_chunks(employee_ids):
+    employee_id = next(iter(employee_ids)) if employee_ids is not None and len(employee_ids) == 1 else None
+    for chunk in out_of_core.iter_invoice_chunks(employee_id, rows_per_chunk=rows_per_chunk):
+        if employee_ids is not None:
+            chunk = chunk[chunk['employee_id'].isin(employee_ids)]
+        yield chunk.assign(date=pd.to_datetime(chunk['date'], format='%d-%m-%Y'))
+
+
+def iter_csv(filters):
+    """The export as CSV text, one chunk at a time, in the column layout of invoice_database.csv"""
+    yield ','.join(INVOICE_COLUMNS) + '\n'
+
+    employee_ids = filters.employee_ids()
+    if employee_ids is not None and not employee_ids:
+        return
+    chunks = _disk_chunks(employee_ids) if out_of_core.enabled else _memory_chunks(employee_ids)
+    for chunk in chunks:
+        chunk = filters.apply(chunk)
+        if len(chunk):
+            chunk = chunk.assign(date=chunk['date'].dt.strftime('%d-%m-%Y'))
+            yield chunk.to_csv(columns=INVOICE_COLUMNS, header=False, index=False)
+
+
+def gzip_stream(texts):
+    """Compress a stream of text into one gzip member, flushing after every piece"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for text in texts:
+        data = compressor.compress(text.encode('utf-8')) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
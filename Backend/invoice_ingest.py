@@ -0,0 +1,528 @@
+import csv
+import io
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+try:
+    import fcntl  # POSIX only; serialises WAL writers across worker processes
+except ImportError:
+    fcntl = None
+
+# Column order of invoice_database.csv
+INVOICE_COLUMNS = ['employee_id', 'amount', 'date', 'location', 'invoice_id', 'type', 'vendor']
+
+# In memory the invoice table is kept compact: strings are dictionary encoded
+# (pandas categoricals, so groupbys hash small integer codes), integers are
+# int32 where they fit and dates are int32 day numbers since 1970-01-01.
+CATEGORY_COLUMNS = ['location', 'type', 'vendor']
+INTEGER_COLUMNS = ['employee_id', 'amount', 'invoice_id']
+csv_chunk_size = 1_000_000
+
+csv_file = 'invoice_database.csv'
+checkpoint_file = 'invoice_wal.checkpoint'
+lock_file = 'invoice_wal.lock'
+# Compacted generations whose CSV byte range the checkpoint remembers, for tailers that fell behind
+compacted_kept = 64
+
+logger = logging.getLogger(__name__)
+
+
+def wal_path(generation):
+    return f'invoice_wal.{generation}.jsonl'
+
+
+# Function to turn the output of extract_invoice_details into a CSV row
+def normalise_invoice(details):
+    """Raises ValueError when a field needed by the invoice database is missing"""
+    def field(*keys):
+        for key in keys:
+            value = details.get(key)
+            if value not in (None, '', 'Not Found'):
+                return str(value).strip()
+        raise ValueError(f"Missing invoice field: {keys[0]}")
+
+    amount = re.sub(r'[^\d.]', '', field('amount', 'Total Amount'))
+    date = datetime.strptime(field('date', 'Date Issued'), '%d-%m-%Y')
+
+    return {
+        'employee_id': int(field('employee_id', 'Employee Id')),
+        'amount': int(float(amount)),
+        'date': date.strftime('%d-%m-%Y'),
+        'location': field('location', 'Location'),
+        'invoice_id': int(field('invoice_id', 'Invoice ID')),
+        'type': field('type', 'Expense Category'),
+        'vendor': field('Vendor', 'vendor'),
+    }
+
+
+def rows_to_frame(rows):
+    """Compact frame from invoice rows as they are written to the CSV and the WAL"""
+    return compact_frame(pd.DataFrame(rows, columns=INVOICE_COLUMNS))
+
+
+def compact_frame(df):
+    """Convert a frame read from the CSV (dates as dd-mm-yyyy strings) to the compact schema"""
+    columns = {}
+    for column in INVOICE_COLUMNS:
+        values = df[column]
+        if column == 'date':
+            columns[column] = to_day_numbers(values)
+        elif column in CATEGORY_COLUMNS:
+            columns[column] = values.astype('category')
+        else:
+            columns[column] = _int32(values)
+    return pd.DataFrame(columns, index=df.index)
+
+
+def _int32(values):
+    values = pd.to_numeric(values)
+    if len(values) and values.min() >= np.iinfo('int32').min and values.max() <= np.iinfo('int32').max:
+        return values.astype('int32')
+    return values
+
+
+def to_day_numbers(dates):
+    days = pd.to_datetime(dates, format='%d-%m-%Y').values.astype('datetime64[D]')
+    return pd.Series(days.astype('int64').astype('int32'), index=dates.index)
+
+
+def from_day_numbers(days):
+    """Day numbers back to datetime64 values"""
+    return pd.to_datetime(np.asarray(days, dtype='int64'), unit='D')
+
+
+def concat_frames(frames):
+    """Concatenate compact frames, merging the categories instead of falling back to strings
+
+    Existing codes keep their meaning; categories first seen in a later frame
+    are appended.
+    """
+    frames = [frame for frame in frames if len(frame)] or frames[:1]
+    if not frames:
+        return compact_frame(pd.DataFrame(columns=INVOICE_COLUMNS))
+    if len(frames) == 1:
+        return frames[0].reset_index(drop=True)
+    columns = {}
+    for column in INVOICE_COLUMNS:
+        if column in CATEGORY_COLUMNS:
+            columns[column] = union_categoricals([frame[column] for frame in frames])
+        else:
+            columns[column] = np.concatenate([frame[column].to_numpy() for frame in frames])
+    return pd.DataFrame(columns)
+
+
+def read_invoice_csv(csv_path=csv_file, chunk_size=csv_chunk_size):
+    """Read the invoice CSV chunk by chunk straight into the compact schema"""
+    chunks = pd.read_csv(csv_path, chunksize=chunk_size, dtype={column: 'category' for column in CATEGORY_COLUMNS})
+    return concat_frames([compact_frame(chunk) for chunk in chunks])
+
+
+def memory_footprint(df):
+    """Bytes held by each column of a frame, including the category dictionaries"""
+    usage = df.memory_usage(deep=True, index=False)
+    return {
+        'rows': len(df),
+        'columns': {column: int(size) for column, size in usage.items()},
+        'total_bytes': int(usage.sum()),
+    }
+
+
+def read_checkpoint():
+    try:
+        with open(checkpoint_file, encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {'seq': 0, 'generation': 0, 'csv_size': None}
+
+
+def _write_checkpoint(checkpoint):
+    tmp_path = checkpoint_file + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(checkpoint, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, checkpoint_file)
+
+
+def read_wal(path, offset=0, missing_ok=True):
+    """Return the complete records after byte offset and the offset to resume from"""
+    try:
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            data = f.read()
+    except FileNotFoundError:
+        if not missing_ok:
+            raise
+        return [], offset
+
+    # A torn last line belongs to a write that is still in progress
+    end = data.rfind(b'\n') + 1
+    records = []
+    for line in data[:end].splitlines():
+        try:
+            records.append(json.loads(line))
+        except ValueError:
+            continue
+    return records, offset + end
+
+
+# Function to load the compacted CSV plus the WAL records it does not contain yet
+def load_invoices(csv_path=csv_file):
+    """Returns the invoice frame and the WAL position (generation, offset, records) a WalTailer should resume from"""
+    # The checkpoint works as a seqlock: an odd seq means a compaction is
+    # rewriting the CSV, a changed seq means our read may be inconsistent
+    while True:
+        before = read_checkpoint()
+        if before['seq'] % 2 == 0:
+            df = read_invoice_csv(csv_path)
+            if read_checkpoint() == before:
+                break
+        time.sleep(0.01)
+
+    generation = before['generation']
+    records, offset = read_wal(wal_path(generation))
+    if records:
+        df = concat_frames([df, rows_to_frame([r['row'] for r in records])])
+    return df, (generation, offset, len(records))
+
+
+class _WalLock:
+    """Thread lock plus an flock so only one process touches the WAL at a time"""
+
+    def __init__(self):
+        self._thread_lock = threading.Lock()
+        self._file = None
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        if fcntl is not None:
+            self._file = open(lock_file, 'a')
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+        self._thread_lock.release()
+
+
+class IngestStats:
+    """Rolling ingest throughput and visibility lag figures"""
+
+    def __init__(self, window=1024):
+        self._lock = threading.Lock()
+        self.appended = 0
+        self.batches = 0
+        self.compactions = 0
+        self.applied = 0
+        self._batch_times = deque(maxlen=window)
+        self._fsync_seconds = deque(maxlen=window)
+        self._lags = deque(maxlen=window)
+
+    def record_batch(self, size, fsync_seconds):
+        with self._lock:
+            self.appended += size
+            self.batches += 1
+            self._batch_times.append((time.time(), size))
+            self._fsync_seconds.append(fsync_seconds)
+
+    def record_compaction(self):
+        with self._lock:
+            self.compactions += 1
+
+    def record_applied(self, records):
+        now = time.time()
+        with self._lock:
+            self.applied += len(records)
+            # Records recovered from the CSV carry no timestamp
+            self._lags.extend(now - r['ts'] for r in records if 'ts' in r)
+
+    def snapshot(self):
+        with self._lock:
+            batch_times = list(self._batch_times)
+            fsyncs = list(self._fsync_seconds)
+            lags = sorted(self._lags)
+
+        ingest_rate = 0.0
+        if len(batch_times) > 1:
+            elapsed = batch_times[-1][0] - batch_times[0][0]
+            if elapsed > 0:
+                ingest_rate = sum(size for _, size in batch_times[1:]) / elapsed
+
+        def lag_at(q):
+            return round(lags[min(len(lags) - 1, int(q * len(lags)))] * 1000, 3) if lags else None
+
+        return {
+            'appended': self.appended,
+            'batches': self.batches,
+            'avg_batch_size': round(self.appended / self.batches, 2) if self.batches else 0,
+            'avg_fsync_ms': round(sum(fsyncs) / len(fsyncs) * 1000, 3) if fsyncs else None,
+            'ingest_rate_per_sec': round(ingest_rate, 2),
+            'compactions': self.compactions,
+            'applied': self.applied,
+            'visibility_lag_ms': {'p50': lag_at(0.5), 'p95': lag_at(0.95), 'max': lag_at(1.0)},
+        }
+
+
+class InvoiceLog:
+    """Append-only write-ahead log for ingested invoices
+
+    Appends are group-committed: concurrent callers that arrive within
+    flush_interval share a single write and fsync. The log is folded into
+    the CSV every compact_every records or compact_interval seconds. An
+    append that is not durable within append_timeout seconds raises
+    TimeoutError.
+    """
+
+    def __init__(self, csv_path=csv_file, batch_size=256, flush_interval=0.005,
+                 compact_every=1000, compact_interval=300, append_timeout=30):
+        self.csv_path = csv_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.compact_every = compact_every
+        self.compact_interval = compact_interval
+        self.append_timeout = append_timeout
+        self.stats = IngestStats()
+
+        self._lock = _WalLock()
+        self._cond = threading.Condition()
+        self._pending = []
+        self._since_compact = 0
+        self._last_compact = time.time()
+
+        # Finish a compaction that was interrupted by a crash
+        with self._lock:
+            if read_checkpoint()['seq'] % 2:
+                self._compact_locked()
+
+        threading.Thread(target=self._run, name='invoice-wal', daemon=True).start()
+
+    def append(self, row, wait=True):
+        """Queue one invoice row; by default block until it is durable on disk"""
+        entry = {'record': {'ts': time.time(), 'row': row}, 'done': threading.Event(), 'error': None}
+        with self._cond:
+            self._pending.append(entry)
+            self._cond.notify()
+        if wait:
+            if not entry['done'].wait(self.append_timeout):
+                with self._cond:
+                    queued = entry in self._pending
+                    if queued:
+                        self._pending.remove(entry)
+                raise TimeoutError(f"Invoice WAL write did not finish within {self.append_timeout}s"
+                                   + ("" if queued else "; it may still be written"))
+            if entry['error'] is not None:
+                raise entry['error']
+        return entry['record']
+
+    def compact(self):
+        """Fold the current WAL generation into the CSV; returns the rows moved"""
+        with self._lock:
+            moved = self._compact_locked()
+        if moved:
+            self.stats.record_compaction()
+        self._since_compact = 0
+        self._last_compact = time.time()
+        return moved
+
+    def _run(self):
+        while True:
+            try:
+                self._run_once()
+            except Exception:
+                # This is the only writer thread: log and carry on rather than let appends hang
+                logger.exception("Error in the invoice WAL writer")
+                time.sleep(1.0)
+
+    def _run_once(self):
+        with self._cond:
+            if not self._pending:
+                self._cond.wait(timeout=1.0)
+            pending = bool(self._pending)
+
+        if pending:
+            # Linger briefly so that concurrent appends share one fsync
+            time.sleep(self.flush_interval)
+            with self._cond:
+                batch = self._pending[:self.batch_size]
+                del self._pending[:self.batch_size]
+            self._write_batch(batch)
+
+        if self._since_compact and (self._since_compact >= self.compact_every or
+                                    time.time() - self._last_compact >= self.compact_interval):
+            try:
+                self.compact()
+            except Exception:
+                # The records are still safe in the WAL; retry on the next round
+                logger.exception("Error compacting the invoice WAL")
+                self._last_compact = time.time()
+
+    def _write_batch(self, batch):
+        # A record that cannot be encoded fails on its own, not with the rest of the batch
+        lines = []
+        for entry in batch:
+            try:
+                lines.append(json.dumps(entry['record']) + '\n')
+            except (TypeError, ValueError) as e:
+                entry['error'] = e
+        written = [entry for entry in batch if entry['error'] is None]
+        try:
+            if written:
+                self._write_lines(''.join(lines), len(written))
+        except Exception as e:
+            if not isinstance(e, OSError):
+                logger.exception("Error writing the invoice WAL")
+            for entry in written:
+                entry['error'] = e
+
+        for entry in batch:
+            entry['done'].set()
+
+    def _write_lines(self, data, count):
+        with self._lock:
+            generation = read_checkpoint()['generation']
+            start = time.perf_counter()
+            with open(wal_path(generation), 'a', encoding='utf-8') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            self.stats.record_batch(count, time.perf_counter() - start)
+        self._since_compact += count
+
+    def _compact_locked(self):
+        checkpoint = read_checkpoint()
+        seq, generation = checkpoint['seq'], checkpoint['generation']
+        records, _ = read_wal(wal_path(generation))
+
+        compacted = checkpoint.get('compacted', [])
+        if seq % 2:
+            # A previous compaction died half-way: roll the CSV back and redo it
+            start = checkpoint['csv_size']
+            with open(self.csv_path, 'r+b') as f:
+                f.truncate(start)
+        elif not records:
+            return 0
+        else:
+            seq += 1
+            start = os.path.getsize(self.csv_path)
+            _write_checkpoint({'seq': seq, 'generation': generation, 'csv_size': start, 'compacted': compacted})
+
+        needs_newline = False
+        with open(self.csv_path, 'rb') as f:
+            if f.seek(0, os.SEEK_END):
+                f.seek(-1, os.SEEK_END)
+                needs_newline = f.read(1) != b'\n'
+        with open(self.csv_path, 'a', newline='', encoding='utf-8') as f:
+            if needs_newline:
+                f.write('\n')
+            writer = csv.writer(f)
+            for record in records:
+                writer.writerow([record['row'][column] for column in INVOICE_COLUMNS])
+            f.flush()
+            os.fsync(f.fileno())
+
+        # Where the generation's rows now are, so a tailer that missed its WAL file can read them from the CSV
+        compacted = (compacted + [[generation, start, os.path.getsize(self.csv_path)]])[-compacted_kept:]
+        _write_checkpoint({'seq': seq + 1, 'generation': generation + 1, 'csv_size': None,
+                           'compacted': compacted})
+
+        # Keep the generation just compacted so lagging tailers can drain it
+        try:
+            os.remove(wal_path(generation - 1))
+        except FileNotFoundError:
+            pass
+        return len(records)
+
+
+def read_compacted(generation, checkpoint, csv_path=csv_file):
+    """Rows of a compacted WAL generation, read back from the CSV; None if the checkpoint no longer knows them"""
+    for compacted_generation, start, end in checkpoint.get('compacted', []):
+        if compacted_generation == generation:
+            break
+    else:
+        return None
+    with open(csv_path, 'rb') as f:
+        header = f.readline()
+        f.seek(start)
+        data = f.read(end - start)
+    df = pd.read_csv(io.BytesIO(header + data), dtype={column: str for column in ['date'] + CATEGORY_COLUMNS},
+                     keep_default_na=False)
+    return df.to_dict('records')
+
+
+class WalTailer:
+    """Follows the WAL and hands newly ingested rows to a running service
+
+    A tailer that falls more than one compaction behind finds its generation's
+    WAL file deleted; it then reads the rows it has not applied yet back from
+    the CSV.
+    """
+
+    def __init__(self, callback, position, poll_interval=0.2):
+        self.callback = callback
+        # Records of the current generation already applied, to skip when reading it back from the CSV
+        self.generation, self.offset, self.applied = position
+        self.poll_interval = poll_interval
+        self.stats = IngestStats()
+        self._wake = threading.Event()
+
+    def start(self):
+        threading.Thread(target=self._run, name='invoice-wal-tailer', daemon=True).start()
+        return self
+
+    def wake(self):
+        self._wake.set()
+
+    def poll(self):
+        """Apply everything written since the last poll; returns the rows applied"""
+        applied = 0
+        while True:
+            # Once the checkpoint has moved on, the old generation is final
+            checkpoint = read_checkpoint()
+            moved_on = checkpoint['generation'] > self.generation
+            try:
+                records, self.offset = read_wal(wal_path(self.generation), self.offset, missing_ok=not moved_on)
+            except FileNotFoundError:
+                records = self._recover(checkpoint)
+            if records:
+                self.callback([r['row'] for r in records])
+                self.stats.record_applied(records)
+                self.applied += len(records)
+                applied += len(records)
+            if not moved_on:
+                return applied
+            self.generation += 1
+            self.offset = 0
+            self.applied = 0
+
+    def _recover(self, checkpoint):
+        """Records of the current generation not applied yet, read back from the CSV after its WAL file was deleted"""
+        rows = read_compacted(self.generation, checkpoint)
+        if rows is None:
+            logger.error("Invoice WAL generation %s was compacted too long ago to recover; its rows are missing",
+                         self.generation)
+            return []
+        logger.warning("Invoice WAL generation %s was deleted before it was applied; read %s rows back from the CSV",
+                       self.generation, len(rows) - self.applied)
+        return [{'row': row} for row in rows[self.applied:]]
+
+    def _run(self):
+        while True:
+            try:
+                self.poll()
+            except Exception:
+                logger.exception("Error applying invoice WAL")
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
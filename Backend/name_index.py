@@ -0,0 +1,137 @@
+import math
+import os
+import re
+import threading
+from collections import Counter
+
+# Fuzzy lookup of canonical vendor and location names.
+#
+# OCR reads names with small errors ("D0minos", "Sector 5" for "Sec 5") that
+# would otherwise become new groups in every vendor and location breakdown.
+# Names are split into lower-case words, letters misread as digits inside a
+# word are folded back (0 -> o, 1 -> l, ...) and each word is cut into padded
+# character trigrams. The score of a known name is the Dice coefficient of
+# the two trigram sets, 1.0 for the same name up to case, punctuation and OCR
+# digits. Numbers that are words of their own ("5" in "Sec 5") must agree, so
+# "Sec 6" never matches "Sec 5".
+#
+# An inverted index maps every trigram to the names that contain it. A name
+# scoring at least t shares at least ceil(t * n / (2 - t)) of the query's n
+# trigrams, so it contains one of the query's rarest n - ceil(t * n / (2 - t))
+# + 1 trigrams. Only those posting lists are read to find candidates, which
+# skips the long lists of common trigrams ("sto", "ore"). Candidates are
+# scored in order of how many of those lists they are in, and scoring stops
+# once the rest cannot beat the best match found.
+#
+# A query scoring at least NAME_MATCH_MIN_SCORE against a known name is mapped
+# to it; anything else is treated as a new canonical name and added.
+
+min_score = float(os.environ.get('NAME_MATCH_MIN_SCORE', '0.6'))
+
+_OCR_DIGITS = str.maketrans({'0': 'o', '1': 'l', '3': 'e', '5': 's', '8': 'b'})
+_WORD = re.compile(r'[a-z0-9]+')
+_WORD_AND_NUMBER = re.compile(r'([a-z]{2,})(\d+)')
+
+
+def words(name):
+    """Lower-case words of a name with OCR digit errors inside words folded back to letters"""
+    result = []
+    for word in _WORD.findall(str(name).lower().replace("'", '')):
+        if word.isalpha():
+            result.append(word)
+            continue
+        # "Sec5" is "Sec 5"
+        split = _WORD_AND_NUMBER.fullmatch(word)
+        if split:
+            result.extend(split.groups())
+        elif word.isdigit():
+            result.append(word)
+        else:
+            result.append(word.translate(_OCR_DIGITS))
+    return result
+
+
+def trigrams(name_words):
+    """Set of padded trigrams of a list of words"""
+    grams = set()
+    for word in name_words:
+        padded = f'  {word} '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class TrigramIndex:
+    """Canonical names of one column with a trigram inverted index over them"""
+
+    def __init__(self, names=()):
+        self.names = []
+        self._keys = {}
+        self._grams = []
+        self._numbers = []
+        self._postings = {}
+        self._lock = threading.Lock()
+        self.add(names)
+
+    def add(self, names):
+        """Add names not yet known as canonical names"""
+        with self._lock:
+            for name in names:
+                name_words = words(name)
+                key = ' '.join(name_words)
+                if not key or key in self._keys:
+                    continue
+                name_id = len(self.names)
+                grams = trigrams(name_words)
+                self.names.append(name)
+                self._keys[key] = name_id
+                self._grams.append(grams)
+                self._numbers.append({word for word in name_words if word.isdigit()})
+                for gram in grams:
+                    self._postings.setdefault(gram, []).append(name_id)
+
+    def match(self, name, threshold=None):
+        """(canonical name, score) of the best match scoring at least threshold (min_score by default),
+        or (None, 0.0) if no name can"""
+        name_words = words(name)
+        name_id = self._keys.get(' '.join(name_words))
+        if name_id is not None:
+            return self.names[name_id], 1.0
+
+        threshold = min_score if threshold is None else threshold
+        grams = trigrams(name_words)
+        if not grams:
+            return None, 0.0
+        # Every name that can reach the threshold contains one of the rarest few trigrams
+        rarest = sorted(grams, key=lambda gram: len(self._postings.get(gram, ())))
+        needed = max(math.ceil(threshold * len(grams) / (2 - threshold)), 1)
+        prefix = len(grams) - needed + 1
+        hits = Counter()
+        for gram in rarest[:prefix]:
+            hits.update(self._postings.get(gram, ()))
+
+        numbers = {word for word in name_words if word.isdigit()}
+        best, best_score = None, 0.0
+        # Most hits first; a name with h hits shares at most h + len(grams) - prefix trigrams
+        for name_id, count in hits.most_common():
+            shared = count + len(grams) - prefix
+            if 2 * shared / (len(grams) + shared) < max(best_score, threshold):
+                break
+            if numbers and self._numbers[name_id] and numbers != self._numbers[name_id]:
+                continue
+            other = self._grams[name_id]
+            score = 2 * len(grams & other) / (len(grams) + len(other))
+            if score > best_score:
+                best, best_score = name_id, score
+        if best is None or best_score < threshold:
+            return None, 0.0
+        return self.names[best], round(best_score, 4)
+
+    def canonical(self, name):
+        """(canonical name, score, outcome) for name; outcome is 'exact', 'matched' or 'new'"""
+        match, score = self.match(name)
+        if score == 1.0:
+            return match, score, 'exact'
+        if match is not None:
+            return match, score, 'matched'
+        self.add([name])
+        return name, score, 'new'
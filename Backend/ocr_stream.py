@@ -0,0 +1,283 @@
+import codecs
+import copy
+import json
+import os
+import re
+
+from werkzeug.exceptions import BadRequest, UnsupportedMediaType
+
+# Streaming ingestion of OCR documents.
+#
+# The OCR app posts {"textBlocks": [{"blockText": ..., "lines": [...]}, ...]}
+# and multi-page statements can carry tens of thousands of blocks. Instead of
+# request.get_json() building the whole tree and the extractors joining every
+# blockText into one string, OcrStream reads the request body in chunks and
+# yields the blocks one at a time; only the block being parsed is held in
+# memory. Every other top-level field is collected in OcrStream.fields.
+#
+# InvoiceExtractor is fed the blocks in order and finds the same fields as the
+# regular expressions did over the joined text. A match that reaches the end
+# of the text seen so far could still grow with the next block ("Issued to:"
+# at the end of one block, the name in the next), so it is only kept once the
+# next block shows where it ends. word_ngram_features() vectorises the blocks
+# for the classifier with the same n-grams the joined text had.
+#
+# Set OCR_STREAMING=0 to parse request bodies whole again.
+
+enabled = os.environ.get('OCR_STREAMING', '1') != '0'
+chunk_size = 64 * 1024
+
+FIELD_PATTERNS = {
+    'name': re.compile(r'Issued to:\s*(.*)'),
+    'vendor': re.compile(r'vendor\s*:\s*(.*)'),
+    'employee_id': re.compile(r'Employee ld:\s*(\d+)'),
+    'date': re.compile(r'Date Issued:\s*(\d{1,2}-\d{1,2}-\d{4})'),
+    'invoice_id': re.compile(r'(\d{6})'),
+    'location': re.compile(r'Address:\s*(.*)'),
+}
+# Free-text fields are stripped of surrounding whitespace
+STRIPPED_FIELDS = {'name', 'vendor', 'location'}
+
+_NUMBER_WITH_O = re.compile(r'\d+O\d*|\d*O\d+')
+_WHITESPACE = ' \t\r\n'
+
+
+def _correct_numbers(text):
+    for num in _NUMBER_WITH_O.findall(text):
+        text = text.replace(num, num.replace('O', '0'))
+    return text
+
+
+def correct_ocr_numbers(block):
+    """Fix letter O read in place of a zero inside numbers, in a block and its lines"""
+    block['blockText'] = _correct_numbers(block['blockText'])
+    for line in block['lines']:
+        line['lineText'] = _correct_numbers(line['lineText'])
+    return block
+
+
+class OcrStream:
+    """An OCR JSON document read incrementally from a byte stream"""
+
+    def __init__(self, stream):
+        self.fields = {}
+        self.has_blocks = False
+        self._stream = stream
+        self._utf8 = codecs.getincrementaldecoder('utf-8')()
+        self._decoder = json.JSONDecoder()
+        self._buffer = ''
+        self._pos = 0
+        self._eof = False
+
+    @classmethod
+    def from_request(cls, request):
+        """Stream the body of a Flask request, or parse it whole when streaming is off"""
+        if not request.is_json:
+            raise UnsupportedMediaType("Did not attempt to load JSON data because the request Content-Type was "
+                                       "not 'application/json'.")
+        if enabled:
+            return cls(request.stream)
+        return ParsedOcrDocument(request.get_json())
+
+    def _fill(self, size=chunk_size):
+        """Read more of the body into the buffer; False at the end of it"""
+        if self._eof:
+            return False
+        data = self._stream.read(size)
+        self._buffer = self._buffer[self._pos:]
+        self._pos = 0
+        if not data:
+            self._eof = True
+            self._buffer += self._utf8.decode(b'', final=True)
+            return False
+        self._buffer += self._utf8.decode(data)
+        return True
+
+    def _peek(self):
+        """Next non-whitespace character, or None at the end of the body"""
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos] in _WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                return None
+
+    def _expect(self, characters):
+        character = self._peek()
+        if character is None or character not in characters:
+            raise BadRequest(f"Failed to decode JSON object: expected one of {characters!r}")
+        self._pos += 1
+        return character
+
+    def _value(self):
+        self._peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError as e:
+                # Grow the read with the value so a large one is not decoded from scratch once per chunk
+                if self._fill(max(chunk_size, len(self._buffer))):
+                    continue
+                raise BadRequest(f"Failed to decode JSON object: {e}")
+            # A number at the end of the buffer may go on in the next chunk
+            if end == len(self._buffer) and self._fill():
+                continue
+            self._pos = end
+            return value
+
+    def blocks(self):
+        """Yield the textBlocks one at a time, collecting the other top-level fields on the way"""
+        self._expect('{')
+        if self._peek() == '}':
+            self._pos += 1
+        else:
+            while True:
+                key = self._value()
+                if not isinstance(key, str):
+                    raise BadRequest("Failed to decode JSON object: expected a key")
+                self._expect(':')
+                if key == 'textBlocks':
+                    self.has_blocks = True
+                    self._expect('[')
+                    if self._peek() == ']':
+                        self._pos += 1
+                    else:
+                        while True:
+                            yield self._value()
+                            if self._expect(',]') == ']':
+                                break
+                else:
+                    self.fields[key] = self._value()
+                if self._expect(',}') == '}':
+                    break
+        if self._peek() is not None:
+            raise BadRequest("Failed to decode JSON object: extra data after the document")
+
+
+class ParsedOcrDocument:
+    """The OcrStream interface over a document that was parsed whole"""
+
+    def __init__(self, data):
+        self.fields = {key: value for key, value in data.items() if key != 'textBlocks'}
+        self.has_blocks = 'textBlocks' in data
+        self._blocks = data.get('textBlocks', [])
+
+    def blocks(self):
+        return iter(self._blocks)
+
+
+class InvoiceExtractor:
+    """Invoice fields of a document fed one block text at a time"""
+
+    def __init__(self, category_mapping):
+        self.category_mapping = {category: [keyword.lower() for keyword in keywords]
+                                 for category, keywords in category_mapping.items()}
+        # Most blocks mention no keyword at all; one search rules them out
+        self._any_keyword = re.compile('|'.join(re.escape(keyword) for keywords in self.category_mapping.values()
+                                                for keyword in keywords))
+        self.expense_category = 'Miscellaneous'
+        self._found = {}
+        self._pending = {}
+        # Text of the blocks a match may still span, joined with newlines
+        self._window = None
+        self._after_grand_total = False
+        self._total = None
+
+    def feed(self, text):
+        window = text if self._window is None else self._window + '\n' + text
+        # Keep the text from the start of this block, or further back for a match that may still grow; a
+        # whitespace-only block keeps everything, as a pattern's \s* can run through it
+        keep = len(window) - len(text) if text.strip(_WHITESPACE) else 0
+        for name, pattern in FIELD_PATTERNS.items():
+            if name in self._found:
+                continue
+            match = pattern.search(window)
+            self._pending.pop(name, None)
+            if match is None:
+                continue
+            if match.end() == len(window):
+                self._pending[name] = match.group(1)
+                keep = min(keep, match.start())
+            else:
+                self._found[name] = match.group(1)
+        self._window = window[keep:]
+
+        # The largest number in the blocks after the first GRAND TOTAL block
+        if self._after_grand_total:
+            digits = re.sub(r'[^\d]', '', text)
+            if digits.isdigit():
+                self._total = max(self._total or 0, int(digits))
+        elif 'GRAND TOTAL' in text:
+            self._after_grand_total = True
+
+        # The last block that mentions a category's keyword decides the category
+        lowered = text.lower()
+        if not self._any_keyword.search(lowered):
+            return
+        for category, keywords in self.category_mapping.items():
+            if any(keyword in lowered for keyword in keywords):
+                self.expense_category = category
+                break
+
+    def fields(self):
+        """{field: value or 'Not Found'} plus total_amount and expense_category"""
+        found = {**self._pending, **self._found}
+        fields = {}
+        for name in FIELD_PATTERNS:
+            value = found.get(name)
+            if value is not None and name in STRIPPED_FIELDS:
+                value = value.strip()
+            fields[name] = 'Not Found' if value is None else value
+        fields['total_amount'] = str(self._total) if self._total is not None else 'Not Found'
+        fields['expense_category'] = self.expense_category
+        return fields
+
+
+def _batches(texts, size):
+    """texts joined with spaces into pieces of about size characters"""
+    batch, length = [], 0
+    for text in texts:
+        batch.append(text)
+        length += len(text) + 1
+        if length >= size:
+            yield ' '.join(batch)
+            batch, length = [], 0
+    if batch:
+        yield ' '.join(batch)
+
+
+def _word_ngrams(vectorizer, texts):
+    """The word n-grams vectorizer's analyzer would produce for ' '.join(texts)"""
+    preprocess = vectorizer.build_preprocessor()
+    tokenize = vectorizer.build_tokenizer()
+    stop_words = vectorizer.get_stop_words()
+    min_n, max_n = vectorizer.ngram_range
+    history = []
+    for text in texts:
+        tokens = tokenize(preprocess(text))
+        if stop_words is not None:
+            tokens = [token for token in tokens if token not in stop_words]
+        if min_n == 1:
+            yield from tokens
+        # N-grams may start in earlier blocks but end in this one
+        window = history + tokens
+        for n in range(max(min_n, 2), max_n + 1):
+            start = window[max(len(history) - n + 1, 0):]
+            yield from map(' '.join, zip(*(start[i:] for i in range(n))))
+        history = window[len(window) - max_n + 1:] if max_n > 1 else []
+
+
+def _identity(ngrams):
+    return ngrams
+
+
+def word_ngram_features(vectorizer, texts):
+    """vectorizer.transform([' '.join(texts)]) without building the joined text (word analyzers only)"""
+    if getattr(vectorizer, 'analyzer', None) != 'word':
+        return vectorizer.transform([' '.join(texts)])
+    # A copy that takes ready n-grams, so a generator stands in for the document
+    streaming = copy.copy(vectorizer)
+    streaming.set_params(analyzer=_identity, ngram_range=(1, 1), stop_words=None)
+    # Tokenizing a few thousand short blocks at a time is as fast as tokenizing the whole text at once
+    return streaming.transform([_word_ngrams(vectorizer, _batches(texts, chunk_size))])
@@ -0,0 +1,104 @@
+import json
+import os
+import threading
+
+import joblib
+import pandas as pd
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.linear_model import SGDClassifier
+
+from invoice_ingest import read_wal
+
+# Document classifier that can keep learning while it serves.
+#
+# Text is vectorised with a HashingVectorizer, which has no vocabulary to
+# store or load, and classified by a linear SGD model trained with
+# partial_fit. Labelled documents posted to the service are appended to a
+# training log; every process replays the log from where its model left off
+# before predicting, so every worker learns every document without a
+# retrain. The model is snapshotted together with its log offset every
+# snapshot_every documents, and trained from documents.csv when there is no
+# snapshot yet.
+
+CLASSES = ['Contract', 'Invoice']
+
+model_file = 'model/online_classifier.joblib'
+training_log = 'model/online_training.jsonl'
+documents_file = 'documents.csv'
+snapshot_every = 100
+bootstrap_epochs = 5
+
+
+def make_vectorizer():
+    # Same n-grams as the TF-IDF vectorizer in vectorizer.pkl
+    return HashingVectorizer(n_features=2 ** 18, ngram_range=(1, 2), alternate_sign=False)
+
+
+class OnlineClassifier:
+    def __init__(self, model, log_offset=0):
+        self.vectorizer = make_vectorizer()
+        self.model = model
+        self.log_offset = log_offset
+        self._since_snapshot = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls):
+        """The snapshot on disk, or a model trained from documents.csv if there is none"""
+        try:
+            state = joblib.load(model_file)
+            return cls(state['model'], state['log_offset'])
+        except FileNotFoundError:
+            classifier = cls(SGDClassifier(loss='log_loss', alpha=1e-4, random_state=0))
+            classifier.bootstrap()
+            return classifier
+
+    def bootstrap(self):
+        documents = pd.read_csv(documents_file)
+        features = self.vectorizer.transform(documents['text'])
+        for _ in range(bootstrap_epochs):
+            self.model.partial_fit(features, documents['label'], classes=CLASSES)
+        self.save()
+
+    def save(self):
+        tmp_path = f'{model_file}.{os.getpid()}.tmp'
+        # Weights of hashed features never seen stay exactly zero, so they compress to almost nothing
+        joblib.dump({'model': self.model, 'log_offset': self.log_offset}, tmp_path, compress=3)
+        os.replace(tmp_path, model_file)
+        self._since_snapshot = 0
+
+    def catch_up(self):
+        """Train on documents other processes (or this one) added to the training log"""
+        try:
+            if os.path.getsize(training_log) <= self.log_offset:
+                return 0
+        except FileNotFoundError:
+            return 0
+        with self._lock:
+            records, self.log_offset = read_wal(training_log, self.log_offset)
+            if records:
+                texts = [record['text'] for record in records]
+                labels = [record['label'] for record in records]
+                self.model.partial_fit(self.vectorizer.transform(texts), labels, classes=CLASSES)
+                self._since_snapshot += len(records)
+                if self._since_snapshot >= snapshot_every:
+                    self.save()
+        return len(records)
+
+    def learn(self, texts, labels):
+        """Add labelled documents to the training log and fit them"""
+        unknown = set(labels) - set(CLASSES)
+        if unknown:
+            raise ValueError(f"Unknown label: {sorted(unknown)[0]}; expected one of {', '.join(CLASSES)}")
+        lines = ''.join(json.dumps({'text': text, 'label': label}) + '\n' for text, label in zip(texts, labels))
+        # One O_APPEND write per batch, so batches from different workers never interleave
+        fd = os.open(training_log, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, lines.encode('utf-8'))
+        finally:
+            os.close(fd)
+        return self.catch_up()
+
+    def predict(self, features):
+        self.catch_up()
+        return self.model.predict(features)
@@ -0,0 +1,202 @@
+import argparse
+import io
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from invoice_ingest import INVOICE_COLUMNS, csv_file, read_checkpoint, read_compacted, read_wal, wal_path
+
+# Out-of-core aggregation over invoice_database.csv.
+#
+# With INVOICE_OUT_OF_CORE=1 the expense breakdowns are computed by streaming
+# the CSV (plus the WAL records not compacted into it yet) in chunks of
+# INVOICE_CHUNK_SIZE rows instead of loading the table into memory. Each chunk
+# is reduced to partial sums per group, which are merged as they come in, so
+# peak memory is bounded by the chunk size. With INVOICE_WORKERS > 1 the file
+# is split into byte ranges that are aggregated in a process pool.
+#
+# Both paths total through sum_amounts(), so they return identical results:
+# integer sums indexed by the group values in sorted order.
+#
+#   python out_of_core.py --by type vendor month --employee 1010 --workers 4
+
+enabled = os.environ.get('INVOICE_OUT_OF_CORE', '0') == '1'
+chunk_size = int(os.environ.get('INVOICE_CHUNK_SIZE', '250000'))
+workers = int(os.environ.get('INVOICE_WORKERS', '1'))
+
+_pool = None
+_pool_key = None
+
+
+def group_values(frame, key):
+    """The values to group a frame by, for raw CSV chunks and in-memory frames alike"""
+    if key == 'month':
+        dates = frame['date']
+        if pd.api.types.is_datetime64_any_dtype(dates):
+            return dates.dt.strftime('%Y-%m')
+        # dd-mm-yyyy -> yyyy-mm
+        return dates.str[6:10] + '-' + dates.str[3:5]
+    return frame[key].astype(str)
+
+
+def sum_amounts(frame, key):
+    """Total amount per value of key, as int64 sums sorted by value"""
+    amounts = frame['amount'].astype('int64')
+    return amounts.groupby(group_values(frame, key).to_numpy()).sum().sort_index()
+
+
+def _merge(totals, partial):
+    if totals is None:
+        return partial
+    return pd.concat([totals, partial]).groupby(level=0).sum()
+
+
+def _reduce(frame, keys, employee_id, results):
+    if employee_id is not None:
+        frame = frame[frame['employee_id'] == employee_id]
+    for key in keys:
+        results[key] = _merge(results.get(key), sum_amounts(frame, key))
+    return len(frame)
+
+
+def _read_range(csv_path, start, end, rows_per_chunk):
+    """Yield the CSV lines starting in the byte range [start, end) as frames of up to rows_per_chunk rows"""
+    with open(csv_path, 'rb') as f:
+        header = f.readline()
+        if start > f.tell():
+            # Begin at the first line starting at or after start
+            f.seek(start - 1)
+            f.readline()
+        while f.tell() < end:
+            lines = []
+            while len(lines) < rows_per_chunk and f.tell() < end:
+                line = f.readline()
+                if not line:
+                    break
+                lines.append(line)
+            if not lines:
+                break
+            yield pd.read_csv(io.BytesIO(header + b''.join(lines)))
+
+
+def _aggregate_range(csv_path, start, end, keys, employee_id, rows_per_chunk):
+    results, rows = {}, 0
+    for chunk in _read_range(csv_path, start, end, rows_per_chunk):
+        rows += _reduce(chunk, keys, employee_id, results)
+    return results, rows
+
+
+def _byte_ranges(csv_path, end, parts):
+    with open(csv_path, 'rb') as f:
+        start = len(f.readline())
+    step = max(1, (end - start) // parts)
+    bounds = list(range(start, end, step))[:parts] + [end]
+    return list(zip(bounds, bounds[1:]))
+
+
+def _get_pool(size):
+    global _pool, _pool_key
+    if _pool_key != (os.getpid(), size):
+        # Spawned, not forked: the services run threads that fork() would copy mid-flight
+        _pool = ProcessPoolExecutor(size, mp_context=multiprocessing.get_context('spawn'))
+        _pool_key = (os.getpid(), size)
+    return _pool
+
+
+def aggregate(keys, employee_id=None, csv_path=csv_file, rows_per_chunk=None, processes=None):
+    """Stream the invoice table once, totalling by every grouping key
+
+    Returns ({key: totals}, number of invoice rows that matched).
+    """
+    rows_per_chunk = rows_per_chunk or chunk_size
+    processes = processes or workers
+    while True:
+        before = read_checkpoint()
+        if before['seq'] % 2:
+            time.sleep(0.01)
+            continue
+        end = before['csv_size'] or os.path.getsize(csv_path)
+
+        if processes > 1:
+            ranges = _byte_ranges(csv_path, end, processes)
+            futures = [_get_pool(processes).submit(_aggregate_range, csv_path, lo, hi, keys, employee_id,
+                                                   rows_per_chunk) for lo, hi in ranges]
+            partials = [future.result() for future in futures]
+        else:
+            partials = [_aggregate_range(csv_path, 0, end, keys, employee_id, rows_per_chunk)]
+
+        records, _ = read_wal(wal_path(before['generation']))
+        if read_checkpoint() == before:
+            break
+
+    results, rows = {}, 0
+    for partial, count in partials:
+        rows += count
+        for key, totals in partial.items():
+            results[key] = _merge(results.get(key), totals)
+    if records:
+        rows += _reduce(pd.DataFrame([r['row'] for r in records], columns=INVOICE_COLUMNS),
+                        keys, employee_id, results)
+    return results, rows
+
+
+def _pin_generation(csv_path):
+    """The WAL generation and the CSV size that holds every row before it, read under the checkpoint seqlock"""
+    while True:
+        before = read_checkpoint()
+        # Mid-compaction csv_size is where the generation being compacted starts
+        end = before['csv_size'] if before['seq'] % 2 else os.path.getsize(csv_path)
+        if read_checkpoint() == before:
+            return before['generation'], end
+
+
+def iter_invoice_chunks(employee_id=None, csv_path=csv_file, rows_per_chunk=None):
+    """Yield the invoice table (CSV, then WAL records) in raw chunks of at most rows_per_chunk rows
+
+    The CSV is read up to where the current WAL generation starts. A
+    compaction while the stream runs is seen by the checkpoint changing
+    generation; that generation's rows are then read back from the CSV, so
+    none are lost or read twice.
+    """
+    generation, end = _pin_generation(csv_path)
+    for chunk in _read_range(csv_path, 0, end, rows_per_chunk or chunk_size):
+        if employee_id is not None:
+            chunk = chunk[chunk['employee_id'] == employee_id]
+        if len(chunk):
+            yield chunk
+    rows = [r['row'] for r in read_wal(wal_path(generation))[0]]
+    checkpoint = read_checkpoint()
+    if checkpoint['generation'] != generation:
+        rows = read_compacted(generation, checkpoint, csv_path)
+        if rows is None:
+            raise RuntimeError(f"Invoice WAL generation {generation} was compacted during the stream "
+                               "and can no longer be read back")
+    if rows:
+        chunk = pd.DataFrame(rows, columns=INVOICE_COLUMNS)
+        if employee_id is not None:
+            chunk = chunk[chunk['employee_id'] == employee_id]
+        if len(chunk):
+            yield chunk
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Aggregate the invoice table without loading it into memory')
+    parser.add_argument('--by', nargs='+', default=['type', 'vendor', 'location', 'month'])
+    parser.add_argument('--employee', type=int)
+    parser.add_argument('--csv', default=csv_file)
+    parser.add_argument('--chunk-size', type=int, default=chunk_size)
+    parser.add_argument('--workers', type=int, default=workers)
+    args = parser.parse_args()
+
+    results, rows = aggregate(args.by, args.employee, args.csv, args.chunk_size, args.workers)
+    print(f"{rows} invoices", file=sys.stderr)
+    for key in args.by:
+        results[key].rename_axis(key).rename('amount').to_csv(sys.stdout, header=True)
+
+
+if __name__ == '__main__':
+    main()
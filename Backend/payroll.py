@@ -0,0 +1,73 @@
+import pandas as pd
+
+# Pay and net-worth figures for every employee.
+#
+# The derived columns (total allowances, assets, liabilities, net worth and
+# remaining balance) are computed for the whole employee table at once with
+# column arithmetic. data_store keeps the result next to the table it was
+# computed from and recomputes it when an employee is updated. Employee ids
+# map to row positions in a dict, so one employee's figures are a hash lookup
+# and a handful of array reads. An id given as a numeric string (JSON bodies
+# carry both "1000" and 1000) is looked up as an int.
+
+ALLOWANCE_COLUMNS = ['food_allowance', 'transport_allowance', 'medical_allowance', 'electronics_allowance',
+                     'misc_allowance']
+PAY_COLUMNS = ['ctc', 'base_package'] + ALLOWANCE_COLUMNS + ['monthly_emi', 'debt_budget']
+DERIVED_COLUMNS = ['total_allowances', 'total_assets', 'total_liabilities', 'net_worth', 'remaining_balance']
+
+
+def employee_key(employee_id):
+    """A numeric string id as an int, like the ids in the employee table"""
+    if isinstance(employee_id, str) and employee_id.strip().isdigit():
+        return int(employee_id)
+    return employee_id
+
+
+def compute(employees):
+    """Pay columns as integers plus the derived columns, one row per employee id"""
+    table = employees[PAY_COLUMNS].astype('int64')
+    allowances = table[ALLOWANCE_COLUMNS].sum(axis=1)
+    table['total_allowances'] = allowances
+    table['total_assets'] = table['base_package'] + allowances
+    table['total_liabilities'] = table['monthly_emi'] + table['debt_budget']
+    table['net_worth'] = table['total_assets'] - table['total_liabilities']
+    table['remaining_balance'] = table['base_package'] - (allowances + table['monthly_emi'])
+    table.insert(0, 'department', employees['department'].to_numpy())
+    table.index = pd.Index(employees['employee_id'].to_numpy(), name='employee_id')
+    return table
+
+
+class Payroll:
+    """Derived pay figures of one version of the employee table"""
+
+    def __init__(self, employees):
+        self.employees = employees
+        self.table = compute(employees)
+        # First row wins for a repeated id, as with a lookup by mask
+        self._positions = {}
+        for position, employee_id in enumerate(self.table.index.tolist()):
+            self._positions.setdefault(employee_id, position)
+        self._columns = {column: self.table[column].to_numpy() for column in PAY_COLUMNS + DERIVED_COLUMNS}
+
+    def position(self, employee_id):
+        """Row of the employee in the employee table, or None if the id is unknown"""
+        return self._positions.get(employee_key(employee_id))
+
+    def record(self, employee_id):
+        """{column: int} for one employee, or None if the id is unknown"""
+        position = self.position(employee_id)
+        if position is None:
+            return None
+        return {column: int(values[position]) for column, values in self._columns.items()}
+
+    def records(self, employee_ids=None, department=None):
+        """Rows for the given employees and/or department (all employees if neither), and the unknown ids"""
+        table = self.table
+        missing = []
+        if employee_ids is not None:
+            positions = [self.position(employee_id) for employee_id in employee_ids]
+            missing = [employee_id for employee_id, position in zip(employee_ids, positions) if position is None]
+            table = table.iloc[[position for position in positions if position is not None]]
+        if department is not None:
+            table = table[table['department'] == department]
+        return table.reset_index().to_dict('records'), missing
@@ -0,0 +1,225 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from flask import g, jsonify
+
+try:
+    import fcntl  # POSIX only; elects the one worker process that precomputes
+except ImportError:
+    fcntl = None
+
+import data_store
+import result_cache
+import Query_2
+import Query_3
+
+# Background precomputation of per-employee results.
+#
+# With PRECOMPUTE_ENABLED=1 a scheduler thread walks all employees and
+# computes their expense totals, charts, ARIMA plot, spending forecast and CTC
+# chart into the result cache (result_cache.py), so the first request of the
+# day for an employee is a cache hit. Results still current are cache hits
+# and cost next to nothing, so only employees whose data changed are
+# recomputed.
+#
+# The cache is per process, and a pass in every gunicorn worker would repeat
+# the same work N times. Only the worker holding an flock on PRECOMPUTE_LOCK
+# runs passes; the others check every few seconds and take over if it exits.
+# Without fcntl (Windows) every process precomputes.
+#
+# A pass runs when the worker starts, PRECOMPUTE_DEBOUNCE seconds after
+# invoice or employee data stops changing, and at the PRECOMPUTE_AT times of
+# day (comma-separated HH:MM). Employees that live requests ask for most come
+# first, then those whose data changed. PRECOMPUTE_WORKERS threads do the work
+# and wait before every task while PRECOMPUTE_MAX_IN_FLIGHT or more live
+# requests are being served by this worker (default 1: any), so
+# precomputation only uses idle time.
+#
+# GET /api/precompute_status reports progress, freshness and cache hit rates.
+
+enabled = os.environ.get('PRECOMPUTE_ENABLED', '0') == '1'
+workers = int(os.environ.get('PRECOMPUTE_WORKERS', '1'))
+schedule = [at.strip() for at in os.environ.get('PRECOMPUTE_AT', '02:00').split(',') if at.strip()]
+debounce = float(os.environ.get('PRECOMPUTE_DEBOUNCE', '30'))
+max_in_flight = max(int(os.environ.get('PRECOMPUTE_MAX_IN_FLIGHT', '1')), 1)
+lock_file = os.environ.get('PRECOMPUTE_LOCK', 'precompute.lock')
+poll_interval = 1.0
+election_interval = 5.0
+
+# (name, function, extra arguments after the employee id)
+TASKS = [
+    ('expense_totals', Query_2.employee_totals, ()),
+    ('barplot', Query_2.employee_chart, (Query_2.create_barplot,)),
+    ('piechart', Query_2.employee_chart, (Query_2.create_piechart,)),
+    ('heatmap', Query_2.employee_chart, (Query_2.create_heatmap,)),
+    ('arima', Query_2.fit_arima_for_employee_monthly, ()),
+    ('ctc_chart', Query_3.create_ctc_chart, ()),
+]
+
+_in_flight = 0
+_in_flight_lock = threading.Lock()
+_status_lock = threading.Lock()
+_status = {'running': False, 'trigger': None, 'started': None, 'finished': None, 'employees': 0, 'done': 0,
+           'tasks_failed': 0, 'paused_s': 0.0, 'last_error': None, 'next_scheduled': None, 'leader': False}
+_scheduler_pid = None
+# Kept open for the life of the process that won the election
+_leader_file = None
+_start_lock = threading.Lock()
+
+
+def _update(**values):
+    with _status_lock:
+        _status.update(values)
+
+
+def _count(name, amount):
+    with _status_lock:
+        _status[name] += amount
+
+
+def _timestamp(seconds):
+    return datetime.fromtimestamp(seconds).isoformat(timespec='seconds') if seconds is not None else None
+
+
+def _next_scheduled():
+    now = datetime.now()
+    times = []
+    for at in schedule:
+        hour, minute = (int(part) for part in at.split(':'))
+        run_at = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+        times.append(run_at if run_at > now else run_at + timedelta(days=1))
+    return min(times).timestamp() if times else float('inf')
+
+
+def _priority_order():
+    employee_ids = [int(employee_id) for employee_id in data_store.get_employees()['employee_id']]
+    return sorted(employee_ids, key=lambda employee_id: (-result_cache.demand(employee_id),
+                                                         -data_store.employee_version(employee_id)))
+
+
+def _wait_for_idle():
+    start = time.perf_counter()
+    while _in_flight >= max_in_flight:
+        time.sleep(0.05)
+    waited = time.perf_counter() - start
+    if waited:
+        _count('paused_s', waited)
+
+
+def _warm(employee_id, tasks):
+    token = result_cache.background.set(True)
+    try:
+        for name, fn, args in tasks:
+            _wait_for_idle()
+            try:
+                fn(employee_id, *args)
+            except Exception as e:
+                _count('tasks_failed', 1)
+                _update(last_error=f"{name} for employee {employee_id}: {e}")
+    finally:
+        result_cache.background.reset(token)
+    _count('done', 1)
+
+
+def run_pass(trigger='manual'):
+    """Precompute every employee's results once, most wanted employees first"""
+    employee_ids = _priority_order()
+    today = datetime.now()
+    # The forecast state is shared by every month a client may ask about
+    tasks = TASKS + [('forecast', Query_2.predict_spending, (today.strftime('%B'), str(today.year)))]
+    _update(running=True, trigger=trigger, started=time.time(), finished=None, employees=len(employee_ids),
+            done=0, tasks_failed=0, paused_s=0.0)
+    try:
+        with ThreadPoolExecutor(workers, thread_name_prefix='precompute') as pool:
+            list(pool.map(lambda employee_id: _warm(employee_id, tasks), employee_ids))
+    finally:
+        _update(running=False, finished=time.time())
+
+
+def _elect():
+    """True once this process holds the precompute lock"""
+    global _leader_file
+    if fcntl is None or _leader_file is not None:
+        return True
+    f = open(lock_file, 'a')
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        f.close()
+        return False
+    _leader_file = f
+    return True
+
+
+def _loop():
+    # Another worker precomputes; the lock is released when that process exits
+    while not _elect():
+        time.sleep(election_interval)
+    _update(leader=True)
+    seen_version = data_store.data_version()
+    changed_at = None
+    due, trigger = time.time(), 'startup'
+    while True:
+        now = time.time()
+        version = data_store.data_version()
+        if version != seen_version:
+            seen_version, changed_at = version, now
+        if changed_at is not None and now - changed_at >= debounce:
+            due, trigger, changed_at = now, 'data_change', None
+        if now >= due:
+            try:
+                run_pass(trigger)
+            except Exception as e:
+                _update(last_error=f"pass failed: {e}")
+            due, trigger = _next_scheduled(), 'schedule'
+            _update(next_scheduled=due)
+        time.sleep(poll_interval)
+
+
+def _ensure_started():
+    global _scheduler_pid
+    # Started from the first request so a pre-fork master never runs it
+    if _scheduler_pid == os.getpid():
+        return
+    with _start_lock:
+        if _scheduler_pid != os.getpid():
+            threading.Thread(target=_loop, name='precompute-scheduler', daemon=True).start()
+            _scheduler_pid = os.getpid()
+
+
+def _before_request():
+    global _in_flight
+    if enabled:
+        _ensure_started()
+    with _in_flight_lock:
+        _in_flight += 1
+    g.precompute_counted = True
+
+
+def _teardown_request(exc):
+    global _in_flight
+    if g.pop('precompute_counted', False):
+        with _in_flight_lock:
+            _in_flight -= 1
+
+
+def status():
+    with _status_lock:
+        current = dict(_status)
+    for name in ('started', 'finished', 'next_scheduled'):
+        current[name] = _timestamp(current[name]) if current[name] != float('inf') else None
+    return {'enabled': enabled, 'workers': workers, 'schedule': schedule, **current, 'cache': result_cache.stats()}
+
+
+def precompute_status():
+    return jsonify(status()), 200
+
+
+def init_app(app):
+    """Count live requests, start the scheduler in serving processes and add /api/precompute_status"""
+    app.before_request(_before_request)
+    app.teardown_request(_teardown_request)
+    app.add_url_rule('/api/precompute_status', 'precompute_status', precompute_status, methods=['GET'])
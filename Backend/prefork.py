@@ -0,0 +1,26 @@
+import gc
+
+import data_store
+
+# Pre-fork serving: the master loads every read-only dataset and model once,
+# then forks workers that share those pages copy-on-write.
+#
+# Two things would otherwise make the workers copy the shared pages anyway:
+# the cyclic GC writes to the header of every object it scans, and the master
+# itself can free and reuse memory between load and fork. So the GC stays off
+# in the master, everything loaded is moved to the permanent generation with
+# gc.freeze() just before forking, and collection is re-enabled per worker.
+# Numeric columns live in numpy buffers, which are never refcounted; object
+# (string) columns still hold Python strings whose refcounts change on access.
+
+
+def prepare_master(**models):
+    """Load and freeze all shared state; call in the master before forking"""
+    gc.disable()
+    data_store.preload(**models)
+    gc.freeze()
+
+
+def init_worker():
+    """Call in each worker right after fork"""
+    gc.enable()
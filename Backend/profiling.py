@@ -0,0 +1,209 @@
+import cProfile
+import os
+import random
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+from flask import g, request
+
+# Opt-in profiling of single requests.
+#
+# A request is profiled when it carries an "X-Profile" header ("sample" or
+# "1" for stack sampling, "cprofile" for cProfile) together with an
+# "X-Profile-Token" matching PROFILE_TOKEN, or when it is picked by
+# PROFILE_SAMPLE_RATE (a fraction of all requests, default 0). Without
+# PROFILE_TOKEN the header is ignored, so profiling is off by default. Each
+# profiled request writes to PROFILE_DIR:
+#
+#   <id>.collapsed   stack samples in collapsed format (flamegraph.pl, speedscope)
+#   <id>.prof        cProfile stats (cprofile mode; snakeviz, pstats)
+#   <id>.alloc.txt   top allocation sites from tracemalloc
+#
+# and the response carries the <id> in an "X-Profile-Id" header. The oldest
+# files are deleted once PROFILE_DIR_MAX_MB is exceeded.
+#
+# Only one request is profiled at a time. tracemalloc traces the whole
+# process and cannot tell threads apart, so allocations are only traced when
+# the profiled request is the only one in flight, and the report is dropped
+# if another request started meanwhile. Requests that are not profiled pay
+# for a header lookup and the in-flight count.
+
+profile_dir = os.environ.get('PROFILE_DIR', 'profiles')
+sample_rate = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+token = os.environ.get('PROFILE_TOKEN')
+max_dir_bytes = int(float(os.environ.get('PROFILE_DIR_MAX_MB', '100')) * 2 ** 20)
+sample_interval = 0.001
+MODES = {'sample': 'sample', '1': 'sample', 'cprofile': 'cprofile'}
+
+_profile_lock = threading.Lock()
+_count_lock = threading.Lock()
+_in_flight = 0
+# Requests started since the profiled request, which started tracing allocations
+_started_while_tracing = 0
+
+
+class StackSampler:
+    """Samples one thread's Python stack at a fixed interval from a helper thread"""
+
+    def __init__(self, thread_id, interval=sample_interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def write_collapsed(self, path):
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f'{stack} {count}\n')
+
+
+class RequestProfile:
+    def __init__(self, mode, route):
+        self.mode = mode
+        slug = route.strip('/').replace('/', '_') or 'root'
+        self.id = f'{time.strftime("%Y%m%d-%H%M%S")}_{slug}_{os.getpid()}_{threading.get_ident() % 100000}'
+        self.sampler = None
+        self.profiler = None
+        self.traced = False
+
+    def start(self):
+        global _started_while_tracing
+        with _count_lock:
+            # Other requests' allocations would land in this request's snapshot
+            self.traced = _in_flight == 1 and not tracemalloc.is_tracing()
+            _started_while_tracing = 0
+        if self.traced:
+            tracemalloc.start()
+        if self.mode == 'cprofile':
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        else:
+            self.sampler = StackSampler(threading.get_ident())
+            self.sampler.start()
+
+    def finish(self):
+        if self.profiler is not None:
+            self.profiler.disable()
+        if self.sampler is not None:
+            self.sampler.stop()
+        snapshot = None
+        if self.traced:
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            with _count_lock:
+                alone = _started_while_tracing == 0
+
+        os.makedirs(profile_dir, exist_ok=True)
+        base = os.path.join(profile_dir, self.id)
+        if self.profiler is not None:
+            self.profiler.dump_stats(base + '.prof')
+        if self.sampler is not None:
+            self.sampler.write_collapsed(base + '.collapsed')
+
+        with open(base + '.alloc.txt', 'w') as f:
+            if snapshot is None:
+                f.write('Allocations not traced: other requests were in flight\n')
+            elif not alone:
+                f.write('Allocations not reported: other requests ran while tracing\n')
+            else:
+                snapshot = snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__),
+                                                   tracemalloc.Filter(False, __file__)])
+                for stat in snapshot.statistics('lineno')[:50]:
+                    f.write(f'{stat}\n')
+        _prune()
+
+
+def _prune():
+    """Delete the oldest files in PROFILE_DIR until it is within PROFILE_DIR_MAX_MB"""
+    entries = [entry for entry in os.scandir(profile_dir) if entry.is_file()]
+    entries.sort(key=lambda entry: entry.stat().st_mtime)
+    total = sum(entry.stat().st_size for entry in entries)
+    for entry in entries:
+        if total <= max_dir_bytes:
+            break
+        total -= entry.stat().st_size
+        try:
+            os.remove(entry.path)
+        except FileNotFoundError:
+            pass
+
+
+def _requested_mode():
+    mode = request.headers.get('X-Profile')
+    if mode is None:
+        if sample_rate <= 0 or random.random() >= sample_rate:
+            return None
+        return 'sample'
+    if not token or request.headers.get('X-Profile-Token') != token:
+        return None
+    return MODES.get(mode.strip().lower())
+
+
+def _before_request():
+    global _in_flight, _started_while_tracing
+    with _count_lock:
+        _in_flight += 1
+        _started_while_tracing += 1
+    g.profiling_counted = True
+    mode = _requested_mode()
+    if mode is None or not _profile_lock.acquire(blocking=False):
+        return
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    g.request_profile = RequestProfile(mode, route)
+    g.request_profile.start()
+
+
+def _finish():
+    profile = g.pop('request_profile', None)
+    if profile is None:
+        return None
+    try:
+        profile.finish()
+    finally:
+        _profile_lock.release()
+    return profile
+
+
+def _after_request(response):
+    profile = _finish()
+    if profile is not None:
+        response.headers['X-Profile-Id'] = profile.id
+    return response
+
+
+def _teardown_request(exc):
+    global _in_flight
+    # Requests that raised skip after_request
+    _finish()
+    if g.pop('profiling_counted', False):
+        with _count_lock:
+            _in_flight -= 1
+
+
+def init_app(app):
+    """Add the per-request profiling hooks to a Flask app"""
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
@@ -0,0 +1,159 @@
+import functools
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
+
+import pandas as pd
+
+import data_store
+import instrumentation
+from instrumentation import registry
+from payroll import employee_key
+
+# Cache of per-employee results (expense totals, rendered charts, ...).
+#
+# A result is stored with the employee's data version from data_store, which
+# changes whenever that employee's invoices or employee row change, so a
+# cached value is used only while the data it was computed from is current.
+# The cache is per process, bounded by RESULT_CACHE_MB and evicts the least
+# recently used results first. Hits and misses are counted for live requests
+# only; the precompute scheduler (precompute.py) fills the cache without
+# affecting them.
+#
+#   @cached
+#   def create_report(employee_id, ...): ...
+#
+# The first argument of a cached function must be the employee id and the
+# rest must be hashable. An id given as a numeric string is passed on as an
+# int. Cached results are shared and must not be modified.
+
+enabled = os.environ.get('RESULT_CACHE_ENABLED', '1') != '0'
+max_bytes = int(float(os.environ.get('RESULT_CACHE_MB', '256')) * 2 ** 20)
+
+registry.describe('mintbolt_result_cache_total', 'counter',
+                  'Result cache lookups by live requests, by function and result (hit or miss).')
+
+# Set by the precompute scheduler so its lookups are not counted as traffic
+background = ContextVar('result_cache_background', default=False)
+
+_lock = threading.Lock()
+_entries = OrderedDict()
+_bytes = 0
+_hits = {}
+_misses = {}
+_demand = {}
+
+
+class _Entry:
+    def __init__(self, value, version, size):
+        self.value = value
+        self.version = version
+        self.size = size
+        self.computed_at = time.time()
+
+
+def _size(value):
+    """Rough memory held by a cached value"""
+    if isinstance(value, (str, bytes)):
+        return sys.getsizeof(value)
+    if isinstance(value, (tuple, list)):
+        return sys.getsizeof(value) + sum(_size(item) for item in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(_size(k) + _size(v) for k, v in value.items())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(deep=True))
+    return sys.getsizeof(value)
+
+
+def _store(key, entry):
+    global _bytes
+    if entry.size > max_bytes:
+        return
+    with _lock:
+        old = _entries.pop(key, None)
+        if old is not None:
+            _bytes -= old.size
+        _entries[key] = entry
+        _bytes += entry.size
+        while _bytes > max_bytes:
+            _, evicted = _entries.popitem(last=False)
+            _bytes -= evicted.size
+
+
+def cached(fn):
+    """Decorator: reuse fn's result while the employee's data is unchanged"""
+    name = fn.__name__
+
+    @functools.wraps(fn)
+    def wrapper(employee_id, *args):
+        # Data versions are kept per int id, so "1000" from a JSON body must share the entry of 1000
+        employee_id = employee_key(employee_id)
+        if not enabled:
+            return fn(employee_id, *args)
+        key = (name, employee_id) + args
+        version = data_store.employee_version(employee_id)
+        live = not background.get()
+        with _lock:
+            entry = _entries.get(key)
+            hit = entry is not None and entry.version == version
+            if hit:
+                _entries.move_to_end(key)
+            if live:
+                counts = _hits if hit else _misses
+                counts[name] = counts.get(name, 0) + 1
+                _demand[employee_id] = _demand.get(employee_id, 0) + 1
+        if live and instrumentation.enabled:
+            registry.inc('mintbolt_result_cache_total', (('function', name), ('result', 'hit' if hit else 'miss')))
+        if hit:
+            return entry.value
+
+        # The version read before computing, so a change made meanwhile invalidates the result
+        value = fn(employee_id, *args)
+        _store(key, _Entry(value, version, _size(value)))
+        return value
+
+    return wrapper
+
+
+def demand(employee_id):
+    """How many times live requests have looked up this employee's results"""
+    return _demand.get(employee_id, 0)
+
+
+def stats():
+    """Size, hit rate and freshness of the cache, overall and per function"""
+    now = time.time()
+    with _lock:
+        entries = [(key[0], key[1], entry) for key, entry in _entries.items()]
+        hits, misses, size = dict(_hits), dict(_misses), _bytes
+
+    functions = {}
+    for name, employee_id, entry in entries:
+        summary = functions.setdefault(name, {'entries': 0, 'fresh': 0, 'oldest_fresh_age_s': None})
+        summary['entries'] += 1
+        if entry.version == data_store.employee_version(employee_id):
+            summary['fresh'] += 1
+            age = round(now - entry.computed_at, 1)
+            summary['oldest_fresh_age_s'] = max(age, summary['oldest_fresh_age_s'] or 0)
+    for name in set(hits) | set(misses):
+        summary = functions.setdefault(name, {'entries': 0, 'fresh': 0, 'oldest_fresh_age_s': None})
+        summary['hits'], summary['misses'] = hits.get(name, 0), misses.get(name, 0)
+        summary['hit_rate'] = _rate(summary['hits'], summary['misses'])
+
+    total_hits, total_misses = sum(hits.values()), sum(misses.values())
+    return {
+        'entries': len(entries),
+        'bytes': size,
+        'max_bytes': max_bytes,
+        'hits': total_hits,
+        'misses': total_misses,
+        'hit_rate': _rate(total_hits, total_misses),
+        'functions': functions,
+    }
+
+
+def _rate(hits, misses):
+    return round(hits / (hits + misses), 4) if hits + misses else None
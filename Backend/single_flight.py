@@ -0,0 +1,84 @@
+import functools
+import threading
+
+import instrumentation
+from instrumentation import registry, stage
+
+# Request coalescing for expensive computations.
+#
+# When several requests ask for the same thing at once (a team opening the
+# dashboard together), the first caller with a given key runs the computation
+# and the others wait for it and get the same result, or the same exception.
+# Nothing is kept once the computation finishes: a caller arriving after that
+# computes afresh, so results are never staler than the request that started
+# them. Coalescing is per worker process.
+#
+#   @coalesce
+#   def create_report(employee_id): ...
+#
+# The key is the function and its arguments, which must be hashable; calls
+# with unhashable arguments simply run uncoalesced. Results are shared
+# between callers and must not be modified.
+
+registry.describe('mintbolt_single_flight_total', 'counter',
+                  'Calls to coalesced functions, by function and whether they ran (leader) or waited (follower).')
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """At most one in-flight call per key; concurrent callers share its outcome"""
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if instrumentation.enabled:
+            registry.inc('mintbolt_single_flight_total',
+                          (('function', self.name), ('role', 'leader' if leader else 'follower')))
+
+        if not leader:
+            with stage('coalesced_wait'):
+                call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+def coalesce(fn):
+    """Decorator: concurrent calls with equal arguments run fn once"""
+    group = SingleFlight(fn.__name__)
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        key = (args, tuple(sorted(kwargs.items())))
+        try:
+            hash(key)
+        except TypeError:
+            return fn(*args, **kwargs)
+        return group.do(key, fn, *args, **kwargs)
+
+    return wrapper
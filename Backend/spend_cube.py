@@ -0,0 +1,182 @@
+import threading
+
+import numpy as np
+import pandas as pd
+
+# Department spend cube.
+#
+# Invoices are joined with department.csv once and summed into a few
+# materialised cuboids (group-bys at different levels of detail), all keyed by
+# integer codes. A query picks the smallest cuboid that has every dimension it
+# groups or filters on, so roll-ups over departments, types or months read a
+# few hundred cells and drill-downs to employees or vendors read one
+# department's slice of a larger cuboid. Appended invoices are summed into
+# small delta frames next to each cuboid and merged in once the deltas grow.
+
+DIMENSIONS = ['department', 'employee_id', 'type', 'vendor', 'location', 'month']
+
+# Every cuboid starts with department and is sorted by its dimensions, so a
+# filter on one department is a binary search
+CUBOIDS = [
+    ('department', 'type', 'month'),
+    ('department', 'vendor', 'month'),
+    ('department', 'location', 'month'),
+    ('department', 'employee_id', 'month'),
+    tuple(DIMENSIONS),
+]
+
+UNASSIGNED = 'Unassigned'
+
+
+def _months(days):
+    """Day numbers since 1970-01-01 to month numbers since 1970-01"""
+    return np.asarray(days, dtype='int64').astype('datetime64[D]').astype('datetime64[M]').astype('int32')
+
+
+def month_number(value):
+    """'2024-03' (or any date in that month) to a month number"""
+    return int(np.datetime64(pd.Timestamp(value), 'M').astype('int64'))
+
+
+def month_label(number):
+    return str(np.datetime64(int(number), 'M'))
+
+
+class _Cuboid:
+    def __init__(self, dims, cells):
+        self.dims = list(dims)
+        self.cells = cells
+        self.pending = []
+        self.pending_rows = 0
+
+    def __len__(self):
+        return len(self.cells) + self.pending_rows
+
+    def add(self, delta):
+        delta = _aggregate(delta, self.dims)
+        self.pending.append(delta)
+        self.pending_rows += len(delta)
+        if self.pending_rows > max(10_000, len(self.cells) // 10):
+            self.cells = _aggregate(pd.concat([self.cells] + self.pending, ignore_index=True), self.dims)
+            self.pending = []
+            self.pending_rows = 0
+
+
+def _aggregate(frame, dims):
+    cells = frame.groupby(dims, sort=True, observed=True).agg(amount=('amount', 'sum'), invoices=('invoices', 'sum'))
+    return cells.reset_index()
+
+
+def _select(cells, filters):
+    """Rows of a sorted cuboid matching {dimension: array of codes}"""
+    department = filters.get('department')
+    if department is not None and len(department) == 1:
+        column = cells['department'].to_numpy()
+        lo, hi = np.searchsorted(column, department[0], 'left'), np.searchsorted(column, department[0], 'right')
+        cells = cells.iloc[lo:hi]
+    mask = None
+    for dim, codes in filters.items():
+        if dim == 'month':
+            values = cells['month'].to_numpy()
+            match = (values >= codes[0]) & (values <= codes[1])
+        elif dim == 'department' and len(codes) == 1:
+            continue
+        else:
+            match = np.isin(cells[dim].to_numpy(), codes)
+        mask = match if mask is None else mask & match
+    return cells if mask is None else cells[mask]
+
+
+class SpendCube:
+    """Spend and invoice counts by department, employee, type, vendor, location and month"""
+
+    def __init__(self, invoices, departments):
+        self._lock = threading.Lock()
+        self.departments = pd.Index(sorted(set(departments['department'])) + [UNASSIGNED])
+        self._department_of = dict(zip(departments['employee_id'],
+                                       self.departments.get_indexer(departments['department'])))
+        self._cuboids = []
+        base, self._names = self._facts(invoices)
+        for dims in CUBOIDS:
+            self._cuboids.append(_Cuboid(dims, _aggregate(base, list(dims))))
+
+    def _facts(self, invoices):
+        """One row per invoice with every dimension as an integer code, and the names of the codes"""
+        names = {column: invoices[column].cat.categories for column in ('type', 'vendor', 'location')}
+        unassigned = len(self.departments) - 1
+        employee_ids = invoices['employee_id'].to_numpy()
+        departments = pd.Series(employee_ids).map(self._department_of).fillna(unassigned)
+        return pd.DataFrame({
+            'department': departments.to_numpy('int16'),
+            'employee_id': employee_ids,
+            'type': invoices['type'].cat.codes.to_numpy(),
+            'vendor': invoices['vendor'].cat.codes.to_numpy(),
+            'location': invoices['location'].cat.codes.to_numpy(),
+            'month': _months(invoices['date'].to_numpy()),
+            'amount': invoices['amount'].to_numpy('float64'),
+            'invoices': np.ones(len(invoices), dtype='int32'),
+        }), names
+
+    def add_invoices(self, invoices):
+        """Fold newly appended invoice rows (slices of the shared invoice frame) into every cuboid"""
+        facts, names = self._facts(invoices)
+        with self._lock:
+            # The shared frame's categories only grow, so the new names also decode the older cells
+            self._names = names
+            for cuboid in self._cuboids:
+                cuboid.add(facts)
+
+    def _codes(self, names, dim, values):
+        if dim == 'employee_id':
+            return np.asarray(values, dtype='int64')
+        return (self.departments if dim == 'department' else names[dim]).get_indexer(values)
+
+    def query(self, group_by=(), filters=None, start_month=None, end_month=None):
+        """Roll up to the group_by dimensions over the invoices matching filters
+
+        filters maps a dimension to a value or list of values (names, or ids
+        for employee_id). Months are inclusive and may be given as 'YYYY-MM'.
+        Returns one dict per group with the amount and invoice count.
+        """
+        group_by = list(group_by)
+        unknown = [dim for dim in group_by + list(filters or {}) if dim not in DIMENSIONS]
+        if unknown:
+            raise ValueError(f"Unknown dimension: {unknown[0]}")
+
+        months = start_month is not None or end_month is not None
+        needed = set(group_by) | set(filters or {}) | ({'month'} if months else set())
+        with self._lock:
+            cuboid = min((c for c in self._cuboids if needed <= set(c.dims)), key=len)
+            parts = [cuboid.cells] + list(cuboid.pending)
+            # Names and cells from the same moment, so filters and results use the cells' codes
+            names = self._names
+
+        codes = {}
+        for dim, values in (filters or {}).items():
+            values = values if isinstance(values, (list, tuple)) else [values]
+            codes[dim] = self._codes(names, dim, values)
+        if months:
+            codes['month'] = (month_number(start_month) if start_month else np.iinfo('int32').min,
+                              month_number(end_month) if end_month else np.iinfo('int32').max)
+
+        selected = pd.concat([_select(part, codes) for part in parts], ignore_index=True)
+        if group_by:
+            totals = selected.groupby(group_by, sort=True)[['amount', 'invoices']].sum().reset_index()
+        else:
+            totals = pd.DataFrame({'amount': [selected['amount'].sum()], 'invoices': [selected['invoices'].sum()]})
+        return self._decode(names, totals, group_by)
+
+    def _decode(self, names, totals, group_by):
+        columns = {}
+        for dim in group_by:
+            values = totals[dim].to_numpy()
+            if dim == 'month':
+                columns[dim] = [month_label(value) for value in values]
+            elif dim == 'employee_id':
+                columns[dim] = [int(value) for value in values]
+            else:
+                labels = self.departments if dim == 'department' else names[dim]
+                columns[dim] = list(labels[values])
+        columns['amount'] = [float(value) for value in totals['amount']]
+        columns['invoices'] = [int(value) for value in totals['invoices']]
+        return [dict(zip(columns, row)) for row in zip(*columns.values())]
@@ -0,0 +1,129 @@
+import numpy as np
+import pandas as pd
+
+# Per-employee time index over the invoice table.
+#
+# An employee's invoices are kept sorted by date next to the running total of
+# their amounts, overall and per category. A date window is then two binary
+# searches, and the spend inside it is one subtraction of prefix sums, instead
+# of boolean masks over the whole table followed by a resample.
+
+
+class _PrefixSeries:
+    """Sorted day numbers with the cumulative sum of the amounts up to each one"""
+
+    def __init__(self, dates, amounts):
+        self.dates = dates
+        self.cumulative = np.concatenate(([0.0], np.cumsum(amounts, dtype='float64')))
+
+    def __len__(self):
+        return len(self.dates)
+
+    def bounds(self, start=None, end=None):
+        """Positions [lo, hi) of the dates in the inclusive window [start, end]"""
+        lo = 0 if start is None else int(np.searchsorted(self.dates, _day(start), 'left'))
+        hi = len(self.dates) if end is None else int(np.searchsorted(self.dates, _day(end), 'right'))
+        return lo, max(lo, hi)
+
+    def total(self, start=None, end=None):
+        lo, hi = self.bounds(start, end)
+        return float(self.cumulative[hi] - self.cumulative[lo]), hi - lo
+
+    def resample(self, freq, start=None, end=None, label='end'):
+        """Totals per calendar period ('M' or 'D') between the first and last date in the window
+
+        Matches DataFrame.resample(...).sum() on the same rows: periods without
+        invoices are 0 and the series is labelled by period end ('ME', 'D') or
+        start ('MS').
+        """
+        lo, hi = self.bounds(start, end)
+        if lo == hi:
+            return pd.Series(dtype='float64')
+        edges, labels = _periods(self.dates[lo], self.dates[hi - 1], freq, label)
+        return pd.Series(self.period_totals(edges), index=labels, name='amount')
+
+    def period_totals(self, edges):
+        """Totals between consecutive day numbers in edges, each period including its first day"""
+        return np.diff(self.cumulative[np.searchsorted(self.dates, edges, 'left')])
+
+
+class EmployeeTimeIndex:
+    """Date-sorted view of one employee's invoices with prefix sums per category"""
+
+    def __init__(self, invoices, rows):
+        dates = invoices['date'].values[rows]
+        order = np.argsort(dates, kind='stable')
+        self.rows = rows[order]
+        dates = dates[order]
+        amounts = invoices['amount'].values[self.rows].astype('float64')
+        types = invoices['type'].cat.codes.to_numpy()[self.rows]
+        names = invoices['type'].cat.categories
+
+        self.overall = _PrefixSeries(dates, amounts)
+        self.categories = {}
+        for code in np.unique(types):
+            match = types == code
+            self.categories[names[code]] = _PrefixSeries(dates[match], amounts[match])
+
+    def __len__(self):
+        return len(self.overall)
+
+    def series(self, category=None):
+        if category is None:
+            return self.overall
+        return self.categories.get(category, _EMPTY)
+
+    def window_rows(self, start=None, end=None):
+        """Positions in the invoice frame of the rows in [start, end], sorted by date"""
+        lo, hi = self.overall.bounds(start, end)
+        return self.rows[lo:hi]
+
+    def total(self, start=None, end=None, category=None):
+        """(spend, invoice count) in the inclusive window [start, end]"""
+        return self.series(category).total(start, end)
+
+    def totals_by_category(self, start=None, end=None):
+        totals = {}
+        for category, series in self.categories.items():
+            amount, count = series.total(start, end)
+            if count:
+                totals[category] = amount
+        return totals
+
+    def resample(self, freq, start=None, end=None, category=None, label='end'):
+        return self.series(category).resample(freq, start, end, label)
+
+    def category_matrix(self, categories, freq='M', label='start'):
+        """Totals per category and period, over the periods from the employee's first invoice to the last
+
+        Returns (labels, matrix) with a row of the matrix per category; a
+        category the employee has no invoices for is a row of zeros.
+        """
+        if not len(self):
+            return pd.DatetimeIndex([], name='date'), np.zeros((len(categories), 0))
+        edges, labels = _periods(self.overall.dates[0], self.overall.dates[-1], freq, label)
+        return labels, np.array([self.series(category).period_totals(edges) for category in categories])
+
+
+_FREQUENCIES = {('M', 'end'): 'ME', ('M', 'start'): 'MS', ('D', 'end'): 'D', ('D', 'start'): 'D'}
+
+_EMPTY = _PrefixSeries(np.array([], dtype='int32'), np.array([], dtype='float64'))
+
+
+def _periods(first_day, last_day, freq, label):
+    """Day numbers where the calendar periods from first_day to last_day start and end, and their labels"""
+    first, last = (pd.Timestamp(int(day), unit='D') for day in (first_day, last_day))
+    periods = pd.period_range(first, last, freq=freq)
+    edges = np.append(_days(periods.start_time), _days((periods[-1] + 1).start_time))
+    labels = periods.start_time if label == 'start' else periods.end_time.normalize()
+    # Keep the frequency on the index, as resample does; ARIMA needs it to forecast
+    return edges, pd.DatetimeIndex(labels, freq=_FREQUENCIES[freq, label], name='date')
+
+
+def _days(values):
+    """Timestamps to day numbers since 1970-01-01, like the invoice table's date column"""
+    return np.asarray(values, dtype='datetime64[ns]').astype('datetime64[D]').astype('int64')
+
+
+def _day(value):
+    return int(_days(pd.Timestamp(value).normalize().to_datetime64()))